@@ -3,18 +3,24 @@
 #DjangoUeditor Xadmin plugin
 
 import xadmin
+from django import forms
 from django.db.models import TextField
 from xadmin.views import BaseAdminPlugin, ModelFormAdminView, DetailAdminView
 from DjangoUeditor.models import UEditorField
+from DjangoUeditor import bundle
+from DjangoUeditor import settings as USettings
 from DjangoUeditor.widgets import UEditorWidget
-from django.conf import settings
 
 class XadminUEditorWidget(UEditorWidget):
     def __init__(self,**kwargs):
         self.ueditor_settings=kwargs
-        self.Media.js = None
         super(XadminUEditorWidget, self).__init__(kwargs)
 
+    @property
+    def media(self):
+        # 脚本由UeditorPlugin在页面头部引入
+        return forms.Media()
+
 class UeditorPlugin(BaseAdminPlugin):
 
     def get_field_style(self, attrs, db_field, style, **kwargs):
@@ -26,8 +32,14 @@ class UeditorPlugin(BaseAdminPlugin):
         return attrs
 
     def block_extrahead(self, context, nodes):
-        js = '<script type="text/javascript" src="%s"></script>' % (settings.STATIC_URL + "ueditor/ueditor.config.js")
-        js += '<script type="text/javascript" src="%s"></script>' % (settings.STATIC_URL + "ueditor/ueditor.all.min.js")
+        if USettings.GetUeditorSettings("lazyLoad", ""):
+            # 延迟加载时由编辑器模板在需要时加载脚本，只在配置了preload时提前下载
+            if USettings.GetUeditorSettings("preload", False):
+                nodes.append("".join('<link rel="preload" href="%s" as="script">' % js
+                                     for js in bundle.get_js_urls()))
+            return
+        js = "".join('<script type="text/javascript" src="%s"></script>' % js
+                     for js in bundle.get_js_urls())
         nodes.append(js)
 
 xadmin.site.register_plugin(UeditorPlugin, DetailAdminView)
@@ -0,0 +1,152 @@
+# coding:utf-8
+# 静态文件包：ueditor_build_static生成的带内容散列的目录，页面使用其中的地址，浏览器和代理可以永久缓存
+import io
+import os
+import re
+import json
+import hashlib
+from django.conf import settings
+from . import settings as USettings
+
+# ueditor的脚本，相对于ueditor目录
+UEDITOR_JS = ("ueditor.config.js", "ueditor.all.min.js")
+# 工具栏按钮使用的对话框目录，见ueditor.all.js中的iframeUrlMap
+DIALOGS = {
+    "anchor": "anchor",
+    "insertimage": "image",
+    "link": "link",
+    "spechars": "spechars",
+    "searchreplace": "searchreplace",
+    "map": "map",
+    "gmap": "gmap",
+    "insertvideo": "video",
+    "help": "help",
+    "preview": "preview",
+    "emotion": "emotion",
+    "wordimage": "wordimage",
+    "attachment": "attachment",
+    "insertframe": "insertframe",
+    "webapp": "webapp",
+    "snapscreen": "snapscreen",
+    "scrawl": "scrawl",
+    "music": "music",
+    "template": "template",
+    "background": "background",
+    "charts": "charts",
+}
+# 与工具栏无关、总是需要的对话框(表格的右键菜单)
+ALWAYS_DIALOGS = ["table"]
+# 不需要发布的文件：示例、php后端、未压缩的脚本和source map
+EXCLUDE_PATTERN = re.compile(
+    r"^(_examples/|php/|index\.html$|UEditorSnapscreen\.exe$|ueditor\.all\.js$|ueditor\.parse\.js$"
+    r"|third-party/jquery-1\.10\.2\.js$)|\.map$")
+# 引用的第三方库，如../../third-party/webuploader/webuploader.min.js
+THIRD_PARTY_PATTERN = re.compile(r"third-party/([A-Za-z0-9_.-]+)")
+# 需要生成预压缩版本的文件类型
+COMPRESS_TYPES = (".js", ".css", ".html", ".htm", ".json", ".svg", ".txt", ".xml")
+
+# 已读取的清单，只在第一次使用时读取
+_manifest = []
+
+
+def get_source_root():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "ueditor")
+
+
+def get_manifest_file():
+    """清单文件，默认为STATIC_ROOT/ueditor.manifest.json"""
+    manifest_file = USettings.GetUeditorSettings("staticManifest", "")
+    if not manifest_file and settings.STATIC_ROOT:
+        manifest_file = os.path.join(settings.STATIC_ROOT, "ueditor.manifest.json")
+    return manifest_file
+
+
+def get_manifest():
+    """读取ueditor_build_static生成的清单，没有生成时返回None"""
+    if not _manifest:
+        manifest = None
+        manifest_file = get_manifest_file()
+        if manifest_file and os.path.exists(manifest_file):
+            with io.open(manifest_file, encoding="utf-8") as f:
+                manifest = json.load(f)
+        _manifest.append(manifest)
+    return _manifest[0]
+
+
+def reset_manifest():
+    del _manifest[:]
+
+
+def get_home_url():
+    """ueditor目录的URL，生成了静态文件包时为带散列的目录"""
+    manifest = get_manifest()
+    if manifest:
+        return settings.STATIC_URL + manifest["path"] + "/"
+    return settings.STATIC_URL + "ueditor/"
+
+
+def get_js_urls():
+    home_url = get_home_url()
+    return [home_url + name for name in UEDITOR_JS]
+
+
+def get_buttons(toolbars):
+    """工具栏配置(模式名称或按钮列表)中的全部按钮，"full"返回None表示全部"""
+    if not isinstance(toolbars, (list, tuple)):
+        if toolbars not in USettings.TOOLBARS_SETTINGS:
+            return None
+        toolbars = USettings.TOOLBARS_SETTINGS[toolbars]
+    buttons = set()
+    for item in toolbars:
+        if isinstance(item, (list, tuple)):
+            buttons.update(item)
+        else:
+            buttons.add(item)
+    return buttons
+
+
+def get_dialogs(buttons):
+    """按钮使用的对话框目录，buttons为None时返回全部对话框"""
+    if buttons is None:
+        return sorted(set(DIALOGS.values()) | set(ALWAYS_DIALOGS))
+    return sorted(set(DIALOGS[button] for button in buttons if button in DIALOGS) | set(ALWAYS_DIALOGS))
+
+
+def list_files(dialogs, with_parse=False):
+    """
+    列出需要发布的文件(相对ueditor目录)：核心脚本、语言、主题、选中的对话框，以及它们引用的第三方库
+    """
+    root = get_source_root()
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, "/")
+            if not EXCLUDE_PATTERN.search(path):
+                files.append(path)
+    if not with_parse:
+        files = [path for path in files if path != "ueditor.parse.min.js"]
+
+    def is_wanted(path, third_party):
+        if path.startswith("dialogs/"):
+            parts = path.split("/")
+            return len(parts) == 2 or parts[1] in dialogs
+        if path.startswith("third-party/"):
+            return path.split("/")[1] in third_party
+        return True
+
+    # 从保留的文件中找出引用的第三方库
+    third_party = set()
+    for path in files:
+        if path.endswith((".js", ".html")) and is_wanted(path, ()):
+            with io.open(os.path.join(root, path), encoding="utf-8", errors="ignore") as f:
+                third_party.update(THIRD_PARTY_PATTERN.findall(f.read()))
+    return [path for path in files if is_wanted(path, third_party)]
+
+
+def file_digest(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
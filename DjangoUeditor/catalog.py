@@ -0,0 +1,124 @@
+# coding:utf-8
+# 上传文件目录：记录上传到MEDIA_ROOT的文件，供list_files分页查询，避免每次遍历磁盘
+import os
+import re
+import time
+from . import storage
+from .models import MediaFile
+
+try:
+    from os import scandir
+except ImportError:
+    # Python2需要安装scandir包
+    from scandir import scandir
+
+
+def normalize_path(path_format):
+    """将输出路径统一为相对MEDIA_ROOT、以/分隔的形式"""
+    return path_format.replace("\\", "/").lstrip("/")
+
+
+def register_file(path_format, size=None, owner_id=None):
+    """登记一个已写入存储的文件,path_format为文件在存储中的名称,owner_id为上传的用户"""
+    path = normalize_path(path_format)
+    file_storage = storage.get_storage()
+    if storage.is_local(file_storage):
+        try:
+            st = os.stat(file_storage.path(path))
+        except OSError:
+            return None
+        size, mtime = st.st_size, st.st_mtime
+    else:
+        # 远程存储刚写入的文件，直接使用当前时间，避免再请求一次
+        size, mtime = file_storage.size(path) if size is None else size, time.time()
+    media_file, created = MediaFile.objects.update_or_create(path=path, defaults={
+        "ext": os.path.splitext(path)[1],
+        "size": size,
+        "mtime": mtime,
+        "owner_id": owner_id
+    })
+    return media_file
+
+
+def list_files(list_path, allow_types, start, size):
+    """按修改时间倒序分页列出list_path下的文件，返回(文件列表,总数)"""
+    queryset = MediaFile.objects.all()
+    prefix = normalize_path(list_path).rstrip("/")
+    if prefix:
+        queryset = queryset.filter(path__startswith=prefix + "/")
+    if len(allow_types) > 0:
+        queryset = queryset.filter(ext__in=allow_types)
+    total = queryset.count()
+    files = queryset.order_by("-mtime", "-id").values_list(
+        "path", "mtime", "thumbnail")[start:start + size]
+    return list(files), total
+
+
+def scan_tree(root, rel_path="", recursive=True):
+    """
+    用scandir遍历root/rel_path，直接使用DirEntry自带的stat结果，
+    生成(相对MEDIA_ROOT的路径,大小,修改时间)，跳过以.开头的文件和目录
+    """
+    for entry in scandir(os.path.join(root, rel_path) if rel_path else root):
+        if entry.name.startswith("."):
+            continue
+        path = rel_path + "/" + entry.name if rel_path else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if recursive:
+                for item in scan_tree(root, path):
+                    yield item
+        elif entry.is_file():
+            st = entry.stat()
+            yield path, st.st_size, st.st_mtime
+
+
+def sync_tree(root, rel_path="", recursive=True, prune=False, batch_size=1000):
+    """
+    将root/rel_path下的文件与上传文件目录对账，只写入新增和大小、修改时间有变化的记录
+    recursive为False时只处理rel_path下的文件，不进入子目录
+    返回(扫描文件数,新增数,更新数,删除数)
+    """
+    return sync_files(scan_tree(root, rel_path, recursive), rel_path, recursive, prune, batch_size)
+
+
+def sync_files(files, rel_path="", recursive=True, prune=False, batch_size=1000):
+    """
+    用scan_tree(root, rel_path, recursive)的结果files更新上传文件目录，返回值与sync_tree相同
+    扫描可以在其它线程中进行，数据库只由调用这个函数的线程写入
+    """
+    queryset = MediaFile.objects.all()
+    if rel_path:
+        queryset = queryset.filter(path__startswith=rel_path + "/")
+    if not recursive:
+        # 只取本层文件，子目录由其它任务负责
+        queryset = queryset.exclude(
+            path__regex=r"^%s[^/]*/" % re.escape(rel_path + "/" if rel_path else ""))
+    known = dict((path, (size, mtime)) for path, size, mtime in
+                 queryset.values_list("path", "size", "mtime").iterator())
+
+    scanned = created = updated = 0
+    new_files = []
+    for path, size, mtime in files:
+        scanned += 1
+        old = known.pop(path, None)
+        if old is None:
+            new_files.append(MediaFile(
+                path=path, ext=os.path.splitext(path)[1], size=size, mtime=mtime))
+            if len(new_files) >= batch_size:
+                MediaFile.objects.bulk_create(new_files)
+                created += len(new_files)
+                new_files = []
+        elif old != (size, mtime):
+            MediaFile.objects.filter(path=path).update(size=size, mtime=mtime)
+            updated += 1
+    if new_files:
+        MediaFile.objects.bulk_create(new_files)
+        created += len(new_files)
+
+    deleted = 0
+    if prune and known:
+        missing = list(known)
+        for i in range(0, len(missing), batch_size):
+            deleted += MediaFile.objects.filter(
+                path__in=missing[i:i + batch_size]).delete()[0]
+    return scanned, created, updated, deleted
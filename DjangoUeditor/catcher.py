@@ -0,0 +1,218 @@
+# coding:utf-8
+# 远程抓图：并发下载远程图片，边下载边写入文件，超过大小限制立即中止
+import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from django.db.models import Count, Sum
+from django.utils import six
+from django.utils.six.moves.urllib.error import HTTPError
+from django.utils.six.moves.urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from django.utils.six.moves.urllib.request import Request, urlopen
+from . import settings as USettings
+from . import derivatives
+from . import quota
+from . import storage
+from .models import MediaFile, RemoteImage
+from .utils import FileSize
+
+if six.PY3:
+    long = int
+
+# 每次从网络读取的字节数
+CHUNK_SIZE = 64 * 1024
+
+
+class CatcherError(Exception):
+    pass
+
+
+class NotModified(Exception):
+    """远程服务器返回304，缓存的本地文件仍然有效"""
+    pass
+
+
+def fetch_remote_file(remote_url, filename, max_size=0, timeout=10, headers=None, size_error=None):
+    """
+    下载remote_url并流式写入filename，返回(写入的字节数,响应头)
+    max_size不为0时，超过该大小立即中止，size_error为此时的错误信息(如超出上传配额)
+    timeout为整个下载过程的超时秒数，headers为附加的请求头，如重新验证缓存时的If-None-Match
+    """
+    size_error = size_error or u"图片大小不允许超过%s" % FileSize(max_size).FriendValue
+    deadline = time.time() + timeout
+    try:
+        remote_file = urlopen(Request(remote_url, headers=headers or {}), timeout=timeout)
+    except HTTPError as E:
+        if E.code == 304:
+            raise NotModified()
+        raise
+    try:
+        info = remote_file.info()
+        length = info.get("Content-Length")
+        if max_size and length and length.isdigit() and long(length) > max_size:
+            raise CatcherError(size_error)
+        size = 0
+        try:
+            with open(filename, "wb") as f:
+                while True:
+                    chunk = remote_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise CatcherError(size_error)
+                    if time.time() > deadline:
+                        raise CatcherError(u"下载超时")
+                    f.write(chunk)
+        except Exception:
+            # 删除不完整的文件
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+        return size, info
+    finally:
+        remote_file.close()
+
+
+def fetch_one(remote_url, path_format, max_size, timeout, headers=None, size_error=None):
+    """
+    下载一个远程文件并保存到存储中，返回(状态,大小,响应头,保存的文件名)
+    远程文件未修改时状态为NOT_MODIFIED
+    """
+    tmp_filename = storage.get_temp_filename(os.path.splitext(path_format)[1])
+    try:
+        size, info = fetch_remote_file(remote_url, tmp_filename, max_size, timeout, headers, size_error)
+        return "SUCCESS", size, info, storage.save_local_file(path_format, tmp_filename)
+    except NotModified:
+        return "NOT_MODIFIED", 0, None, path_format
+    except Exception as E:
+        return u"抓取图片错误：%s" % E, 0, None, path_format
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def fetch_all(jobs, max_size=0, timeout=10, concurrency=4, size_error=None):
+    """
+    并发下载多个远程文件并保存到存储中，jobs为[(remote_url, path_format, headers),...]
+    按jobs的顺序返回[(状态,大小,响应头,保存的文件名),...]
+    """
+    if len(jobs) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(jobs)), 1)) as executor:
+        futures = [executor.submit(fetch_one, remote_url, path_format, max_size, timeout, headers, size_error)
+                   for remote_url, path_format, headers in jobs]
+        return [future.result() for future in futures]
+
+
+# 抓图缓存
+
+
+def normalize_url(remote_url):
+    """规范化远程地址：协议和域名小写，去掉默认端口和#片段，查询参数排序"""
+    parts = urlsplit(remote_url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def url_hash(remote_url):
+    return hashlib.sha1(normalize_url(remote_url).encode("utf-8")).hexdigest()
+
+
+def get_cached_images(remote_urls):
+    """取得已缓存且本地文件仍存在的远程图片，返回{remote_url: RemoteImage}"""
+    hashes = dict((url_hash(remote_url), remote_url) for remote_url in remote_urls)
+    cached = {}
+    for image in RemoteImage.objects.filter(url_hash__in=list(hashes)):
+        if storage.get_storage().exists(image.path):
+            cached[hashes[image.url_hash]] = image
+    return cached
+
+
+def is_fresh(image, now=None):
+    """在catcherCacheTTL秒内验证过的缓存无需再次请求远程服务器"""
+    now = now or time.time()
+    return now - image.checked_time < USettings.GetUeditorSettings("catcherCacheTTL", 86400)
+
+
+def revalidate_headers(image):
+    """生成重新验证缓存用的条件请求头"""
+    headers = {}
+    if image.etag:
+        headers["If-None-Match"] = image.etag
+    if image.last_modified:
+        headers["If-Modified-Since"] = image.last_modified
+    return headers
+
+
+def touch_cached_images(images, revalidated=False):
+    """更新缓存的最近使用时间，revalidated为True时同时更新验证时间"""
+    if len(images) == 0:
+        return
+    now = time.time()
+    values = {"last_used": now}
+    if revalidated:
+        values["checked_time"] = now
+    RemoteImage.objects.filter(pk__in=[image.pk for image in images]).update(**values)
+
+
+def cache_image(remote_url, path, size, info):
+    """记录远程地址与本地文件的对应关系"""
+    now = time.time()
+    RemoteImage.objects.update_or_create(url_hash=url_hash(remote_url), defaults={
+        "url": remote_url,
+        "path": path.replace("\\", "/").lstrip("/"),
+        "etag": (info and info.get("ETag")) or "",
+        "last_modified": (info and info.get("Last-Modified")) or "",
+        "size": size,
+        "checked_time": now,
+        "last_used": now
+    })
+
+
+def evict_cached_images():
+    """
+    缓存条数超过catcherCacheMaxEntries或文件总大小超过catcherCacheMaxSize时，淘汰最久未使用的记录
+    淘汰的文件及其缩略图从存储中删除，同时从上传文件目录和上传配额中去掉，返回淘汰的记录数
+    """
+    max_entries = USettings.GetUeditorSettings("catcherCacheMaxEntries", 10000)
+    max_size = USettings.GetUeditorSettings("catcherCacheMaxSize", 1024 * 1024 * 1024)
+    totals = RemoteImage.objects.aggregate(count=Count("pk"), size=Sum("size"))
+    count, total = totals["count"], totals["size"] or 0
+    evicted = []
+    for pk, path, size in RemoteImage.objects.order_by("last_used", "id").values_list(
+            "pk", "path", "size").iterator():
+        if count <= max_entries and total <= max_size:
+            break
+        count -= 1
+        total -= size
+        # 同时淘汰时只由删除了记录的请求删除文件
+        if RemoteImage.objects.filter(pk=pk).delete()[0]:
+            evicted.append(path)
+    if evicted:
+        delete_files(evicted)
+    return len(evicted)
+
+
+def delete_files(paths):
+    """删除抓取保存的文件和缩略图，并去掉上传文件目录中的记录和占用的配额"""
+    file_storage = storage.get_storage()
+    thumbnails = {}
+    released = []
+    for pk, path, thumbnail, owner_id, size in MediaFile.objects.filter(path__in=paths).values_list(
+            "pk", "path", "thumbnail", "owner_id", "size"):
+        thumbnails[path] = thumbnail
+        if MediaFile.objects.filter(pk=pk).delete()[0]:
+            released.append((owner_id, size))
+    quota.release_files(released)
+    for path in paths:
+        try:
+            file_storage.delete(path)
+            for derivative in derivatives.derivative_paths(path, thumbnails.get(path, "")):
+                file_storage.delete(derivative)
+        except (IOError, OSError):
+            pass
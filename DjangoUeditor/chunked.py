@@ -0,0 +1,205 @@
+# coding:utf-8
+# 分块上传：大文件按编号分块上传到暂存目录，支持断点续传，全部收到后拼接为最终文件
+import os
+import re
+import json
+import shutil
+import time
+import tempfile
+from . import settings as USettings
+
+# 上传ID只允许字母、数字、下划线和减号，防止路径穿越
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+# 每次拼接复制的最大字节数
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+# 拼接锁的超时时间(秒)，拼接的进程异常退出后，超时的锁可以被下一个请求取得
+ASSEMBLE_LOCK_TIMEOUT = 600
+
+
+class ChunkError(Exception):
+    pass
+
+
+def get_staging_root():
+    """
+    分块暂存目录，默认为tempPath(未设置时为系统临时目录)下的ueditor_chunks
+    不放在MEDIA_ROOT中，未拼接的分块不能被直接下载
+    """
+    staging_root = USettings.GetUeditorSettings("chunkStagingPath", "")
+    if staging_root:
+        return staging_root
+    return os.path.join(USettings.GetUeditorSettings("tempPath", "") or tempfile.gettempdir(), "ueditor_chunks")
+
+
+def get_staging_path(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+        raise ChunkError(u"上传ID不正确")
+    return os.path.join(get_staging_root(), upload_id)
+
+
+def chunk_filename(staging_path, index):
+    return os.path.join(staging_path, "%08d.part" % index)
+
+
+def load_meta(staging_path):
+    try:
+        with open(os.path.join(staging_path, "meta.json")) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_meta(staging_path, meta):
+    """首个分块到达时保存上传信息，之后的分块必须与之一致"""
+    old_meta = load_meta(staging_path)
+    if old_meta is not None:
+        if old_meta != meta:
+            raise ChunkError(u"分块信息与之前的上传不一致")
+        return
+    tmp_filename = os.path.join(staging_path, "meta.json.tmp")
+    with open(tmp_filename, "w") as f:
+        json.dump(meta, f)
+    os.rename(tmp_filename, os.path.join(staging_path, "meta.json"))
+
+
+def received_chunks(staging_path):
+    """返回已收到的分块{编号:大小}"""
+    chunks = {}
+    if not os.path.isdir(staging_path):
+        return chunks
+    for name in os.listdir(staging_path):
+        if name.endswith(".part"):
+            chunks[int(name[:-5])] = os.path.getsize(os.path.join(staging_path, name))
+    return chunks
+
+
+def staged_size(staging_path):
+    """返回(上传用户id,已暂存的字节数)"""
+    meta = load_meta(staging_path) or {}
+    return meta.get("owner"), sum(received_chunks(staging_path).values())
+
+
+def staged_usage():
+    """所有未完成的分块上传暂存的字节数[(上传用户id,字节数),...]，与已保存的文件一样计入上传配额"""
+    staging_root = get_staging_root()
+    if not os.path.isdir(staging_root):
+        return []
+    return [staged_size(os.path.join(staging_root, name)) for name in os.listdir(staging_root)
+            if UPLOAD_ID_PATTERN.match(name)]
+
+
+def sweep(max_age, dry_run=False):
+    """
+    删除超过max_age秒没有收到分块的暂存目录，返回[(上传ID,上传用户id,字节数),...]
+    暂存的字节数已计入配额，调用者需从用量中减去
+    """
+    staging_root = get_staging_root()
+    if not os.path.isdir(staging_root):
+        return []
+    cutoff = time.time() - max_age
+    swept = []
+    for name in os.listdir(staging_root):
+        staging_path = os.path.join(staging_root, name)
+        if not UPLOAD_ID_PATTERN.match(name) or not os.path.isdir(staging_path):
+            continue
+        try:
+            mtime = max([os.path.getmtime(staging_path)] + [
+                os.path.getmtime(os.path.join(staging_path, entry)) for entry in os.listdir(staging_path)])
+        except OSError:
+            # 正在拼接或已被删除
+            continue
+        if mtime >= cutoff:
+            continue
+        owner_id, size = staged_size(staging_path)
+        if not dry_run:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        swept.append((name, owner_id, size))
+    return swept
+
+
+def save_chunk(staging_path, index, PostFile):
+    """写入一个分块，先写临时文件再改名，保证已收到的分块总是完整的"""
+    filename = chunk_filename(staging_path, index)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        for chunk in PostFile.chunks():
+            f.write(chunk)
+    os.rename(tmp_filename, filename)
+
+
+def copy_file_data(src, dst, count):
+    """
+    将src的count个字节追加到dst，依次尝试copy_file_range、sendfile，
+    数据在内核中复制，不经过用户空间；都不支持时退回普通复制
+    """
+    for name in ("copy_file_range", "sendfile"):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        copied = 0
+        try:
+            while copied < count:
+                if name == "sendfile":
+                    sent = func(dst.fileno(), src.fileno(), copied, min(count - copied, COPY_BLOCK_SIZE))
+                else:
+                    sent = func(src.fileno(), dst.fileno(), min(count - copied, COPY_BLOCK_SIZE), copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            if copied > 0:
+                raise
+            continue
+        if copied != count:
+            raise ChunkError(u"分块文件长度不正确")
+        return
+    shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+
+
+def acquire_assemble_lock(lock_path):
+    """取得拼接锁，锁已超时时先删除"""
+    try:
+        os.mkdir(lock_path)
+        return True
+    except OSError:
+        pass
+    try:
+        if time.time() - os.path.getmtime(lock_path) < ASSEMBLE_LOCK_TIMEOUT:
+            return False
+        os.rmdir(lock_path)
+        os.mkdir(lock_path)
+        return True
+    except OSError:
+        return False
+
+
+def assemble(staging_path, chunks, filename):
+    """
+    全部分块收到后拼接为filename并删除暂存目录，返回文件大小
+    并发到达的最后几个分块中只有一个请求执行拼接，其余返回None
+    拼接失败时删除锁和写了一半的文件，重新上传最后的分块可以再次拼接
+    """
+    lock_path = os.path.join(staging_path, ".assembling")
+    if not acquire_assemble_lock(lock_path):
+        return None
+    tmp_filename = filename + ".part"
+    try:
+        with open(tmp_filename, "wb") as dst:
+            for index in range(chunks):
+                with open(chunk_filename(staging_path, index), "rb") as src:
+                    # 内核复制直接写入文件描述符，需先写出缓冲区中的数据
+                    dst.flush()
+                    copy_file_data(src, dst, os.fstat(src.fileno()).st_size)
+            dst.flush()
+            size = dst.tell()
+        os.rename(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        try:
+            os.rmdir(lock_path)
+        except OSError:
+            pass
+        raise
+    shutil.rmtree(staging_path, ignore_errors=True)
+    return size
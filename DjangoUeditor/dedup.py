@@ -0,0 +1,87 @@
+# coding:utf-8
+# 按内容去重保存上传文件：边写入边计算sha1，内容已存在时返回已有文件
+# 引用次数由引用文件的内容(如news.ArticleMedia)统计，引用次数大于0的文件ueditor_gc不会删除
+import os
+import time
+import hashlib
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from . import catalog
+from . import storage
+from .models import MediaBlob, MediaFile
+
+
+def save_upload_file(PostFile, path_format):
+    """
+    保存上传文件，path_format为文件在存储中的名称
+    返回(状态,实际使用的文件名称,是否写入了新文件)
+    """
+    path_format = catalog.normalize_path(path_format)
+    tmp_filename = storage.get_temp_filename(os.path.splitext(path_format)[1])
+    sha1 = hashlib.sha1()
+    size = 0
+    try:
+        with open(tmp_filename, "wb") as f:
+            for chunk in PostFile.chunks():
+                sha1.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception as E:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return u"写入文件错误:%s" % E, path_format, False
+
+    digest = sha1.hexdigest()
+    blob = reuse_blob(digest)
+    if blob is not None:
+        os.remove(tmp_filename)
+        return u"SUCCESS", blob.path, False
+
+    path_format = storage.save_local_file(path_format, tmp_filename)
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(sha1=digest, path=path_format, size=size, refcount=0)
+    except IntegrityError:
+        # 相同内容的文件被并发上传，保留先登记的那一份
+        blob = reuse_blob(digest)
+        if blob is not None:
+            storage.get_storage().delete(path_format)
+            return u"SUCCESS", blob.path, False
+    return u"SUCCESS", path_format, True
+
+
+def reuse_blob(digest):
+    """
+    内容为digest的文件已存在时返回其登记记录，否则返回None
+    已有文件在编辑器中被再次使用，刷新其目录中的修改时间，ueditor_gc的保留期从此时重新计算
+    """
+    blob = MediaBlob.objects.filter(sha1=digest).first()
+    if blob is None:
+        return None
+    if not storage.get_storage().exists(blob.path):
+        # 文件已被删除，登记记录失效
+        blob.delete()
+        return None
+    MediaFile.objects.filter(path=blob.path).update(mtime=time.time())
+    return blob
+
+
+def release_blobs(paths):
+    """内容中去掉了对paths的引用，按内容去重保存的文件引用次数减1"""
+    paths = [catalog.normalize_path(path) for path in paths]
+    if paths:
+        MediaBlob.objects.filter(path__in=paths, refcount__gt=0).update(refcount=F("refcount") - 1)
+
+
+def set_refcounts(counts):
+    """按内容中的引用重新统计后设置引用次数，counts为{路径: 引用次数}"""
+    paths_by_count = {}
+    for path, count in counts.items():
+        paths_by_count.setdefault(count, []).append(path)
+    for count, paths in paths_by_count.items():
+        MediaBlob.objects.filter(path__in=[catalog.normalize_path(path) for path in paths]).update(refcount=count)
+
+
+def referenced_blobs(paths):
+    """paths中仍被引用(引用次数大于0)的按内容去重保存的文件，返回集合"""
+    return set(MediaBlob.objects.filter(path__in=list(paths), refcount__gt=0).values_list("path", flat=True))
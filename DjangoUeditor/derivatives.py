@@ -0,0 +1,120 @@
+# coding:utf-8
+# 图片衍生文件：上传成功后登记任务，由ueditor_derivatives命令在进程池中生成缩略图和WebP
+import os
+import time
+from . import settings as USettings
+from . import storage
+from .models import DerivativeJob, MediaFile
+
+# 衍生文件保存在原图所在目录下的.thumbs目录中，以.开头的目录不会被登记到上传文件目录
+DERIVATIVE_DIR = ".thumbs"
+# 可以生成缩略图的图片类型
+IMAGE_TYPES = [".png", ".jpg", ".jpeg", ".gif", ".bmp"]
+
+
+def enqueue(path_format):
+    """登记一个生成缩略图的任务，未启用、不是本地存储或不是图片时不登记"""
+    if not USettings.GetUeditorSettings("derivativeEnable", False) or not storage.is_local():
+        return None
+    path = path_format.replace("\\", "/").lstrip("/")
+    if os.path.splitext(path)[1].lower() not in IMAGE_TYPES:
+        return None
+    return DerivativeJob.objects.create(path=path)
+
+
+def derivative_path(path, width, height, ext=None):
+    """取得衍生文件的路径，如uploads/a.png的200x200缩略图为uploads/.thumbs/a_200x200.png"""
+    dirname, filename = os.path.split(path)
+    basename, original_ext = os.path.splitext(filename)
+    return "/".join(filter(None, [
+        dirname, DERIVATIVE_DIR, "%s_%dx%d%s" % (basename, width, height, ext or original_ext)]))
+
+
+def derivative_paths(path, thumbnail=""):
+    """
+    path可能存在的全部衍生文件：thumbnailSizes中每个尺寸的原格式和WebP缩略图
+    thumbnail为目录中记录的缩略图，修改thumbnailSizes之前生成的也包括在内
+    """
+    paths = [thumbnail] if thumbnail else []
+    for width, height in USettings.GetUeditorSettings("thumbnailSizes", [[200, 200]]):
+        for ext in (None, ".webp"):
+            derivative = derivative_path(path, width, height, ext)
+            if derivative not in paths:
+                paths.append(derivative)
+    return paths
+
+
+def make_derivatives(media_root, path, sizes, webp):
+    """
+    为media_root/path生成各尺寸的缩略图，webp为True时同时生成WebP格式
+    在进程池中执行，不访问数据库，返回生成的第一个缩略图的路径
+    """
+    from PIL import Image
+
+    # Pillow编译时没有libwebp时不能保存WebP，只生成原格式的缩略图
+    Image.init()
+    webp = webp and "WEBP" in Image.SAVE
+    image = Image.open(os.path.join(media_root, path))
+    image.load()
+    thumbnail = ""
+    for width, height in sizes:
+        thumb = image.copy()
+        thumb.thumbnail((width, height), Image.LANCZOS if hasattr(Image, "LANCZOS") else Image.ANTIALIAS)
+        outputs = [(derivative_path(path, width, height), image.format)]
+        if webp:
+            outputs.append((derivative_path(path, width, height, ".webp"), "WEBP"))
+        for output_path, output_format in outputs:
+            filename = os.path.join(media_root, output_path)
+            if not os.path.exists(os.path.dirname(filename)):
+                try:
+                    os.makedirs(os.path.dirname(filename))
+                except OSError:
+                    pass
+            output = thumb
+            if output_format == "JPEG" and output.mode not in ("RGB", "L"):
+                output = output.convert("RGB")
+            elif output_format == "WEBP" and output.mode not in ("RGB", "RGBA"):
+                output = output.convert("RGBA")
+            # 先写临时文件再改名，避免读到不完整的缩略图
+            tmp_filename = filename + ".tmp"
+            output.save(tmp_filename, output_format)
+            os.rename(tmp_filename, filename)
+        thumbnail = thumbnail or derivative_path(path, width, height)
+    return thumbnail
+
+
+def claim_jobs(limit):
+    """取出一批待处理的任务并标记为处理中"""
+    pks = list(DerivativeJob.objects.filter(
+        status=DerivativeJob.STATUS_PENDING).order_by("id").values_list("pk", flat=True)[:limit])
+    if not pks:
+        return []
+    # 逐个把状态从待处理改为处理中，更新成功的才归本进程处理，避免多个worker重复处理
+    now = time.time()
+    claimed = [pk for pk in pks if DerivativeJob.objects.filter(
+        pk=pk, status=DerivativeJob.STATUS_PENDING).update(status=DerivativeJob.STATUS_RUNNING, claimed_time=now)]
+    return list(DerivativeJob.objects.filter(pk__in=claimed).order_by("id"))
+
+
+def requeue_expired_jobs(lease):
+    """
+    处理中超过lease秒的任务重新排队，返回重新排队的任务数
+    这些任务的worker已经退出，仍在租期内的任务可能正由其他worker处理，不能重新排队
+    """
+    return DerivativeJob.objects.filter(
+        status=DerivativeJob.STATUS_RUNNING, claimed_time__lt=time.time() - lease).update(
+        status=DerivativeJob.STATUS_PENDING)
+
+
+def finish_job(job, thumbnail=None, error=None, max_attempts=3):
+    """记录任务结果，成功时把缩略图登记到上传文件目录"""
+    job.attempts += 1
+    if error is None:
+        job.status = DerivativeJob.STATUS_DONE
+        job.error = ""
+        if thumbnail:
+            MediaFile.objects.filter(path=job.path).update(thumbnail=thumbnail)
+    else:
+        job.status = DerivativeJob.STATUS_FAILED if job.attempts >= max_attempts else DerivativeJob.STATUS_PENDING
+        job.error = error
+    job.save(update_fields=["status", "attempts", "error"])
@@ -0,0 +1,139 @@
+"""
+A management command which builds a cache-friendly copy of the UEditor
+static tree.
+
+Only the dialogs used by the configured toolbars (and the third-party
+libraries those dialogs reference) are kept; examples, the PHP backend
+and unminified sources are dropped.  The files are copied into
+``STATIC_ROOT/ueditor-<content hash>/`` with ``.gz`` (and ``.br`` when
+the ``brotli`` package is installed) variants for servers that support
+precompressed files, and ``ueditor.manifest.json`` records the directory.
+Widgets then load UEditor from the hashed directory, so every file can
+be served with a far-future ``Cache-Control``.  Run it after
+``collectstatic``.
+
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import bundle
+from ...models import UEditorField
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compress_file(filename):
+    """生成filename.gz和filename.br，压缩后没有变小时不生成，返回生成的字节数"""
+    with open(filename, "rb") as f:
+        data = f.read()
+    written = 0
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    variants = [(".gz", buf.getvalue())]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data)))
+    for ext, compressed in variants:
+        if len(compressed) < len(data):
+            with open(filename + ext, "wb") as f:
+                f.write(compressed)
+            written += len(compressed)
+    return written
+
+
+class Command(BaseCommand):
+    help = "Build a hashed, tree-shaken and precompressed copy of the UEditor static files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--toolbars", action="append", default=[],
+            help="Toolbar mode from TOOLBARS_SETTINGS, or 'full', to keep dialogs for; "
+                 "repeatable. Defaults to the toolbars of every UEditorField model field")
+        parser.add_argument(
+            "--output", default="",
+            help="Directory to write the bundle and manifest to, defaults to STATIC_ROOT")
+        parser.add_argument(
+            "--with-parse", action="store_true", default=False,
+            help="Also ship ueditor.parse.min.js and the libraries it loads")
+
+    def get_toolbars(self, options):
+        if options["toolbars"]:
+            return options["toolbars"]
+        toolbars = []
+        for model in apps.get_models():
+            for field in model._meta.fields:
+                if isinstance(field, UEditorField):
+                    toolbars.append(field.ueditor_settings.get("toolbars", "full"))
+        return toolbars or ["full"]
+
+    def handle(self, *args, **options):
+        output = options["output"] or settings.STATIC_ROOT
+        if not output:
+            raise CommandError("Set STATIC_ROOT or pass --output")
+
+        buttons = set()
+        for toolbars in self.get_toolbars(options):
+            toolbar_buttons = bundle.get_buttons(toolbars)
+            if toolbar_buttons is None:
+                buttons = None
+                break
+            buttons.update(toolbar_buttons)
+        dialogs = bundle.get_dialogs(buttons)
+        files = bundle.list_files(dialogs, options["with_parse"])
+
+        # 目录名由全部文件的路径和内容决定，任何文件变化都会生成新的目录
+        source_root = bundle.get_source_root()
+        digests = dict((path, bundle.file_digest(os.path.join(source_root, path))) for path in files)
+        version = hashlib.sha1("\n".join(
+            "%s %s" % (path, digests[path]) for path in files).encode("utf-8")).hexdigest()[:12]
+        dirname = "ueditor-%s" % version
+        dest_root = os.path.join(output, dirname)
+
+        size = compressed = 0
+        tmp_root = dest_root + ".tmp"
+        if os.path.isdir(dest_root):
+            self.stdout.write("%s is up to date" % dest_root)
+        else:
+            if os.path.isdir(tmp_root):
+                shutil.rmtree(tmp_root)
+            for path in files:
+                src = os.path.join(source_root, path)
+                dst = os.path.join(tmp_root, path)
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                shutil.copy2(src, dst)
+                size += os.path.getsize(dst)
+                if path.endswith(bundle.COMPRESS_TYPES):
+                    compressed += compress_file(dst)
+            # 全部写入后再改名，页面不会用到写了一半的目录
+            os.rename(tmp_root, dest_root)
+            self.stdout.write("Wrote %d files (%d bytes, %d bytes precompressed) to %s" % (
+                len(files), size, compressed, dest_root))
+
+        manifest = {
+            "version": version,
+            "path": dirname,
+            "dialogs": dialogs,
+            "files": digests
+        }
+        manifest_file = bundle.get_manifest_file() if not options["output"] else \
+            os.path.join(output, "ueditor.manifest.json")
+        with io.open(manifest_file + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest, indent=1, sort_keys=True, ensure_ascii=False))
+        os.rename(manifest_file + ".tmp", manifest_file)
+        bundle.reset_manifest()
+        self.stdout.write("Dialogs: %s" % ", ".join(dialogs))
+        self.stdout.write("Manifest written to %s; restart the application to use %s" % (
+            manifest_file, dirname))
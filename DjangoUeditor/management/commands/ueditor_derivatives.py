@@ -0,0 +1,75 @@
+"""
+A management command which generates thumbnails and WebP variants for
+images uploaded through UEditor.
+
+``UploadFile`` only records a ``DerivativeJob`` row after a successful
+image upload; this command picks pending jobs up and renders the
+derivatives in a process pool, outside of the request.  Several workers
+can share the queue.  A job still running longer than ``--lease`` seconds
+after it was claimed is assumed to belong to a worker that stopped and is
+put back in the queue, so restarts do not lose work while jobs held by
+live workers are left alone.
+
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import derivatives
+from ... import settings as USettings
+from ... import storage
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and WebP variants for uploaded images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=2,
+            help="Number of worker processes")
+        parser.add_argument(
+            "--batch-size", type=int, default=50,
+            help="Number of jobs claimed at a time")
+        parser.add_argument(
+            "--interval", type=float, default=5,
+            help="Seconds to wait when the queue is empty")
+        parser.add_argument(
+            "--lease", type=float, default=600,
+            help="Seconds after which a running job is considered abandoned and requeued")
+        parser.add_argument(
+            "--once", action="store_true", default=False,
+            help="Exit when the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        try:
+            import PIL  # noqa
+        except ImportError:
+            raise CommandError("Pillow is required to generate thumbnails")
+
+        sizes = [tuple(size) for size in USettings.GetUeditorSettings("thumbnailSizes", [[200, 200]])]
+        webp = USettings.GetUeditorSettings("thumbnailWebp", True)
+        if not storage.is_local():
+            raise CommandError("Thumbnails can only be generated for a local storage")
+        media_root = storage.get_storage().path("")
+
+        with ProcessPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            while True:
+                # 退出的worker未完成的任务超过租期后重新排队
+                derivatives.requeue_expired_jobs(options["lease"])
+                jobs = derivatives.claim_jobs(options["batch_size"])
+                if not jobs:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+                    continue
+                futures = [executor.submit(derivatives.make_derivatives, media_root, job.path, sizes, webp)
+                           for job in jobs]
+                for job, future in zip(jobs, futures):
+                    try:
+                        derivatives.finish_job(job, thumbnail=future.result())
+                    except Exception as e:
+                        derivatives.finish_job(job, error="%s" % e)
+                        self.stderr.write("%s: %s" % (job.path, e))
+                self.stdout.write("Processed %d jobs" % len(jobs))
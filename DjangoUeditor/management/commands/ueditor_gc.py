@@ -0,0 +1,193 @@
+"""
+A management command which removes uploads that no article references
+any more.
+
+Every ``UEditorField`` column (``news.Article.content`` among them) is
+streamed in primary-key batches and the media URLs are pulled out of the
+HTML by a compiled regular expression in a process pool.  Catalog rows
+(``DjangoUeditor.models.MediaFile``) older than the grace period whose
+path was never seen, and which are not deduplicated files with a non-zero
+reference count, are then moved to a quarantine directory, or deleted
+with ``--delete``.  The quarantine directory must be outside
+``MEDIA_ROOT`` so quarantined files can no longer be downloaded; it is
+``quarantinePath``, or ``ueditor_quarantine`` next to ``MEDIA_ROOT`` by
+default.  Run ``ueditor_sync_catalog`` first if files reach
+``MEDIA_ROOT`` outside of UEditor.  Chunked uploads abandoned for more
+than ``--chunk-days`` are removed from the staging directory as well.
+
+"""
+
+import os
+import shutil
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ... import catalog
+from ... import chunked
+from ... import dedup
+from ... import derivatives
+from ... import quota
+from ... import references
+from ... import storage
+from ... import settings as USettings
+from ...models import MediaBlob, MediaFile
+
+
+def get_quarantine_root(root):
+    """隔离目录，默认为MEDIA_ROOT旁边的ueditor_quarantine，不能通过MEDIA_URL下载"""
+    quarantine_root = USettings.GetUeditorSettings("quarantinePath", "")
+    if not quarantine_root:
+        quarantine_root = os.path.join(os.path.dirname(os.path.normpath(root)), "ueditor_quarantine")
+    return os.path.abspath(quarantine_root)
+
+
+def quarantine_file(root, quarantine_root, path):
+    """把文件移到隔离目录下的相同位置"""
+    dst = os.path.join(quarantine_root, path)
+    if not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    shutil.move(os.path.join(root, path), dst)
+
+
+class Command(BaseCommand):
+    help = "Quarantine or delete uploads that are not referenced by any UEditorField content"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default="",
+            help="Only collect files under this directory, relative to MEDIA_ROOT")
+        parser.add_argument(
+            "--grace-days", type=float, default=7,
+            help="Files modified more recently than this are always kept")
+        parser.add_argument(
+            "--chunk-days", type=float, default=2,
+            help="Remove chunked uploads that received no chunk for this many days")
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of processes extracting URLs")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of rows read per query")
+        parser.add_argument(
+            "--delete", action="store_true", default=False,
+            help="Delete unreferenced files instead of moving them to the quarantine directory")
+        parser.add_argument(
+            "--quarantine", default="",
+            help="Quarantine directory, defaults to the quarantinePath setting or "
+                 "ueditor_quarantine next to MEDIA_ROOT")
+        parser.add_argument(
+            "--dry-run", action="store_true", default=False,
+            help="Only report unreferenced files")
+
+    def handle(self, *args, **options):
+        local = storage.is_local()
+        if not options["delete"] and not options["dry_run"] and not local:
+            raise CommandError("Quarantine needs a local storage, use --delete instead")
+        batch_size = max(options["batch_size"], 1)
+        cutoff = time.time() - options["grace_days"] * 86400
+        self.sweep_chunks(options["chunk_days"] * 86400, options["dry_run"])
+
+        started = time.time()
+        referenced, rows = self.collect_references(max(options["workers"], 1), batch_size)
+        self.stdout.write("Found %d referenced files in %d rows in %.1fs" % (
+            len(referenced), rows, time.time() - started))
+
+        queryset = MediaFile.objects.filter(mtime__lt=cutoff)
+        base = catalog.normalize_path(options["path"]).rstrip("/")
+        if base:
+            queryset = queryset.filter(path__startswith=base + "/")
+
+        file_storage = storage.get_storage()
+        root = file_storage.path("") if local else None
+        quarantine_root = None
+        if not options["delete"] and not options["dry_run"]:
+            quarantine_root = os.path.abspath(options["quarantine"]) if options["quarantine"] \
+                else get_quarantine_root(root)
+            media_root = os.path.abspath(root)
+            if quarantine_root == media_root or quarantine_root.startswith(os.path.join(media_root, "")):
+                raise CommandError("The quarantine directory must not be inside MEDIA_ROOT, "
+                                   "files in it could still be downloaded")
+
+        # 按主键分批读取上传文件目录，每批处理完再读下一批，内存占用与文件数量无关
+        found = removed = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by("pk").values_list(
+                "pk", "path", "thumbnail", "owner_id", "size")[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            orphans = [row for row in rows if row[1] not in referenced]
+            # 按内容去重保存的文件仍有引用时保留，只靠内容扫描可能漏掉其他写法的引用
+            retained = dedup.referenced_blobs(row[1] for row in orphans)
+            orphans = [row for row in orphans if row[1] not in retained]
+            found += len(orphans)
+            if options["dry_run"]:
+                for pk, path, thumbnail, owner_id, size in orphans:
+                    self.stdout.write(path)
+                continue
+            done = []
+            for pk, path, thumbnail, owner_id, size in orphans:
+                try:
+                    # 各尺寸的缩略图和WebP在.thumbs目录中，不会被登记，随原图一起处理
+                    if options["delete"]:
+                        file_storage.delete(path)
+                        for derivative in derivatives.derivative_paths(path, thumbnail):
+                            file_storage.delete(derivative)
+                    else:
+                        quarantine_file(root, quarantine_root, path)
+                        for derivative in derivatives.derivative_paths(path, thumbnail):
+                            if os.path.exists(os.path.join(root, derivative)):
+                                quarantine_file(root, quarantine_root, derivative)
+                except (IOError, OSError) as e:
+                    self.stderr.write("%s: %s" % (path, e))
+                    continue
+                done.append((pk, path, owner_id, size))
+            removed += len(done)
+            MediaFile.objects.filter(pk__in=[item[0] for item in done]).delete()
+            MediaBlob.objects.filter(path__in=[item[1] for item in done]).delete()
+            quota.release_files([(owner_id, size) for pk, path, owner_id, size in done])
+
+        if options["dry_run"]:
+            self.stdout.write("%d unreferenced files" % found)
+        else:
+            self.stdout.write("%s %d unreferenced files" % (
+                "Deleted" if options["delete"] else "Quarantined to %s:" % quarantine_root, removed))
+
+    def sweep_chunks(self, max_age, dry_run):
+        """删除放弃的分块上传，并从用量中减去暂存的字节数"""
+        swept = chunked.sweep(max_age, dry_run)
+        for upload_id, owner_id, size in swept:
+            if dry_run:
+                self.stdout.write("chunks: %s (%d bytes)" % (upload_id, size))
+            elif size:
+                quota.release(owner_id, size, count=0)
+        self.stdout.write("%s %d abandoned chunked uploads" % ("Found" if dry_run else "Removed", len(swept)))
+
+    def collect_references(self, workers, batch_size):
+        """在进程池中提取所有UEditorField引用的文件路径，返回(路径集合,读取的行数)"""
+        prefix = references.get_url_prefix()
+        referenced = set()
+        rows = 0
+        # 创建进程之前关闭数据库连接，避免子进程继承同一个连接
+        connection.close()
+        pool = Pool(workers)
+        try:
+            pending = []
+            for model, field_name in references.get_editor_fields():
+                for batch in references.iter_contents(model, field_name, batch_size):
+                    rows += len(batch)
+                    pending.append(pool.apply_async(
+                        references.extract_paths, ([content for pk, content in batch], prefix)))
+                    # 限制排队的批次，内存占用与表的大小无关
+                    if len(pending) >= workers * 2:
+                        referenced.update(pending.pop(0).get())
+            for result in pending:
+                referenced.update(result.get())
+        finally:
+            pool.close()
+            pool.join()
+        return referenced, rows
@@ -0,0 +1,25 @@
+"""
+A management command which recomputes the upload usage counters
+(``DjangoUeditor.models.UploadUsage``) from the upload catalog.
+
+The counters are kept up to date incrementally on upload and by
+``ueditor_gc``; files removed by other means (``ueditor_sync_catalog
+--prune``, manual deletes) make them drift.  This replaces every counter
+with one grouped ``SUM``/``COUNT`` over the catalog.  Run
+``ueditor_sync_catalog`` first so the catalog matches the disk.
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from ... import quota
+
+
+class Command(BaseCommand):
+    help = "Recompute per-user and site upload usage from the upload catalog"
+
+    def handle(self, *args, **options):
+        usage = quota.reconcile()
+        size, count = usage[quota.SITE_KEY]
+        self.stdout.write("Site usage: %d files, %d bytes; %d users" % (
+            count, size, len(usage) - 1))
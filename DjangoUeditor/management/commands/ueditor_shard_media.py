@@ -0,0 +1,101 @@
+"""
+A management command which moves files out of a flat upload directory
+into the sharded ``YYYY/MM/DD/<hash prefix>/`` layout used when
+``defaultPathFormat`` is ``"sharded"``.
+
+Every move is appended to a journal next to the files, and after each
+batch the catalog, dedup and catcher-cache rows are updated.  Once every file is moved, the URLs in all
+``UEditorField`` columns (``news.Article.content`` among them) are
+rewritten in primary-key batches; each changed row is saved through the
+model, so ``auto_now`` fields and ``post_save`` handlers (page caches,
+reference tables, search indexes) see the new URLs.  The journal is read
+back on every run, so a run interrupted before the rewrite finishes can
+simply be repeated; it is deleted once the rewrite completes.
+
+"""
+
+import io
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import catalog
+from ... import references
+from ... import sharding
+from ... import storage
+
+JOURNAL_NAME = ".ueditor_shard.log"
+
+
+def read_journal(filename):
+    moved = {}
+    if os.path.exists(filename):
+        with io.open(filename, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 2:
+                    moved[parts[0]] = parts[1]
+    return moved
+
+
+class Command(BaseCommand):
+    help = "Move flat UEditor uploads into date/hash-prefix shard directories"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default="",
+            help="Directory to shard, relative to MEDIA_ROOT; subdirectories are left alone")
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of files moved, or rows rewritten, per transaction")
+        parser.add_argument(
+            "--dry-run", action="store_true", default=False,
+            help="Only report what would be moved")
+
+    def handle(self, *args, **options):
+        if not storage.is_local():
+            raise CommandError("Only files in a local storage can be sharded")
+        root = storage.get_storage().path("")
+        base = catalog.normalize_path(options["path"]).rstrip("/")
+        if not os.path.isdir(os.path.join(root, base)):
+            raise CommandError("%s is not a directory" % os.path.join(root, base))
+        batch_size = max(options["batch_size"], 1)
+        journal = os.path.join(root, JOURNAL_NAME)
+        moved = read_journal(journal)
+
+        count = skipped = 0
+        batch = {}
+        with io.open(journal, "a", encoding="utf-8") as log:
+            for path, size, mtime in catalog.scan_tree(root, base, recursive=False):
+                new_path = sharding.sharded_path(path, mtime)
+                if options["dry_run"]:
+                    self.stdout.write("%s -> %s" % (path, new_path))
+                    count += 1
+                    continue
+                if not sharding.move_file(root, path, new_path):
+                    self.stderr.write("%s already exists, %s not moved" % (new_path, path))
+                    skipped += 1
+                    continue
+                # 移动后立即记入日志，中断后重新运行仍能重写引用
+                log.write(u"%s\t%s\n" % (path, new_path))
+                batch[path] = new_path
+                if len(batch) >= batch_size:
+                    log.flush()
+                    sharding.update_records(batch)
+                    moved.update(batch)
+                    count += len(batch)
+                    batch = {}
+            if batch:
+                sharding.update_records(batch)
+                moved.update(batch)
+                count += len(batch)
+        if options["dry_run"]:
+            self.stdout.write("%d files would be moved" % count)
+            return
+        self.stdout.write("Moved %d files, skipped %d" % (count, skipped))
+
+        for model, field_name in references.get_editor_fields():
+            changed = sharding.rewrite_references(model, field_name, moved, batch_size)
+            self.stdout.write("Rewrote %d %s.%s rows" % (changed, model._meta.label, field_name))
+        # 引用已全部重写，之后的运行不必再重放这些移动
+        os.remove(journal)
@@ -0,0 +1,76 @@
+"""
+A management command which brings the UEditor upload catalog
+(``DjangoUeditor.models.MediaFile``) back in line with the files on disk.
+
+Files can reach ``MEDIA_ROOT`` without going through the UEditor
+controller (rsync, restores, a custom ``upload_module``).  This walks the
+tree with ``os.scandir``, one worker thread per top-level directory, and
+only writes catalog rows for files whose size or mtime changed since the
+last run.  The workers only scan; every catalog write is made by the
+main thread, so the database never sees concurrent writers.
+
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import catalog
+from ... import storage
+
+
+def scan_directory(root, rel_path, recursive):
+    # 在工作线程中只遍历磁盘，不访问数据库
+    return list(catalog.scan_tree(root, rel_path, recursive))
+
+
+class Command(BaseCommand):
+    help = "Reconcile the UEditor upload catalog with the files in MEDIA_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default="",
+            help="Only reconcile this directory, relative to MEDIA_ROOT")
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of top-level directories scanned in parallel")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of catalog rows written per query")
+        parser.add_argument(
+            "--prune", action="store_true", default=False,
+            help="Delete catalog rows whose file no longer exists")
+
+    def handle(self, *args, **options):
+        if not storage.is_local():
+            raise CommandError("The catalog can only be reconciled against a local storage")
+        root = storage.get_storage().path("")
+        base = catalog.normalize_path(options["path"]).rstrip("/")
+        if not os.path.isdir(os.path.join(root, base)):
+            self.stderr.write("%s is not a directory" % os.path.join(root, base))
+            return
+
+        # 本层文件作为一个任务，每个下级目录(通常为日期目录)各作为一个任务
+        jobs = [(base, False)]
+        for entry in catalog.scandir(os.path.join(root, base)):
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                jobs.append((base + "/" + entry.name if base else entry.name, True))
+
+        started = time.time()
+        totals = [0, 0, 0, 0]
+        with ThreadPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            futures = [executor.submit(scan_directory, root, rel_path, recursive)
+                       for rel_path, recursive in jobs]
+            # 各目录的扫描结果依次在本线程中写入，避免多个连接同时写库(SQLite会锁表)
+            for (rel_path, recursive), future in zip(jobs, futures):
+                result = catalog.sync_files(future.result(), rel_path, recursive,
+                                            options["prune"], options["batch_size"])
+                for i, value in enumerate(result):
+                    totals[i] += value
+
+        elapsed = max(time.time() - started, 0.001)
+        self.stdout.write(
+            "Scanned %d files in %.1fs (%.0f files/sec): %d added, %d updated, %d removed" % (
+                totals[0], elapsed, totals[0] / elapsed, totals[1], totals[2], totals[3]))
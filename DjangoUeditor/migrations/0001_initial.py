@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('ext', models.CharField(max_length=16)),
+                ('size', models.BigIntegerField(default=0)),
+                ('mtime', models.FloatField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='mediafile',
+            index_together=set([('mtime', 'id')]),
+        ),
+    ]
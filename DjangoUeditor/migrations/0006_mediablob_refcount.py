@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def reset_refcounts(apps, schema_editor):
+    # 以前记录的是上传次数，改为内容中的引用数，由backfill_article_media等重新计算
+    apps.get_model('DjangoUeditor', 'MediaBlob').objects.update(refcount=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DjangoUeditor', '0005_uploadusage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediablob',
+            name='refcount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(reset_refcounts, migrations.RunPython.noop),
+    ]
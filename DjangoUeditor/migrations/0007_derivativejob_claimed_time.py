@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DjangoUeditor', '0006_mediablob_refcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='derivativejob',
+            name='claimed_time',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -1,4 +1,5 @@
 #coding: utf-8
+from django.conf import settings
 from django.db import models
 from django.contrib.admin import widgets as admin_widgets
 from .widgets import UEditorWidget, AdminUEditorWidget
@@ -25,6 +26,110 @@ class UEditorField(models.TextField):
             defaults['widget'] = AdminUEditorWidget(attrs=self.ueditor_settings)
         return super(UEditorField, self).formfield(**defaults)
 
+
+class MediaFile(models.Model):
+    """
+    上传文件目录，记录通过UEditor写入MEDIA_ROOT的每一个文件
+        path:相对MEDIA_ROOT的路径,如"uploads/images/a.png"
+        ext:扩展名,如".png",用于按imageManagerAllowFiles/fileManagerAllowFiles过滤
+        size:文件大小,单位B
+        mtime:文件修改时间(时间戳),list_files按它倒序分页
+        thumbnail:缩略图相对MEDIA_ROOT的路径,由ueditor_derivatives命令生成
+        owner:上传文件的用户,计入该用户的上传配额
+    """
+    path = models.CharField(max_length=255, unique=True)
+    ext = models.CharField(max_length=16)
+    size = models.BigIntegerField(default=0)
+    mtime = models.FloatField()
+    thumbnail = models.CharField(max_length=255, blank=True, default="")
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                              on_delete=models.SET_NULL, related_name="+")
+
+    class Meta:
+        index_together = [("mtime", "id")]
+
+    def __str__(self):
+        return self.path
+
+
+class RemoteImage(models.Model):
+    """
+    远程抓图缓存，同一远程地址再次抓取时直接返回已保存的本地文件
+        url_hash:规范化后远程地址的sha1
+        path:本地文件相对MEDIA_ROOT的路径
+        etag,last_modified:远程服务器返回的ETag和Last-Modified,用于重新验证
+        checked_time:最近一次与远程服务器验证的时间(时间戳)
+        last_used:最近一次命中的时间(时间戳),超出条数限制时按它淘汰
+    """
+    url_hash = models.CharField(max_length=40, unique=True)
+    url = models.TextField()
+    path = models.CharField(max_length=255)
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    size = models.BigIntegerField(default=0)
+    checked_time = models.FloatField()
+    last_used = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return self.url
+
+
+class MediaBlob(models.Model):
+    """
+    按内容去重保存的上传文件(contentAddressed模式)
+        sha1:文件内容的sha1
+        path:保存的文件相对MEDIA_ROOT的路径
+        refcount:引用次数，内容(如news.ArticleMedia)中增加引用时加1，去掉引用时减1，为0时ueditor_gc才会删除文件
+    """
+    sha1 = models.CharField(max_length=40, unique=True)
+    path = models.CharField(max_length=255, db_index=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.path
+
+
+class DerivativeJob(models.Model):
+    """
+    图片缩略图/WebP生成任务，上传成功后登记，由ueditor_derivatives命令在后台处理
+        claimed_time:被worker取出的时间(时间戳)，超过租期仍在处理中的任务视为worker已退出，重新排队
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "pending"),
+        (STATUS_RUNNING, "running"),
+        (STATUS_DONE, "done"),
+        (STATUS_FAILED, "failed"),
+    )
+    path = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    claimed_time = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.path
+
+
+class UploadUsage(models.Model):
+    """
+    上传用量计数，写入和删除文件时原子地增减，检查配额时只需读取一行
+        key:"site"为全站用量,"user:<id>"为用户用量
+        size:已保存文件的总大小,单位B
+        count:已保存的文件数
+    """
+    key = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.key
+
 #以下支持south
 try:
     from south.modelsinspector import add_introspection_rules
@@ -0,0 +1,149 @@
+# coding:utf-8
+# 上传配额：按用户和全站累计已保存文件的大小，写入和删除文件时原子地增减计数，检查配额只需读取一行
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from . import chunked
+from . import settings as USettings
+from .models import MediaFile, UploadUsage
+from .utils import FileSize
+
+SITE_KEY = "site"
+
+# 已确认存在的计数行，避免每次上传都查询一次
+_known_keys = set()
+
+
+def user_key(owner_id):
+    return "user:%s" % owner_id
+
+
+def get_owner_id(request):
+    """上传文件的用户，未登录时返回None，只计入全站用量"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
+
+
+def get_limits(owner_id):
+    """返回[(计数键,配额),...]，配额为0表示不限制"""
+    limits = [(SITE_KEY, USettings.GetUeditorSettings("siteQuota", 0))]
+    if owner_id is not None:
+        limits.append((user_key(owner_id), USettings.GetUeditorSettings("userQuota", 0)))
+    return limits
+
+
+def ensure_usage(key):
+    if key in _known_keys:
+        return
+    if not UploadUsage.objects.filter(key=key).exists():
+        try:
+            with transaction.atomic():
+                UploadUsage.objects.create(key=key)
+        except IntegrityError:
+            # 被并发的请求创建
+            pass
+    _known_keys.add(key)
+
+
+def quota_error(limit):
+    return u"上传空间不足，最多允许保存%s的文件。" % FileSize(limit).FriendValue
+
+
+def remaining(owner_id):
+    """返回(剩余字节数,配额)，有多项配额时取剩余最少的一项，都不限制时返回None"""
+    limits = dict((key, limit) for key, limit in get_limits(owner_id) if limit)
+    if not limits:
+        return None
+    used = dict(UploadUsage.objects.filter(key__in=list(limits)).values_list("key", "size"))
+    return min((limit - used.get(key, 0), limit) for key, limit in limits.items())
+
+
+def check(owner_id, size):
+    """只检查不计入，用于分块上传开始时和远程抓图下载时提前拒绝，返回错误信息，未超出时返回None"""
+    left = remaining(owner_id)
+    if left is not None and size > left[0]:
+        return quota_error(left[1])
+    return None
+
+
+def charge(owner_id, size, count=1):
+    """
+    把count个共size字节的文件计入用户和全站用量，返回错误信息，成功时返回None
+    用带条件的UPDATE增加计数，并发上传也不会超出配额；超出时不计入
+    分块上传的每个分块以count=0计入字节数，拼接完成后再计入文件数
+    """
+    charged = []
+    for key, limit in get_limits(owner_id):
+        ensure_usage(key)
+        queryset = UploadUsage.objects.filter(key=key)
+        if limit:
+            queryset = queryset.filter(size__lte=limit - size)
+        updated = queryset.update(size=F("size") + size, count=F("count") + count)
+        if updated == 0 and not UploadUsage.objects.filter(key=key).exists():
+            # 计数行在确认存在之后被删除，重新创建后再计入
+            _known_keys.discard(key)
+            ensure_usage(key)
+            updated = queryset.update(size=F("size") + size, count=F("count") + count)
+        if updated == 0:
+            if charged:
+                UploadUsage.objects.filter(key__in=charged).update(
+                    size=F("size") - size, count=F("count") - count)
+            return quota_error(limit)
+        charged.append(key)
+    return None
+
+
+def adjust(owner_id, size, count):
+    """不检查配额，直接增减用户和全站用量"""
+    keys = [SITE_KEY] if owner_id is None else [SITE_KEY, user_key(owner_id)]
+    UploadUsage.objects.filter(key__in=keys).update(size=F("size") + size, count=F("count") + count)
+
+
+def release(owner_id, size, count=1):
+    """文件被删除或没有保存成功时，从用户和全站用量中减去"""
+    adjust(owner_id, -size, -count)
+
+
+def release_files(files):
+    """批量减去用量，files为[(用户id,大小),...]，每个用户只更新一次"""
+    usage = defaultdict(lambda: [0, 0])
+    for owner_id, size in files:
+        usage[owner_id][0] += size
+        usage[owner_id][1] += 1
+    if not usage:
+        return
+    with transaction.atomic():
+        for owner_id, (size, count) in usage.items():
+            if owner_id is not None:
+                UploadUsage.objects.filter(key=user_key(owner_id)).update(
+                    size=F("size") - size, count=F("count") - count)
+        UploadUsage.objects.filter(key=SITE_KEY).update(
+            size=F("size") - sum(item[0] for item in usage.values()),
+            count=F("count") - sum(item[1] for item in usage.values()))
+
+
+def reconcile():
+    """按上传文件目录和未完成的分块上传重新统计全部用量，返回{计数键: (大小,文件数)}"""
+    usage = defaultdict(lambda: (0, 0))
+    rows = [(row["owner"], row["total"] or 0, row["files"]) for row in
+            MediaFile.objects.values("owner").annotate(total=Sum("size"), files=Count("id")).order_by()]
+    rows.extend((owner_id, size, 0) for owner_id, size in chunked.staged_usage())
+    for owner_id, size, count in rows:
+        keys = [SITE_KEY] if owner_id is None else [SITE_KEY, user_key(owner_id)]
+        for key in keys:
+            usage[key] = (usage[key][0] + size, usage[key][1] + count)
+    usage = dict(usage)
+    usage.setdefault(SITE_KEY, (0, 0))
+    with transaction.atomic():
+        existing = set(UploadUsage.objects.values_list("key", flat=True))
+        UploadUsage.objects.exclude(key__in=list(usage)).update(size=0, count=0)
+        new_rows = []
+        for key, (size, count) in usage.items():
+            if key in existing:
+                UploadUsage.objects.filter(key=key).update(size=size, count=count)
+            else:
+                new_rows.append(UploadUsage(key=key, size=size, count=count))
+        UploadUsage.objects.bulk_create(new_rows)
+    return usage
@@ -0,0 +1,117 @@
+# coding:utf-8
+# 控制器限流：按用户(未登录时按IP)和action分别计算
+# 保存在Django缓存中时使用固定窗口计数器，只用原子的add和incr，多个进程并发请求也不会超出限制
+# 缓存不可用时使用进程内的令牌桶
+import math
+import time
+import threading
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from . import settings as USettings
+
+# 进程内的令牌桶：{键: (剩余令牌数,更新时间)}，按最近使用的顺序排列
+_local_buckets = OrderedDict()
+_local_lock = threading.Lock()
+# 进程内最多保存的令牌桶数量，超过时淘汰最久未使用的，防止被大量不同IP撑满内存
+MAX_LOCAL_BUCKETS = 10000
+
+
+def get_limit(action):
+    """返回action的(每秒补充的令牌数,桶容量)，"*"为未单独配置的action的限制，不限制时返回None"""
+    limits = USettings.GetUeditorSettings("rateLimits", {})
+    limit = limits.get(action, limits.get("*"))
+    if not limit:
+        return None
+    return float(limit[0]), float(limit[1])
+
+
+def get_client_ip(request):
+    """客户端IP，在反向代理之后时可用rateLimitIpHeader指定保存真实IP的请求头，如HTTP_X_FORWARDED_FOR"""
+    header = USettings.GetUeditorSettings("rateLimitIpHeader", "")
+    if header and request.META.get(header):
+        return request.META[header].split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_client_key(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return "user:%s" % user.pk
+    return "ip:%s" % get_client_ip(request)
+
+
+def get_cache():
+    """限流使用的缓存，rateLimitCache不存在或为DummyCache时返回None，改用进程内的令牌桶"""
+    try:
+        cache = caches[USettings.GetUeditorSettings("rateLimitCache", "default")]
+    except Exception:
+        return None
+    if isinstance(cache, DummyCache):
+        return None
+    return cache
+
+
+def consume(bucket, rate, burst, now):
+    """从令牌桶中取一个令牌，返回(是否允许,新的令牌桶)"""
+    tokens, updated = bucket if bucket else (burst, now)
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens < 1:
+        return False, (tokens, now)
+    return True, (tokens - 1, now)
+
+
+def count_in_window(cache, key, rate, burst, now):
+    """
+    固定窗口计数：窗口从第一个请求开始，长度为burst/rate秒，窗口内最多允许burst个请求
+    返回需要等待的秒数，未超出时返回0
+    """
+    window = burst / rate if rate > 0 else None
+    timeout = int(math.ceil(window)) if window else None
+    # add只在键不存在时写入，与incr一样是原子操作
+    cache.add(key + ":start", now, timeout)
+    cache.add(key, 0, timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # 窗口恰好在add之后过期，重新开始一个窗口
+        cache.add(key, 1, timeout)
+        count = 1
+    if count <= burst:
+        return 0
+    if window is None:
+        return 60
+    start = cache.get(key + ":start")
+    return max(start + window - now, 0.001) if start is not None else window
+
+
+def consume_local(key, rate, burst, now):
+    """从进程内的令牌桶取一个令牌，返回需要等待的秒数，未超出时返回0"""
+    with _local_lock:
+        allowed, bucket = consume(_local_buckets.pop(key, None), rate, burst, now)
+        _local_buckets[key] = bucket
+        while len(_local_buckets) > MAX_LOCAL_BUCKETS:
+            _local_buckets.popitem(last=False)
+    if allowed:
+        return 0
+    return (1 - bucket[0]) / rate if rate > 0 else 60
+
+
+def check(request, action):
+    """
+    检查请求是否超出action的频率限制，返回需要等待的秒数，未超出时返回0
+    只访问限流的计数器，在任何磁盘和网络操作之前调用
+    """
+    limit = get_limit(action)
+    if limit is None:
+        return 0
+    rate, burst = limit
+    key = "ueditor:ratelimit:%s:%s" % (action, get_client_key(request))
+    now = time.time()
+    cache = get_cache()
+    if cache is not None:
+        try:
+            return count_in_window(cache, key, rate, burst, now)
+        except Exception:
+            pass
+    return consume_local(key, rate, burst, now)
@@ -0,0 +1,65 @@
+# coding:utf-8
+# 内容引用：从UEditorField保存的HTML中找出引用的上传文件
+import re
+from django.apps import apps
+from django.utils.six.moves.urllib.parse import unquote
+from . import storage
+
+# 文件URL中允许出现的字符，遇到引号、空白、括号等即结束
+URL_PATH_PATTERN = r"[^\"'\s<>()?#]+"
+# 按需缩放的地址引用的是原图，如/ueditor/media-resize/640x0/uploads/a.png
+RESIZE_PREFIX = r"media-resize/\d+x\d+/"
+
+# 每个进程编译一次的提取表达式：{文件URL前缀: 表达式}
+_patterns = {}
+
+
+def get_url_prefix():
+    """存储中文件URL的公共前缀，如/media/"""
+    return storage.file_url("")
+
+
+def url_pattern(prefix):
+    """匹配文件URL的表达式，第一个分组为URL编码的文件名"""
+    return re.compile(re.escape(prefix) + "(" + URL_PATH_PATTERN + ")")
+
+
+def extract_paths(contents, prefix):
+    """
+    从多段HTML中提取引用的文件路径(相对MEDIA_ROOT)，返回集合
+    只依赖传入的字符串，可以在进程池中运行
+    """
+    pattern = _patterns.get(prefix)
+    if pattern is None:
+        pattern = _patterns[prefix] = re.compile(
+            "(?:%s|%s)(%s)" % (re.escape(prefix), RESIZE_PREFIX, URL_PATH_PATTERN))
+    paths = set()
+    for content in contents:
+        if content:
+            paths.update(pattern.findall(content))
+    return set(unquote(path) for path in paths)
+
+
+def get_editor_fields():
+    """所有使用UEditorField的模型字段，返回[(模型,字段名),...]"""
+    from .models import UEditorField
+    fields = []
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, UEditorField):
+                fields.append((model, field.attname))
+    return fields
+
+
+def iter_contents(model, field_name, batch_size=1000):
+    """按主键分批读取model的field_name，每次生成[(主键,内容),...]，不会一次读入整张表"""
+    last_pk = None
+    while True:
+        queryset = model._default_manager.order_by("pk")
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list("pk", field_name)[:batch_size])
+        if not rows:
+            break
+        yield rows
+        last_pk = rows[-1][0]
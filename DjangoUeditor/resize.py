@@ -0,0 +1,168 @@
+# coding:utf-8
+# 按需缩放图片：首次请求时缩放MEDIA_ROOT中的图片，结果保存在限制总大小的磁盘缓存中，按最近使用时间淘汰
+import os
+import hashlib
+import threading
+from . import settings as USettings
+from . import storage
+
+# 可以缩放的图片类型与保存格式
+IMAGE_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".gif": "GIF",
+    ".bmp": "BMP",
+    ".webp": "WEBP",
+}
+
+# 同一缓存项的并发请求只缩放一次：{缓存文件名: 锁}
+_locks = {}
+_locks_lock = threading.Lock()
+# 缓存目录的大致总大小，None表示尚未统计
+_cache_size = [None]
+_cache_size_lock = threading.Lock()
+
+
+class ResizeError(Exception):
+    pass
+
+
+def get_cache_root():
+    """缩放缓存目录，默认为MEDIA_ROOT/.resized"""
+    return USettings.GetUeditorSettings("resizeCachePath", "") or os.path.join(
+        storage.get_storage().path(""), ".resized")
+
+
+def check_size(width, height):
+    """宽度必须在resizeWidths中，高度为0(按比例)或在resizeHeights中，防止缓存被任意尺寸撑满"""
+    if width not in USettings.GetUeditorSettings("resizeWidths", []):
+        raise ResizeError(u"不允许的宽度%s" % width)
+    if height != 0 and height not in USettings.GetUeditorSettings("resizeHeights", []):
+        raise ResizeError(u"不允许的高度%s" % height)
+
+
+def get_source_file(path):
+    """取得MEDIA_ROOT中的原图路径，不允许访问MEDIA_ROOT之外和以.开头的文件，不是本地存储时不支持缩放"""
+    if not storage.is_local():
+        raise ResizeError(u"不支持的存储")
+    media_root = os.path.abspath(storage.get_storage().path(""))
+    filename = os.path.abspath(os.path.join(media_root, path))
+    if not filename.startswith(media_root + os.sep):
+        raise ResizeError(u"文件不存在")
+    if any(part.startswith(".") for part in os.path.relpath(filename, media_root).split(os.sep)):
+        raise ResizeError(u"文件不存在")
+    if os.path.splitext(filename)[1].lower() not in IMAGE_FORMATS:
+        raise ResizeError(u"不支持的图片类型")
+    if not os.path.isfile(filename):
+        raise ResizeError(u"文件不存在")
+    return filename
+
+
+def get_cache_file(source_file, width, height):
+    """缓存文件名由原图路径、修改时间和尺寸决定，原图更新后自动使用新的缓存"""
+    st = os.stat(source_file)
+    key = hashlib.sha1(("%s|%s|%s|%d|%d" % (
+        source_file, st.st_mtime, st.st_size, width, height)).encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_root(), key[:2], key + os.path.splitext(source_file)[1].lower())
+
+
+def get_lock(cache_file):
+    with _locks_lock:
+        lock = _locks.get(cache_file)
+        if lock is None:
+            lock = _locks[cache_file] = threading.Lock()
+        return lock
+
+
+def resize_image(source_file, cache_file, width, height):
+    """缩放图片并原子地写入cache_file，返回写入的字节数"""
+    from PIL import Image
+
+    image = Image.open(source_file)
+    image_format = IMAGE_FORMATS[os.path.splitext(source_file)[1].lower()]
+    # 高度为0时按宽度等比缩放，只缩小不放大
+    image.thumbnail((width, height or image.size[1]),
+                    Image.LANCZOS if hasattr(Image, "LANCZOS") else Image.ANTIALIAS)
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if not os.path.exists(os.path.dirname(cache_file)):
+        try:
+            os.makedirs(os.path.dirname(cache_file))
+        except OSError:
+            pass
+    tmp_filename = "%s.%d.%d.tmp" % (cache_file, os.getpid(), threading.current_thread().ident)
+    try:
+        image.save(tmp_filename, image_format)
+        os.rename(tmp_filename, cache_file)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return os.path.getsize(cache_file)
+
+
+def get_resized_file(path, width, height):
+    """取得缩放后的缓存文件，不存在时生成"""
+    check_size(width, height)
+    source_file = get_source_file(path)
+    cache_file = get_cache_file(source_file, width, height)
+    if os.path.exists(cache_file):
+        touch(cache_file)
+        return cache_file
+    lock = get_lock(cache_file)
+    with lock:
+        # 等待锁期间可能已由其它请求生成
+        if not os.path.exists(cache_file):
+            size = resize_image(source_file, cache_file, width, height)
+            add_cache_size(size)
+    with _locks_lock:
+        _locks.pop(cache_file, None)
+    return cache_file
+
+
+def touch(cache_file):
+    """更新修改时间，淘汰时按修改时间判断最近使用"""
+    try:
+        os.utime(cache_file, None)
+    except OSError:
+        pass
+
+
+def scan_cache():
+    """返回缓存目录中的[(修改时间,大小,文件名),...]"""
+    from .catalog import scandir
+    files = []
+    root = get_cache_root()
+    if not os.path.isdir(root):
+        return files
+    for sub in scandir(root):
+        if not sub.is_dir():
+            continue
+        for entry in scandir(sub.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+    return files
+
+
+def add_cache_size(size):
+    """累计缓存大小，超过resizeCacheMaxSize时淘汰最久未使用的文件，直到降到限制的90%"""
+    max_size = USettings.GetUeditorSettings("resizeCacheMaxSize", 1073741824)
+    with _cache_size_lock:
+        if _cache_size[0] is None:
+            _cache_size[0] = sum(item[1] for item in scan_cache())
+        else:
+            _cache_size[0] += size
+        if _cache_size[0] <= max_size:
+            return
+        files = sorted(scan_cache())
+        total = sum(item[1] for item in files)
+        for mtime, file_size, filename in files:
+            if total <= max_size * 0.9:
+                break
+            try:
+                os.remove(filename)
+                total -= file_size
+            except OSError:
+                pass
+        _cache_size[0] = total
@@ -0,0 +1,108 @@
+# coding:utf-8
+# 涂鸦上传：直接从请求流中边读取边解码base64写入文件，内存占用与图片大小无关
+import os
+import re
+import binascii
+from .utils import FileSize
+
+# 每次从请求中读取的字节数
+CHUNK_SIZE = 64 * 1024
+# 字段名的最大长度，超过时认为请求不正确
+MAX_KEY_LENGTH = 1024
+
+PERCENT_PATTERN = re.compile(br"%([0-9A-Fa-f]{2})")
+NON_BASE64_PATTERN = re.compile(br"[^A-Za-z0-9+/=]")
+
+
+class ScrawlError(Exception):
+    pass
+
+
+def url_unquote(data):
+    """解码application/x-www-form-urlencoded编码的字节串"""
+    return PERCENT_PATTERN.sub(lambda m: binascii.unhexlify(m.group(1)), data.replace(b"+", b" "))
+
+
+def iter_field_value(stream, field_name, chunk_size=CHUNK_SIZE):
+    """
+    从urlencoded编码的请求流中找出field_name字段，分块生成其解码后的值
+    字段不存在时不生成任何数据
+    """
+    if not isinstance(field_name, bytes):
+        field_name = field_name.encode("utf-8")
+    key = b""
+    in_value = matched = False
+    # 被分块截断的%XX
+    pending = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        while data:
+            if not in_value:
+                eq, amp = data.find(b"="), data.find(b"&")
+                if amp != -1 and (eq == -1 or amp < eq):
+                    # 没有值的字段
+                    key, data = b"", data[amp + 1:]
+                    continue
+                if eq == -1:
+                    key, data = key + data, b""
+                    if len(key) > MAX_KEY_LENGTH:
+                        raise ScrawlError(u"表单字段名过长")
+                    continue
+                key, data = key + data[:eq], data[eq + 1:]
+                matched, in_value, key = url_unquote(key) == field_name, True, b""
+            else:
+                amp = data.find(b"&")
+                value, data = (data, b"") if amp == -1 else (data[:amp], data[amp + 1:])
+                if matched:
+                    value = pending + value
+                    # %XX可能被截断在两个分块之间，留到下一块再解码
+                    cut = value.rfind(b"%", -2)
+                    if cut != -1 and amp == -1:
+                        value, pending = value[:cut], value[cut:]
+                    else:
+                        pending = b""
+                    yield url_unquote(value)
+                    if amp != -1:
+                        return
+                if amp != -1:
+                    in_value = False
+    if matched and pending:
+        yield url_unquote(pending)
+
+
+def iter_base64_decode(chunks):
+    """分块解码base64，忽略其中的空白等非base64字符"""
+    rest = b""
+    for chunk in chunks:
+        data = rest + NON_BASE64_PATTERN.sub(b"", chunk)
+        length = len(data) // 4 * 4
+        data, rest = data[:length], data[length:]
+        if data:
+            yield binascii.a2b_base64(data)
+    if rest:
+        yield binascii.a2b_base64(rest + b"=" * (-len(rest) % 4))
+
+
+def save_scrawl(chunks, filename, max_size=0):
+    """
+    将base64编码的涂鸦数据分块解码写入filename，返回写入的字节数
+    max_size不为0时，解码后的大小超过限制立即中止并删除文件
+    """
+    size = 0
+    try:
+        with open(filename, "wb") as f:
+            for data in iter_base64_decode(chunks):
+                size += len(data)
+                if max_size and size > max_size:
+                    raise ScrawlError(u"上传文件大小不允许超过%s。" % FileSize(max_size).FriendValue)
+                f.write(data)
+    except Exception:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+    if size == 0:
+        os.remove(filename)
+        raise ScrawlError(u"没有涂鸦数据")
+    return size
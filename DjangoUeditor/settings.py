@@ -12,8 +12,72 @@ TOOLBARS_SETTINGS = {
 UEditorSettings = {
     "toolbars": TOOLBARS_SETTINGS["normal"],
     "autoFloatEnabled": False,
-    # 默认保存上传文件的命名方式
-    "defaultPathFormat": "%(basename)s_%(datetime)s_%(rnd)s.%(extname)s"
+    # 默认保存上传文件的命名方式，可使用%(shard)s分片目录；设为"sharded"时使用内置的"年/月/日/散列前缀/文件名"分片方式，
+    # 避免单个目录中的文件过多，已有文件可用python manage.py ueditor_shard_media迁移
+    "defaultPathFormat": "%(basename)s_%(datetime)s_%(rnd)s.%(extname)s",
+    # 保存上传文件的存储类，为空时使用Django的default_storage，如"DjangoUeditor.storage.S3Storage"
+    "storage": "",
+    # 创建存储类时传入的参数，如S3Storage的{"bucket": "media", "endpoint_url": "http://127.0.0.1:9000"}
+    "storageOptions": {},
+    # 下载、解码、拼接时使用的本地临时目录，为空时本地存储使用MEDIA_ROOT/.ueditor_tmp，其它存储使用系统临时目录
+    "tempPath": "",
+    # ueditor_build_static生成的清单文件，为空时使用STATIC_ROOT/ueditor.manifest.json；存在时页面从带散列的目录加载ueditor
+    "staticManifest": "",
+    # 延迟加载编辑器：为空时页面加载时即加载ueditor的脚本；"interaction"在文本框获得焦点、鼠标移入时才加载；
+    # "visible"在此基础上滚动到可见区域时也加载
+    "lazyLoad": "",
+    # 延迟加载时是否用<link rel="preload">提前下载ueditor的脚本
+    "preload": False,
+    # 控制器各action的频率限制{action: [每秒补充的请求数, 最多连续请求数]}，登录用户按用户、未登录按IP分别计算，
+    # "*"为其它action的限制，如"*": [5, 20]；超出时返回429
+    "rateLimits": {
+        "catchimage": [0.5, 10],
+        "listimage": [2, 20],
+        "listfile": [2, 20]
+    },
+    # 保存限流状态的缓存(CACHES中的名称)，多进程部署时应使用memcached、redis等共享缓存；不可用时在进程内计算
+    "rateLimitCache": "default",
+    # 在反向代理之后时，保存客户端真实IP的请求头，如"HTTP_X_FORWARDED_FOR"，为空时使用REMOTE_ADDR
+    "rateLimitIpHeader": "",
+    # 每个登录用户的上传配额，单位B，为0时不限制；超出后上传、涂鸦、分块上传和远程抓图都会被拒绝
+    "userQuota": 0,
+    # 全站的上传配额，单位B，为0时不限制
+    "siteQuota": 0,
+    # 按内容去重保存上传文件，内容相同(sha1相同)的文件只保存一份
+    "contentAddressed": False,
+    # 分块上传(uploadchunk)的暂存目录，为空时使用tempPath(未设置时为系统临时目录)下的ueditor_chunks，不要设置在MEDIA_ROOT中
+    "chunkStagingPath": "",
+    # ueditor_gc隔离未引用文件的目录，为空时使用MEDIA_ROOT旁边的ueditor_quarantine，不能设置在MEDIA_ROOT中
+    "quarantinePath": "",
+    # 上传图片后登记缩略图任务，由python manage.py ueditor_derivatives在后台生成(需要安装Pillow，只支持本地存储)
+    "derivativeEnable": False,
+    # 缩略图尺寸列表[宽,高]，图片管理器使用第一个尺寸
+    "thumbnailSizes": [[200, 200]],
+    # 是否同时生成WebP格式的缩略图
+    "thumbnailWebp": True,
+    # 按需缩放(/ueditor/media-resize/<宽>x<高>/<路径>)允许的宽度，高度为0表示按比例缩放，只支持本地存储
+    "resizeWidths": [320, 480, 640, 960, 1280],
+    # 按需缩放允许的高度(除0以外)
+    "resizeHeights": [],
+    # 缩放缓存目录，为空时使用MEDIA_ROOT/.resized
+    "resizeCachePath": "",
+    # 缩放缓存的最大总大小，单位B，默认1GB，超出时淘汰最久未使用的文件
+    "resizeCacheMaxSize": 1073741824,
+    # 缩放结果的浏览器缓存时间，单位秒
+    "resizeMaxAge": 2592000,
+    # config响应的浏览器缓存时间，单位秒，配置变化后通过ETag重新验证
+    "configMaxAge": 86400,
+    # 远程抓图时同时下载的图片数量
+    "catcherConcurrency": 4,
+    # 远程抓图时每张图片的下载超时时间，单位秒
+    "catcherTimeout": 10,
+    # 是否缓存远程抓图，同一远程地址再次抓取时直接返回已保存的本地文件
+    "catcherCacheEnable": True,
+    # 抓图缓存的有效期，单位秒，过期后使用ETag/Last-Modified向远程服务器重新验证
+    "catcherCacheTTL": 86400,
+    # 抓图缓存的最大条数和文件总大小(字节)，超出任一项时淘汰最久未使用的记录，同时删除保存的文件
+    "catcherCacheMaxEntries": 10000,
+    "catcherCacheMaxSize": 1024 * 1024 * 1024
 }
 # 请参阅php文件夹里面的config.json进行配置
 UEditorUploadSettings = {
@@ -94,6 +158,32 @@ UEditorUploadSettings = {
 }
 
 
+# 预先生成的config响应：content为json，gzip为压缩后的json，etag和gzip_etag分别为两种编码的强ETag
+UEditorConfigCache = {}
+
+
+# 序列化UEditorUploadSettings，每次更新配置后重新生成，避免每个请求都执行json.dumps
+def BuildConfigCache():
+    import io
+    import gzip
+    import json
+    import hashlib
+    content = json.dumps(UEditorUploadSettings, ensure_ascii=False)
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    buf = io.BytesIO()
+    # 固定mtime，保证相同配置生成相同的压缩结果
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(content)
+    digest = hashlib.sha1(content).hexdigest()
+    UEditorConfigCache.update({
+        "content": content,
+        "gzip": buf.getvalue(),
+        "etag": '"%s"' % digest,
+        "gzip_etag": '"%s-gzip"' % digest
+    })
+
+
 # 更新配置：从用户配置文件settings.py重新读入配置UEDITOR_SETTINGS,覆盖默认
 def UpdateUserSettings():
     UserSettings = getattr(gSettings, "UEDITOR_SETTINGS", {}).copy()
@@ -101,6 +191,7 @@ def UpdateUserSettings():
         UEditorSettings.update(UserSettings["config"])
     if 'upload' in UserSettings:
         UEditorUploadSettings.update(UserSettings["upload"])
+    BuildConfigCache()
 
 # 读取用户Settings文件并覆盖默认配置
 UpdateUserSettings()
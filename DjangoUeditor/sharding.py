@@ -0,0 +1,103 @@
+# coding:utf-8
+# 目录分片：按日期加散列前缀分散上传文件，避免单个目录中的文件过多
+import os
+import time
+import hashlib
+from django.db import transaction
+from django.utils.six.moves.urllib.parse import unquote
+from . import settings as USettings
+from . import references
+from . import storage
+
+# defaultPathFormat设为"sharded"时使用的分片命名方式，每天最多256个分片目录
+SHARDED_PATH_FORMAT = "%(year)s/%(month)s/%(day)s/%(shard)s/%(basename)s_%(datetime)s_%(rnd)s.%(extname)s"
+# 生成路径时分片的占位符，文件名确定后替换为散列前缀
+SHARD_TOKEN = "\x00shard\x00"
+
+
+def get_default_path_format():
+    """取得defaultPathFormat，"sharded"为内置的分片命名方式"""
+    path_format = USettings.GetUeditorSettings("defaultPathFormat", "")
+    return SHARDED_PATH_FORMAT if path_format == "sharded" else path_format
+
+
+def shard_of(name):
+    """文件名的散列前缀，同名文件总是分到同一个分片"""
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:2]
+
+
+def format_path(path_format, path_format_var):
+    """
+    按path_format生成上传文件的路径，%(shard)s为生成的文件名(不含目录)的散列前缀
+    与ueditor_shard_media移动已有文件时使用的分片一致
+    """
+    if "%(shard)s" not in path_format:
+        return path_format % path_format_var
+    path = path_format % dict(path_format_var, shard=SHARD_TOKEN)
+    filename = os.path.basename(path.replace("\\", "/")).replace(SHARD_TOKEN, "")
+    return path.replace(SHARD_TOKEN, shard_of(filename))
+
+
+def sharded_path(path, mtime):
+    """已有文件的分片路径：按修改时间分日期目录，按文件名分片，如uploads/a.png => uploads/2016/05/03/a7/a.png"""
+    dirname, filename = os.path.split(path)
+    date = time.strftime("%Y/%m/%d", time.localtime(mtime))
+    return "/".join(part for part in (dirname, date, shard_of(filename), filename) if part)
+
+
+def move_file(root, path, new_path):
+    """在本地存储中移动文件，目标已存在时不移动，返回是否移动"""
+    src = os.path.join(root, path)
+    dst = os.path.join(root, new_path)
+    if os.path.exists(dst):
+        return False
+    if not os.path.isdir(os.path.dirname(dst)):
+        try:
+            os.makedirs(os.path.dirname(dst))
+        except OSError:
+            pass
+    os.rename(src, dst)
+    return True
+
+
+def update_records(moved):
+    """更新上传文件目录、去重记录和抓图缓存中的路径，moved为{旧路径: 新路径}"""
+    from .models import MediaFile, MediaBlob, RemoteImage
+    with transaction.atomic():
+        for model in (MediaFile, MediaBlob, RemoteImage):
+            for path, new_path in moved.items():
+                model.objects.filter(path=path).update(path=new_path)
+
+
+def rewrite_content(content, pattern, moved):
+    """把内容中引用旧文件的URL替换为新文件的URL"""
+    def replace(match):
+        new_path = moved.get(unquote(match.group(1)))
+        return storage.file_url(new_path) if new_path else match.group(0)
+    return pattern.sub(replace, content)
+
+
+def rewrite_references(model, field_name, moved, batch_size=500):
+    """
+    按主键分批读取model，重写field_name中引用已移动文件的URL，每批在一个事务中更新
+    需要修改的记录逐条save()，与编辑保存一样更新auto_now字段并发送post_save，
+    依赖它们的缓存、引用表和索引随之更新
+    返回修改的记录数
+    """
+    if not moved:
+        return 0
+    pattern = references.url_pattern(references.get_url_prefix())
+    changed = 0
+    for rows in references.iter_contents(model, field_name, batch_size):
+        pks = [pk for pk, content in rows if rewrite_content(content or "", pattern, moved) != (content or "")]
+        if not pks:
+            continue
+        with transaction.atomic():
+            for instance in model._default_manager.select_for_update().filter(pk__in=pks):
+                content = getattr(instance, field_name) or ""
+                new_content = rewrite_content(content, pattern, moved)
+                if new_content != content:
+                    setattr(instance, field_name, new_content)
+                    instance.save()
+                    changed += 1
+    return changed
@@ -908,7 +908,9 @@
                         }
                     })(img));
                     img.width = 113;
-                    img.setAttribute('src', urlPrefix + list[i].url + (list[i].url.indexOf('?') == -1 ? '?noCache=':'&noCache=') + (+new Date()).toString(36) );
+                    /* 有缩略图时列表中显示缩略图，插入时仍使用原图 */
+                    var previewUrl = list[i].thumb || list[i].url;
+                    img.setAttribute('src', urlPrefix + previewUrl + (previewUrl.indexOf('?') == -1 ? '?noCache=':'&noCache=') + (+new Date()).toString(36) );
                     img.setAttribute('_src', urlPrefix + list[i].url);
                     domUtils.addClass(icon, 'icon');
 
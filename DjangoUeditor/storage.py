@@ -0,0 +1,305 @@
+# coding:utf-8
+# 存储后端：UEditor所有文件的写入、列出和URL计算都通过Django Storage完成
+import os
+import shutil
+import datetime
+import tempfile
+import mimetypes
+from importlib import import_module
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage, default_storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+from django.utils.module_loading import import_string
+from django.utils import timezone
+from . import settings as USettings
+
+# 已创建的存储和已导入的upload_module，只在第一次使用时创建/导入
+_storage = []
+_upload_module = []
+
+
+def get_storage():
+    """
+    取得UEditor使用的存储
+    UEditorSettings["storage"]为Storage类的路径，storageOptions为其参数；未指定时使用default_storage
+    """
+    if not _storage:
+        storage_class = USettings.GetUeditorSettings("storage", "")
+        if storage_class:
+            _storage.append(import_string(storage_class)(
+                **USettings.GetUeditorSettings("storageOptions", {})))
+        else:
+            _storage.append(default_storage)
+    return _storage[0]
+
+
+def reset_storage():
+    """修改存储配置后调用，下次使用时重新创建"""
+    del _storage[:]
+    del _upload_module[:]
+
+
+def is_local(storage=None):
+    """存储是否在本地文件系统上，只有本地存储支持对账、缩略图、缩放等需要直接读写文件的功能"""
+    storage = storage or get_storage()
+    try:
+        storage.path("")
+        return True
+    except NotImplementedError:
+        return False
+
+
+def get_upload_module():
+    """取得upload_module设置的自定义上传模块，只导入一次"""
+    if not _upload_module:
+        module_name = USettings.UEditorUploadSettings.get("upload_module", None)
+        _upload_module.append(import_module(module_name) if module_name else None)
+    return _upload_module[0]
+
+
+def file_url(name):
+    """取得存储中文件的URL"""
+    return get_storage().url(name)
+
+
+def get_temp_filename(suffix=""):
+    """
+    生成一个本地临时文件名，用于边下载/解码边写入的场景，写完后再保存到存储中
+    本地存储时放在MEDIA_ROOT/.ueditor_tmp中，与目标文件在同一文件系统，保存时直接移动
+    """
+    temp_path = USettings.GetUeditorSettings("tempPath", "")
+    if not temp_path:
+        temp_path = os.path.join(get_storage().path(""), ".ueditor_tmp") if is_local() else tempfile.gettempdir()
+    if not os.path.exists(temp_path):
+        try:
+            os.makedirs(temp_path)
+        except OSError:
+            pass
+    fd, filename = tempfile.mkstemp(suffix=suffix, dir=temp_path)
+    os.close(fd)
+    return filename
+
+
+class LocalTempFile(File):
+    """本地临时文件，FileSystemStorage保存时通过temporary_file_path直接移动而不复制"""
+
+    def __init__(self, filename):
+        super(LocalTempFile, self).__init__(open(filename, "rb"), name=os.path.basename(filename))
+        self.filename = filename
+
+    def temporary_file_path(self):
+        return self.filename
+
+
+def save_local_file(name, filename):
+    """把本地临时文件filename保存到存储中，返回实际保存的文件名，临时文件随后被删除"""
+    f = LocalTempFile(filename)
+    try:
+        name = get_storage().save(name, f)
+    finally:
+        f.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+    return name.replace("\\", "/")
+
+
+def save_file(name, content):
+    """把上传的文件保存到存储中，返回实际保存的文件名"""
+    return get_storage().save(name, content).replace("\\", "/")
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    S3兼容的对象存储(AWS S3、MinIO、Ceph等)，需要安装boto3
+        bucket:存储桶名称
+        endpoint_url:服务地址，非AWS服务(如MinIO)需要指定，如"http://127.0.0.1:9000"
+        access_key,secret_key,region_name:访问凭据和区域
+        location:文件在存储桶中的前缀目录
+        base_url:访问文件的URL前缀，默认为endpoint_url/bucket/
+        max_pool_connections:连接池大小，所有请求共用一个客户端
+        multipart_threshold,multipart_chunksize:文件超过multipart_threshold时分块并发上传
+    endpoint_url为"file:///目录"时使用LocalS3Client，在本地目录中模拟对象存储，不需要boto3，用于测试和开发
+    """
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region_name=None,
+                 location="", base_url=None, default_acl=None, max_pool_connections=20,
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                 max_concurrency=4):
+        self.bucket = bucket
+        self.location = location.strip("/")
+        self.default_acl = default_acl
+        if base_url is None:
+            base_url = "%s/%s/" % ((endpoint_url or "https://s3.amazonaws.com").rstrip("/"), bucket)
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        if endpoint_url and endpoint_url.startswith("file://"):
+            self.client = LocalS3Client(endpoint_url[len("file://"):])
+            self.transfer_config = None
+            return
+
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.client = boto3.session.Session().client(
+            "s3", endpoint_url=endpoint_url, region_name=region_name,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            config=Config(max_pool_connections=max_pool_connections))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency)
+
+    def _key(self, name):
+        name = name.replace("\\", "/").lstrip("/")
+        return "%s/%s" % (self.location, name) if self.location else name
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as E:
+            # botocore的ClientError和LocalS3Error都在response中给出错误代码
+            if getattr(E, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def _open(self, name, mode="rb"):
+        f = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        self.client.download_fileobj(self.bucket, self._key(name), f, Config=self.transfer_config)
+        f.seek(0)
+        return File(f, name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        extra_args = {"ContentType": mimetypes.guess_type(name)[0] or "application/octet-stream"}
+        if self.default_acl:
+            extra_args["ACL"] = self.default_acl
+        self.client.upload_fileobj(content, self.bucket, self._key(name),
+                                   ExtraArgs=extra_args, Config=self.transfer_config)
+        return name.replace("\\", "/")
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        return self._head(name)["ContentLength"]
+
+    def get_modified_time(self, name):
+        modified_time = self._head(name)["LastModified"]
+        return modified_time if settings.USE_TZ else timezone.make_naive(modified_time)
+
+    def modified_time(self, name):
+        return timezone.make_naive(self._head(name)["LastModified"])
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip("/")
+        prefix = prefix + "/" if prefix else ""
+        directories, files = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+            for item in page.get("CommonPrefixes", []):
+                directories.append(item["Prefix"][len(prefix):].rstrip("/"))
+            for item in page.get("Contents", []):
+                files.append(item["Key"][len(prefix):])
+        return directories, files
+
+    def url(self, name):
+        return self.base_url + filepath_to_uri(self._key(name))
+
+
+class LocalS3Error(Exception):
+    """与botocore的ClientError一样在response中给出错误代码"""
+
+    def __init__(self, code, message):
+        super(LocalS3Error, self).__init__(message)
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class LocalS3Paginator(object):
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix="", Delimiter=""):
+        yield self.client.list_objects_v2(Bucket=Bucket, Prefix=Prefix, Delimiter=Delimiter)
+
+
+class LocalS3Client(object):
+    """
+    在本地目录中模拟S3接口(类似单机的MinIO)，对象保存为root/存储桶/键，
+    只实现S3Storage用到的方法，接口与boto3的客户端相同
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.content_types = {}
+
+    def _path(self, bucket, key):
+        parts = key.split("/")
+        if not key or ".." in parts or "" in parts:
+            raise LocalS3Error("InvalidKey", "Invalid key: %s" % key)
+        return os.path.join(self.root, bucket, *parts)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3Error("404", "Not Found")
+        st = os.stat(path)
+        return {
+            "ContentLength": st.st_size,
+            "LastModified": datetime.datetime.fromtimestamp(st.st_mtime, timezone.utc),
+            "ContentType": self.content_types.get((Bucket, Key), "binary/octet-stream")
+        }
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        path = self._path(Bucket, Key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # 先写临时文件再改名，读取时不会看到写了一半的对象
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload")
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(Fileobj, f)
+        os.rename(tmp_path, path)
+        self.content_types[(Bucket, Key)] = (ExtraArgs or {}).get("ContentType", "binary/octet-stream")
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3Error("404", "Not Found")
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, Fileobj)
+
+    def delete_object(self, Bucket, Key):
+        # 与S3一样，删除不存在的对象不报错
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        self.content_types.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=""):
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                if not filename.startswith(".upload"):
+                    keys.append(os.path.relpath(os.path.join(dirpath, filename), bucket_root).replace(os.sep, "/"))
+        prefixes, contents = set(), []
+        for key in sorted(keys):
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter, 1)[0] + Delimiter)
+            else:
+                contents.append({"Key": key, "Size": os.path.getsize(os.path.join(bucket_root, *key.split("/")))})
+        return {"CommonPrefixes": [{"Prefix": prefix} for prefix in sorted(prefixes)], "Contents": contents}
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(operation_name)
+        return LocalS3Paginator(self)
@@ -0,0 +1,1344 @@
+# coding:utf-8
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from unittest import skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils.html import conditional_escape
+from django.utils.six import StringIO
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib.parse import urlsplit, parse_qsl, quote_plus
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from . import bundle
+from . import catalog
+from . import catcher
+from . import chunked
+from . import dedup
+from . import derivatives
+from . import quota
+from . import ratelimit
+from . import resize
+from . import scrawl
+from . import sharding
+from . import settings as USettings
+from . import storage
+from . import widgets
+from .models import DerivativeJob, MediaBlob, MediaFile, RemoteImage, UploadUsage
+
+
+@contextmanager
+def ueditor_settings(**values):
+    """临时修改UEditorSettings，结束后恢复，并重新创建存储"""
+    old = dict((key, USettings.UEditorSettings[key]) for key in values if key in USettings.UEditorSettings)
+    USettings.UEditorSettings.update(values)
+    storage.reset_storage()
+    try:
+        yield
+    finally:
+        for key in values:
+            if key in old:
+                USettings.UEditorSettings[key] = old[key]
+            else:
+                USettings.UEditorSettings.pop(key, None)
+        storage.reset_storage()
+
+
+class TempMediaMixin(object):
+    """MEDIA_ROOT、tempPath等目录都放在一个临时目录中，测试结束后删除"""
+
+    def setUp(self):
+        super(TempMediaMixin, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.media_root = os.path.join(self.tmp, "media")
+        os.makedirs(self.media_root)
+        # 视图测试直接使用DjangoUeditor.urls
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL="/media/",
+                                     ROOT_URLCONF="DjangoUeditor.urls")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.use_settings(tempPath=os.path.join(self.tmp, "tmp"))
+        # 测试结束后计数行被回滚
+        quota._known_keys.clear()
+        self.addCleanup(quota._known_keys.clear)
+
+    def use_settings(self, **values):
+        context = ueditor_settings(**values)
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+    def write_media(self, path, data=b"data"):
+        filename = os.path.join(self.media_root, path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, "wb") as f:
+            f.write(data)
+        return filename
+
+
+class TempMediaTestCase(TempMediaMixin, TestCase):
+    pass
+
+
+class StorageTests(TempMediaTestCase):
+    def use_s3(self, **options):
+        options.setdefault("bucket", "media")
+        options.setdefault("endpoint_url", "file://" + os.path.join(self.tmp, "s3"))
+        self.use_settings(storage="DjangoUeditor.storage.S3Storage", storageOptions=options)
+
+    def check_storage(self, url_prefix):
+        file_storage = storage.get_storage()
+        name = file_storage.save("uploads/a b.txt", ContentFile(b"hello"))
+        self.assertEqual(name, "uploads/a b.txt")
+        self.assertTrue(file_storage.exists(name))
+        self.assertEqual(file_storage.size(name), 5)
+        with file_storage.open(name) as f:
+            self.assertEqual(f.read(), b"hello")
+        self.assertEqual(storage.file_url(name), url_prefix + "uploads/a%20b.txt")
+
+        # 同名文件不覆盖已有的文件
+        other = storage.save_file("uploads/a b.txt", ContentFile(b"world"))
+        self.assertNotEqual(other, name)
+        with file_storage.open(other) as f:
+            self.assertEqual(f.read(), b"world")
+        self.assertEqual(sorted(file_storage.listdir("uploads")[1]), sorted([name[8:], other[8:]]))
+        self.assertEqual(file_storage.listdir("")[0], ["uploads"])
+
+        file_storage.delete(name)
+        self.assertFalse(file_storage.exists(name))
+        self.assertTrue(file_storage.exists(other))
+
+    def check_save_local_file(self):
+        filename = storage.get_temp_filename(".txt")
+        with open(filename, "wb") as f:
+            f.write(b"local")
+        name = storage.save_local_file("uploads/local.txt", filename)
+        self.assertFalse(os.path.exists(filename))
+        with storage.get_storage().open(name) as f:
+            self.assertEqual(f.read(), b"local")
+
+    def test_local_storage(self):
+        self.assertTrue(storage.is_local())
+        self.check_storage("/media/")
+        self.check_save_local_file()
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, "uploads", "local.txt")))
+
+    def test_s3_storage(self):
+        self.use_s3(base_url="http://cdn.example.com/media/")
+        self.assertIsInstance(storage.get_storage(), storage.S3Storage)
+        self.assertFalse(storage.is_local())
+        self.check_storage("http://cdn.example.com/media/")
+        self.check_save_local_file()
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "s3", "media", "uploads", "local.txt")))
+
+    def test_s3_location(self):
+        self.use_s3(location="site1/")
+        file_storage = storage.get_storage()
+        name = file_storage.save("a.txt", ContentFile(b"x"))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "s3", "media", "site1", "a.txt")))
+        self.assertTrue(file_storage.url(name).endswith("/media/site1/a.txt"))
+        self.assertEqual(file_storage.listdir(""), ([], ["a.txt"]))
+
+    def test_s3_missing_object(self):
+        self.use_s3()
+        file_storage = storage.get_storage()
+        self.assertFalse(file_storage.exists("missing.txt"))
+        # 删除不存在的对象与S3一样不报错
+        file_storage.delete("missing.txt")
+        with self.assertRaises(storage.LocalS3Error):
+            file_storage.open("missing.txt")
+
+
+class RemoteImageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    测试用的远程图片服务器，size参数(或路径中的数字)为返回的字节数：
+    /img/*       带Content-Length和ETag，If-None-Match匹配时返回304
+    /nolength/*  不带Content-Length，发送完后关闭连接
+    /stall/*     发送一半后停顿stall秒
+    /trickle/*   每隔interval秒发送64KB
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self.respond()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        segments = parts.path.split("/")
+        kind = segments[1]
+        # 大小也可以写在路径中，如/img/10/a.png
+        size = int(segments[2] if segments[2].isdigit() else params.get("size", 100))
+        time.sleep(float(params.get("delay", 0)))
+        if kind == "img" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        if kind != "nolength":
+            self.send_header("Content-Length", str(size))
+        if kind == "img":
+            self.send_header("ETag", '"v1"')
+            self.send_header("Last-Modified", "Mon, 01 Jan 2018 00:00:00 GMT")
+        self.end_headers()
+        if kind == "stall":
+            self.wfile.write(b"x" * (size // 2))
+            self.wfile.flush()
+            time.sleep(float(params.get("stall", 1)))
+            self.wfile.write(b"x" * (size - size // 2))
+        elif kind == "trickle":
+            while size > 0:
+                self.wfile.write(b"x" * min(size, catcher.CHUNK_SIZE))
+                self.wfile.flush()
+                size -= catcher.CHUNK_SIZE
+                time.sleep(float(params.get("interval", 0.1)))
+        else:
+            self.wfile.write(b"x" * size)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RemoteImageServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端中止下载时连接被关闭，不输出错误
+        pass
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), RemoteImageHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = []
+        self.active = self.max_active = 0
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+
+class CatcherTests(TempMediaTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(CatcherTests, cls).setUpClass()
+        cls.server = RemoteImageServer()
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(CatcherTests, cls).tearDownClass()
+
+    def setUp(self):
+        super(CatcherTests, self).setUp()
+        self.server.reset()
+        self.use_settings(rateLimits={})
+
+    def read_media(self, path):
+        with storage.get_storage().open(path) as f:
+            return f.read()
+
+    def test_fetch_all_concurrency(self):
+        jobs = [(self.server.url("/img/%d.png?size=%d&delay=0.2" % (i, 10 + i)), "catcher/%d.png" % i, None)
+                for i in range(4)]
+        results = catcher.fetch_all(jobs, timeout=5, concurrency=2)
+        # 结果按jobs的顺序返回
+        self.assertEqual([result[0] for result in results], ["SUCCESS"] * 4)
+        self.assertEqual([result[1] for result in results], [10, 11, 12, 13])
+        self.assertEqual([result[3] for result in results], ["catcher/%d.png" % i for i in range(4)])
+        self.assertEqual(self.read_media("catcher/3.png"), b"x" * 13)
+        self.assertEqual(self.server.max_active, 2)
+
+        self.server.reset()
+        catcher.fetch_all(jobs[:2], timeout=5, concurrency=1)
+        self.assertEqual(self.server.max_active, 1)
+        self.assertEqual(catcher.fetch_all([]), [])
+
+    def test_max_size_with_content_length(self):
+        filename = os.path.join(self.tmp, "a.png")
+        with self.assertRaises(catcher.CatcherError):
+            catcher.fetch_remote_file(self.server.url("/img/a.png?size=2000"), filename, max_size=1000)
+        # 未开始写入文件
+        self.assertFalse(os.path.exists(filename))
+        size, info = catcher.fetch_remote_file(self.server.url("/img/a.png?size=1000"), filename, max_size=1000)
+        self.assertEqual(size, 1000)
+        self.assertEqual(os.path.getsize(filename), 1000)
+
+    def test_max_size_without_content_length(self):
+        filename = os.path.join(self.tmp, "a.png")
+        with self.assertRaises(catcher.CatcherError):
+            catcher.fetch_remote_file(self.server.url("/nolength/a.png?size=300000"), filename,
+                                      max_size=100000)
+        self.assertFalse(os.path.exists(filename))
+        size, info = catcher.fetch_remote_file(self.server.url("/nolength/a.png?size=100000"), filename,
+                                               max_size=100000)
+        self.assertEqual(size, 100000)
+
+        state, size, info, path = catcher.fetch_one(
+            self.server.url("/nolength/a.png?size=300000"), "catcher/a.png", 100000, 5)
+        self.assertTrue(state.startswith(u"抓取图片错误"))
+        self.assertFalse(storage.get_storage().exists("catcher/a.png"))
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "tmp")), [])
+
+    def test_timeout(self):
+        filename = os.path.join(self.tmp, "a.png")
+        # 读取时超过timeout没有数据
+        start = time.time()
+        with self.assertRaises(Exception):
+            catcher.fetch_remote_file(self.server.url("/stall/a.png?size=1000&stall=2"), filename, timeout=0.5)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertFalse(os.path.exists(filename))
+        # 一直有数据，但整个下载过程超过timeout
+        with self.assertRaises(catcher.CatcherError):
+            catcher.fetch_remote_file(self.server.url("/trickle/a.png?size=2000000&interval=0.2"), filename,
+                                      timeout=0.5)
+        self.assertFalse(os.path.exists(filename))
+
+        state, size, info, path = catcher.fetch_one(
+            self.server.url("/stall/a.png?size=1000&stall=2"), "catcher/a.png", 0, 0.5)
+        self.assertTrue(state.startswith(u"抓取图片错误"))
+        self.assertFalse(storage.get_storage().exists("catcher/a.png"))
+
+    def test_normalize_url(self):
+        self.assertEqual(catcher.normalize_url("HTTP://Example.COM:80/a.png?b=2&a=1#top"),
+                         "http://example.com/a.png?a=1&b=2")
+        self.assertEqual(catcher.url_hash("https://example.com:443"), catcher.url_hash("https://example.com/"))
+        self.assertNotEqual(catcher.url_hash("http://example.com/A.png"), catcher.url_hash("http://example.com/a.png"))
+
+    def test_cache(self):
+        remote_url = self.server.url("/img/a.png?size=10")
+        state, size, info, path = catcher.fetch_one(remote_url, "catcher/a.png", 0, 5)
+        catcher.cache_image(remote_url, path, size, info)
+        image = RemoteImage.objects.get()
+        self.assertEqual((image.path, image.size, image.etag), ("catcher/a.png", 10, '"v1"'))
+
+        # 规范化后相同的地址命中同一条缓存
+        self.assertEqual(list(catcher.get_cached_images([remote_url + "#x"])), [remote_url + "#x"])
+        self.assertTrue(catcher.is_fresh(image))
+        with ueditor_settings(catcherCacheTTL=10):
+            self.assertFalse(catcher.is_fresh(image, now=image.checked_time + 11))
+
+        # 重新验证：远程文件未修改时返回NOT_MODIFIED
+        headers = catcher.revalidate_headers(image)
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2018 00:00:00 GMT"})
+        state, size, info, path = catcher.fetch_one(remote_url, "catcher/b.png", 0, 5, headers)
+        self.assertEqual(state, "NOT_MODIFIED")
+        self.assertFalse(storage.get_storage().exists("catcher/b.png"))
+
+        # 本地文件被删除后不再命中
+        storage.get_storage().delete("catcher/a.png")
+        self.assertEqual(catcher.get_cached_images([remote_url]), {})
+
+    def test_evict_cached_images(self):
+        UploadUsage.objects.create(key=quota.SITE_KEY, size=100, count=4)
+        for i, size in enumerate((10, 20, 30, 40)):
+            path = "catcher/%d.png" % i
+            self.write_media(path, b"x" * size)
+            catalog.register_file(path)
+            catcher.cache_image("http://example.com/%d.png" % i, path, size, None)
+            RemoteImage.objects.filter(path=path).update(last_used=i)
+        self.write_media(derivatives.derivative_path("catcher/0.png", 200, 200))
+        with ueditor_settings(catcherCacheMaxEntries=3, catcherCacheMaxSize=1000):
+            self.assertEqual(catcher.evict_cached_images(), 1)
+        # 按文件总大小淘汰：剩余90字节，淘汰1.png后为70字节
+        with ueditor_settings(catcherCacheMaxSize=75):
+            self.assertEqual(catcher.evict_cached_images(), 1)
+            self.assertEqual(catcher.evict_cached_images(), 0)
+        self.assertEqual(sorted(RemoteImage.objects.values_list("path", flat=True)),
+                         ["catcher/2.png", "catcher/3.png"])
+        # 淘汰的文件和缩略图被删除，并从上传文件目录和配额中去掉
+        file_storage = storage.get_storage()
+        for path in ("catcher/0.png", "catcher/1.png", "catcher/.thumbs/0_200x200.png"):
+            self.assertFalse(file_storage.exists(path))
+        self.assertTrue(file_storage.exists("catcher/2.png"))
+        self.assertEqual(sorted(MediaFile.objects.values_list("path", flat=True)),
+                         ["catcher/2.png", "catcher/3.png"])
+        self.assertEqual(UploadUsage.objects.values_list("size", "count").get(key=quota.SITE_KEY), (70, 2))
+
+    def catch(self, *remote_urls):
+        response = self.client.post("/controller/?action=catchimage&catcherPathFormat=catcher/%(basename)s_%(rnd)s",
+                                    {"source[]": remote_urls})
+        return json.loads(response.content.decode("utf-8"))["list"]
+
+    def test_catchimage_view(self):
+        remote_url = self.server.url("/img/10/a.png")
+        first = self.catch(remote_url)[0]
+        self.assertEqual((first["state"], first["size"]), ("SUCCESS", 10))
+        self.assertEqual(len(self.server.requests), 1)
+
+        # 缓存有效期内不请求远程服务器
+        second = self.catch(remote_url)[0]
+        self.assertEqual(second["url"], first["url"])
+        self.assertEqual(len(self.server.requests), 1)
+
+        # 过期后重新验证，304时沿用原来的文件
+        RemoteImage.objects.update(checked_time=0)
+        third = self.catch(remote_url)[0]
+        self.assertEqual((third["state"], third["url"]), ("SUCCESS", first["url"]))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertGreater(RemoteImage.objects.get().checked_time, 0)
+
+        # 超过大小限制的图片返回错误，其它图片不受影响
+        with ueditor_settings(catcherCacheEnable=False):
+            results = self.catch(self.server.url("/nolength/20000000/b.png"), remote_url)
+        self.assertTrue(results[0]["state"].startswith(u"抓取图片错误"))
+        self.assertEqual(results[1]["state"], "SUCCESS")
+
+    def test_catchimage_quota(self):
+        self.use_settings(siteQuota=100)
+        UploadUsage.objects.create(key=quota.SITE_KEY, size=90)
+        # 下载过程中超出剩余配额即中止，不写入文件
+        results = self.catch(self.server.url("/nolength/200000/a.png"), self.server.url("/img/10/b.png"))
+        self.assertEqual(results[0]["state"], u"抓取图片错误：" + quota.quota_error(100))
+        self.assertEqual(results[1]["state"], "SUCCESS")
+        self.assertEqual(storage.get_storage().listdir("catcher")[1], [os.path.basename(results[1]["url"])])
+        self.assertEqual(UploadUsage.objects.get(key=quota.SITE_KEY).size, 100)
+
+
+class CatalogTests(TempMediaTestCase):
+    def test_register_file(self):
+        self.write_media("uploads/a.png", b"12345")
+        media_file = catalog.register_file("\\uploads\\a.png")
+        self.assertEqual((media_file.path, media_file.ext, media_file.size), ("uploads/a.png", ".png", 5))
+        self.assertEqual(media_file.mtime, os.path.getmtime(os.path.join(self.media_root, "uploads", "a.png")))
+        # 再次登记时更新原来的记录
+        self.write_media("uploads/a.png", b"123")
+        catalog.register_file("uploads/a.png")
+        self.assertEqual(MediaFile.objects.get().size, 3)
+        # 不存在的文件不登记
+        self.assertIsNone(catalog.register_file("uploads/missing.png"))
+        self.assertEqual(MediaFile.objects.count(), 1)
+
+    def test_register_remote_file(self):
+        self.use_settings(storage="DjangoUeditor.storage.S3Storage", storageOptions={
+            "bucket": "media", "endpoint_url": "file://" + os.path.join(self.tmp, "s3")})
+        name = storage.save_file("uploads/a.png", ContentFile(b"12345"))
+        self.assertEqual(catalog.register_file(name).size, 5)
+        self.assertEqual(catalog.register_file(name, size=7).size, 7)
+
+    def test_list_files(self):
+        for i, path in enumerate(["uploads/a.png", "uploads/b.txt", "uploads/c.jpg", "other/d.png"]):
+            MediaFile.objects.create(path=path, ext=os.path.splitext(path)[1], mtime=i)
+        files, total = catalog.list_files("", [".png", ".jpg"], 0, 10)
+        self.assertEqual(total, 3)
+        self.assertEqual([item[0] for item in files], ["other/d.png", "uploads/c.jpg", "uploads/a.png"])
+        files, total = catalog.list_files("/uploads/", [".png", ".jpg"], 1, 1)
+        self.assertEqual((files, total), ([("uploads/a.png", 0.0, "")], 2))
+        self.assertEqual(catalog.list_files("uploads", [], 0, 10)[1], 3)
+        # 只匹配整个目录名
+        self.assertEqual(catalog.list_files("upload", [], 0, 10)[1], 0)
+
+    def test_list_view(self):
+        for i in range(3):
+            MediaFile.objects.create(path="uploads/%d.png" % i, ext=".png", mtime=i)
+        response = self.client.get("/controller/?action=listimage&start=1&size=1")
+        result = json.loads(response.content.decode("utf-8"))
+        self.assertEqual((result["state"], result["start"], result["total"]), ("SUCCESS", 1, 3))
+        self.assertEqual(result["list"], [{"url": "/media/uploads/1.png", "thumb": "", "mtime": 1.0}])
+        result = json.loads(self.client.get("/controller/?action=listfile&start=5").content.decode("utf-8"))
+        self.assertEqual((result["list"], result["total"]), ([], 3))
+
+
+class SyncCatalogTests(TempMediaTestCase):
+    # 工作线程只遍历磁盘，数据库由主线程写入，可以在测试的事务中使用多个工作线程
+
+    def sync(self, *args):
+        out = StringIO()
+        call_command("ueditor_sync_catalog", *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def catalog(self):
+        return dict(MediaFile.objects.values_list("path", "size"))
+
+    def test_sync(self):
+        self.write_media("a.png", b"1")
+        self.write_media("2018/01/b.png", b"12")
+        self.write_media("2018/02/c.txt", b"123")
+        self.write_media(".ueditor_tmp/d.png", b"1234")
+        self.write_media("2019/.hidden/e.png", b"1")
+        MediaFile.objects.create(path="2018/gone.png", ext=".png", size=1, mtime=0)
+        self.assertIn("Scanned 3 files", self.sync("--workers", "3"))
+        self.assertEqual(self.catalog(), {"a.png": 1, "2018/01/b.png": 2, "2018/02/c.txt": 3, "2018/gone.png": 1})
+
+        # 只更新有变化的文件
+        filename = self.write_media("2018/01/b.png", b"12345")
+        os.utime(filename, (1000, 1000))
+        self.write_media("2018/02/f.png", b"1")
+        self.assertIn("1 added, 1 updated, 0 removed", self.sync())
+        self.assertEqual(MediaFile.objects.get(path="2018/01/b.png").mtime, 1000)
+        self.assertIn("0 added, 0 updated, 0 removed", self.sync("--workers", "1"))
+
+        # --prune删除文件已不存在的记录，--path只处理指定目录
+        os.remove(os.path.join(self.media_root, "a.png"))
+        self.assertIn("0 added, 0 updated, 1 removed", self.sync("--path", "2018", "--prune"))
+        self.assertIn("a.png", self.catalog())
+        self.assertIn("0 added, 0 updated, 1 removed", self.sync("--prune", "--batch-size", "1"))
+        self.assertEqual(sorted(self.catalog()), ["2018/01/b.png", "2018/02/c.txt", "2018/02/f.png"])
+
+    def test_sync_tree_not_recursive(self):
+        self.write_media("uploads/a.png")
+        self.write_media("uploads/sub/b.png")
+        MediaFile.objects.create(path="uploads/sub/c.png", ext=".png", size=1, mtime=0)
+        self.assertEqual(catalog.sync_tree(self.media_root, "uploads", recursive=False, prune=True), (1, 1, 0, 0))
+        self.assertEqual(sorted(self.catalog()), ["uploads/a.png", "uploads/sub/c.png"])
+
+    def test_requires_local_storage(self):
+        self.use_settings(storage="DjangoUeditor.storage.S3Storage", storageOptions={
+            "bucket": "media", "endpoint_url": "file://" + os.path.join(self.tmp, "s3")})
+        with self.assertRaises(CommandError):
+            self.sync()
+
+    def test_missing_path(self):
+        self.assertIn("is not a directory", self.sync("--path", "missing"))
+        self.assertEqual(MediaFile.objects.count(), 0)
+
+
+class ChunkUploadTests(TempMediaTestCase):
+    data = b"0123456789abcdefghij"
+
+    def post(self, index, chunks=4, name="a.txt", upload_id="upload-0001", data=None, size=None):
+        if data is None:
+            data = self.data[index * 5:index * 5 + 5]
+        response = self.client.post(
+            "/controller/?action=uploadchunk&type=file&uploadId=%s&filePathFormat=files/%%(filename)s" % upload_id,
+            {"upfile": SimpleUploadedFile("blob", data), "chunk": index, "chunks": chunks,
+             "size": len(self.data) if size is None else size, "name": name})
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_out_of_order_and_duplicate_chunks(self):
+        for index in (2, 0, 2):
+            result = self.post(index)
+            self.assertEqual(result["state"], "SUCCESS")
+        self.assertEqual(result["chunks"], [0, 2])
+        # 查询已收到的分块，续传剩下的分块
+        response = self.client.get("/controller/?action=uploadchunk&uploadId=upload-0001")
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["chunks"], [0, 2])
+        self.assertEqual(self.post(3)["chunks"], [0, 2, 3])
+        result = self.post(1)
+        self.assertEqual((result["state"], result["url"], result["size"]), ("SUCCESS", "/media/files/a.txt", 20))
+        with storage.get_storage().open("files/a.txt") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(chunked.get_staging_path("upload-0001")))
+        self.assertEqual(list(MediaFile.objects.values_list("path", "size")), [("files/a.txt", 20)])
+        # 重复的分块只计入一次
+        usage = UploadUsage.objects.get(key=quota.SITE_KEY)
+        self.assertEqual((usage.size, usage.count), (20, 1))
+
+    def test_rejected_chunks(self):
+        for upload_id in ("short", "../../etc/passwd-x", ""):
+            self.assertEqual(self.post(0, upload_id=upload_id)["state"], u"上传ID不正确")
+        for index in (4, -1, "x"):
+            self.assertEqual(self.post(index, data=b"x")["state"], u"分块编号不正确")
+        self.assertTrue(self.post(0, name="a.exe")["state"].startswith(u"服务器不允许上传.exe类型"))
+        self.assertFalse(os.path.exists(chunked.get_staging_root()))
+        # 之后的分块必须与第一个分块的文件信息一致
+        self.assertEqual(self.post(0)["state"], "SUCCESS")
+        self.assertEqual(self.post(1, size=99)["state"], u"分块信息与之前的上传不一致")
+        self.assertEqual(self.post(1, chunks=5)["state"], u"分块信息与之前的上传不一致")
+        self.assertEqual(sorted(chunked.received_chunks(chunked.get_staging_path("upload-0001"))), [0])
+        self.assertEqual(UploadUsage.objects.get(key=quota.SITE_KEY).size, 5)
+
+
+class DedupTests(TempMediaTestCase):
+    def save(self, path_format, data):
+        return dedup.save_upload_file(SimpleUploadedFile("a.txt", data), path_format)
+
+    def test_same_content(self):
+        self.assertEqual(self.save("\\files/a.txt", b"hello"), ("SUCCESS", "files/a.txt", True))
+        self.assertEqual(self.save("files/b.txt", b"hello"), ("SUCCESS", "files/a.txt", False))
+        self.assertFalse(storage.get_storage().exists("files/b.txt"))
+        self.assertEqual(self.save("files/c.txt", b"world"), ("SUCCESS", "files/c.txt", True))
+        blob = MediaBlob.objects.get(path="files/a.txt")
+        self.assertEqual((blob.size, blob.refcount), (5, 0))
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "tmp")), [])
+
+    def test_reuse_touches_catalog(self):
+        self.save("files/a.txt", b"hello")
+        MediaFile.objects.create(path="files/a.txt", ext=".txt", size=5, mtime=0)
+        self.save("files/b.txt", b"hello")
+        # 再次使用的文件从此时重新计算ueditor_gc的保留期
+        self.assertGreater(MediaFile.objects.get().mtime, time.time() - 60)
+
+    def test_refcounts(self):
+        self.save("files/a.txt", b"hello")
+        self.save("files/c.txt", b"world")
+        dedup.set_refcounts({"/files/a.txt": 2, "files/other.txt": 1})
+        dedup.release_blobs(["files/a.txt", "files/c.txt"])
+        self.assertEqual(dedup.referenced_blobs(["files/a.txt", "files/c.txt", "files/other.txt"]),
+                         set(["files/a.txt"]))
+        dedup.set_refcounts({"files/a.txt": 0, "\\files\\c.txt": 3})
+        self.assertEqual(sorted(MediaBlob.objects.values_list("path", "refcount")),
+                         [("files/a.txt", 0), ("files/c.txt", 3)])
+
+    def test_missing_blob_file(self):
+        self.save("files/a.txt", b"hello")
+        storage.get_storage().delete("files/a.txt")
+        self.assertEqual(self.save("files/b.txt", b"hello"), ("SUCCESS", "files/b.txt", True))
+        self.assertEqual(list(MediaBlob.objects.values_list("path", "refcount")), [("files/b.txt", 0)])
+
+    def test_upload_view(self):
+        self.use_settings(contentAddressed=True)
+        urls = []
+        for name in ("a.txt", "b.txt"):
+            response = self.client.post("/controller/?action=uploadfile&filePathFormat=files/%(filename)s",
+                                        {"upfile": SimpleUploadedFile(name, b"hello")})
+            result = json.loads(response.content.decode("utf-8"))
+            self.assertEqual(result["state"], "SUCCESS")
+            urls.append(result["url"])
+        self.assertEqual(urls, ["/media/files/a.txt", "/media/files/a.txt"])
+        # 重复的文件不登记、不计入配额
+        self.assertEqual(list(MediaFile.objects.values_list("path", flat=True)), ["files/a.txt"])
+        usage = UploadUsage.objects.get(key=quota.SITE_KEY)
+        self.assertEqual((usage.size, usage.count), (5, 1))
+
+
+class DerivativeTests(TempMediaTestCase):
+    def setUp(self):
+        super(DerivativeTests, self).setUp()
+        self.use_settings(derivativeEnable=True, thumbnailSizes=[[20, 20]], thumbnailWebp=True)
+
+    def test_enqueue(self):
+        self.assertIsNone(derivatives.enqueue("uploads/a.txt"))
+        job = derivatives.enqueue("\\uploads\\a.PNG")
+        self.assertEqual((job.path, job.status), ("uploads/a.PNG", DerivativeJob.STATUS_PENDING))
+        with ueditor_settings(derivativeEnable=False):
+            self.assertIsNone(derivatives.enqueue("uploads/b.png"))
+        self.use_settings(storage="DjangoUeditor.storage.S3Storage", storageOptions={
+            "bucket": "media", "endpoint_url": "file://" + os.path.join(self.tmp, "s3")})
+        self.assertIsNone(derivatives.enqueue("uploads/b.png"))
+
+    def test_derivative_path(self):
+        self.assertEqual(derivatives.derivative_path("uploads/a.png", 200, 100), "uploads/.thumbs/a_200x100.png")
+        self.assertEqual(derivatives.derivative_path("a.png", 20, 20, ".webp"), ".thumbs/a_20x20.webp")
+
+    def test_claim_and_finish(self):
+        jobs = [DerivativeJob.objects.create(path="uploads/%d.png" % i) for i in range(3)]
+        claimed = derivatives.claim_jobs(2)
+        self.assertEqual([job.pk for job in claimed], [jobs[0].pk, jobs[1].pk])
+        self.assertEqual([job.pk for job in derivatives.claim_jobs(5)], [jobs[2].pk])
+        self.assertEqual(derivatives.claim_jobs(5), [])
+
+        # 只有超过租期的任务重新排队
+        self.assertEqual(derivatives.requeue_expired_jobs(60), 0)
+        DerivativeJob.objects.filter(pk=jobs[2].pk).update(claimed_time=time.time() - 61)
+        self.assertEqual(derivatives.requeue_expired_jobs(60), 1)
+        self.assertEqual([job.pk for job in derivatives.claim_jobs(5)], [jobs[2].pk])
+
+        MediaFile.objects.create(path="uploads/0.png", ext=".png", mtime=0)
+        derivatives.finish_job(claimed[0], thumbnail="uploads/.thumbs/0_20x20.png")
+        self.assertEqual(MediaFile.objects.get().thumbnail, "uploads/.thumbs/0_20x20.png")
+        self.assertEqual(DerivativeJob.objects.get(pk=jobs[0].pk).status, DerivativeJob.STATUS_DONE)
+
+        # 失败的任务重新排队，达到最多次数后不再处理
+        job = claimed[1]
+        derivatives.finish_job(job, error="broken", max_attempts=2)
+        self.assertEqual((job.status, job.attempts), (DerivativeJob.STATUS_PENDING, 1))
+        derivatives.finish_job(derivatives.claim_jobs(1)[0], error="broken", max_attempts=2)
+        job = DerivativeJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.attempts, job.error), (DerivativeJob.STATUS_FAILED, 2, "broken"))
+
+    @skipUnless(Image, "Pillow is not installed")
+    def test_command(self):
+        Image.new("RGB", (100, 50), "red").save(self.write_media("uploads/a.jpg"), "JPEG")
+        self.write_media("uploads/broken.png", b"not an image")
+        for path in ("uploads/a.jpg", "uploads/broken.png"):
+            MediaFile.objects.create(path=path, ext=os.path.splitext(path)[1], mtime=0)
+            derivatives.enqueue(path)
+        # 上次中断时处理中的任务，超过了租期
+        DerivativeJob.objects.filter(path="uploads/a.jpg").update(status=DerivativeJob.STATUS_RUNNING)
+        # 另一个worker正在处理的任务
+        DerivativeJob.objects.create(path="uploads/b.png", status=DerivativeJob.STATUS_RUNNING,
+                                     claimed_time=time.time())
+
+        err = StringIO()
+        call_command("ueditor_derivatives", "--once", "--workers", "1", stdout=StringIO(), stderr=err)
+        self.assertIn("uploads/broken.png", err.getvalue())
+        self.assertEqual(MediaFile.objects.get(path="uploads/a.jpg").thumbnail, "uploads/.thumbs/a_20x20.jpg")
+        thumb = Image.open(os.path.join(self.media_root, "uploads", ".thumbs", "a_20x20.jpg"))
+        self.assertEqual(thumb.size, (20, 10))
+        Image.init()
+        self.assertEqual(os.path.exists(os.path.join(self.media_root, "uploads", ".thumbs", "a_20x20.webp")),
+                         "WEBP" in Image.SAVE)
+        self.assertEqual(DerivativeJob.objects.get(path="uploads/a.jpg").status, DerivativeJob.STATUS_DONE)
+        # 失败的任务重新排队，直到达到最多次数
+        job = DerivativeJob.objects.get(path="uploads/broken.png")
+        self.assertEqual((job.status, job.attempts), (DerivativeJob.STATUS_FAILED, 3))
+        self.assertEqual(DerivativeJob.objects.get(path="uploads/b.png").status, DerivativeJob.STATUS_RUNNING)
+
+
+class ScrawlTests(TempMediaTestCase):
+    data = bytes(bytearray(range(256))) * 3
+    # base64中的+、/和=都被编码为%XX
+    value = quote_plus(base64.encodebytes(data) if hasattr(base64, "encodebytes") else base64.encodestring(data))
+    body = ("a=1&empty&up%66ile2=x&" + "upfile=" + value + "&b=2").encode("ascii")
+
+    def decode(self, body, chunk_size, field_name="upfile"):
+        return b"".join(scrawl.iter_field_value(io.BytesIO(body), field_name, chunk_size))
+
+    def test_iter_field_value(self):
+        expected = scrawl.url_unquote(self.value.encode("ascii"))
+        self.assertIn(b"\n", expected)
+        # 任意分块大小，字段名和%XX被截断在两个分块之间时都能正确解码
+        for chunk_size in list(range(1, 20)) + [scrawl.CHUNK_SIZE]:
+            self.assertEqual(self.decode(self.body, chunk_size), expected, chunk_size)
+        self.assertEqual(self.decode(self.body, 3, "upfile2"), b"x")
+        self.assertEqual(self.decode(b"up%66ile=a%2Bb+c", 2), b"a+b c")
+        self.assertEqual(self.decode(b"upfile=abc%2", 4), b"abc%2")
+        self.assertEqual(self.decode(self.body, 5, "missing"), b"")
+        self.assertEqual(self.decode(b"upfile=", 5), b"")
+
+    def test_key_too_long(self):
+        with self.assertRaises(scrawl.ScrawlError):
+            self.decode(b"x" * (scrawl.MAX_KEY_LENGTH + 10), 100)
+
+    def test_iter_base64_decode(self):
+        encoded = base64.b64encode(self.data)
+        for size in (1, 3, 4, 7, 100):
+            chunks = [encoded[i:i + size] + b"\r\n" for i in range(0, len(encoded), size)]
+            self.assertEqual(b"".join(scrawl.iter_base64_decode(chunks)), self.data)
+        # 缺少结尾的=
+        self.assertEqual(b"".join(scrawl.iter_base64_decode([b"YWJjZA"])), b"abcd")
+
+    def test_save_scrawl(self):
+        filename = os.path.join(self.tmp, "a.png")
+        chunks = [base64.b64encode(self.data)]
+        self.assertEqual(scrawl.save_scrawl(chunks, filename, len(self.data)), len(self.data))
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        with self.assertRaises(scrawl.ScrawlError):
+            scrawl.save_scrawl(chunks, filename, len(self.data) - 1)
+        self.assertFalse(os.path.exists(filename))
+        with self.assertRaises(scrawl.ScrawlError):
+            scrawl.save_scrawl([b"", b"\r\n"], filename)
+        self.assertFalse(os.path.exists(filename))
+
+    def upload(self, body, query=""):
+        response = self.client.post("/controller/?action=uploadscrawl&scrawlPathFormat=scrawl/%(rnd)s" + query,
+                                    body, content_type="application/x-www-form-urlencoded")
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_upload_view(self):
+        result = self.upload(self.body)
+        self.assertEqual((result["state"], result["size"]), ("SUCCESS", len(self.data)))
+        with storage.get_storage().open(result["url"][len("/media/"):]) as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(UploadUsage.objects.get(key=quota.SITE_KEY).size, len(self.data))
+
+        result = self.upload(self.body, "&scrawlMaxSize=100")
+        self.assertTrue(result["state"].startswith(u"上传文件大小不允许超过"))
+        self.assertEqual(self.upload(b"a=1")["state"], u"没有涂鸦数据")
+        self.assertEqual(MediaFile.objects.count(), 1)
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "tmp")), [])
+
+
+class ConfigTests(TempMediaTestCase):
+    def get(self, **headers):
+        return self.client.get("/controller/?action=config", **headers)
+
+    def test_identity_and_gzip(self):
+        response = self.get()
+        self.assertEqual(response.content, USettings.UEditorConfigCache["content"])
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["imageActionName"], "uploadimage")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        compressed = self.get(HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed.content)).read(), response.content)
+        # 两种编码的内容不同，ETag也不同
+        self.assertEqual(compressed["ETag"], response["ETag"][:-1] + '-gzip"')
+
+    def test_not_modified(self):
+        etag = self.get()["ETag"]
+        for if_none_match in (etag, "W/" + etag, '"other", ' + etag, '"other", *', "*"):
+            response = self.get(HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual((response.status_code, response.content), (304, b""), if_none_match)
+            self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        # 未压缩内容的ETag不能用于压缩的内容
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_ENCODING="gzip").status_code, 200)
+        gzip_etag = self.get(HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH="W/" + gzip_etag, HTTP_ACCEPT_ENCODING="gzip").status_code, 304)
+
+
+@skipUnless(Image, "Pillow is not installed")
+class ResizeTests(TempMediaTestCase):
+    def setUp(self):
+        super(ResizeTests, self).setUp()
+        self.use_settings(resizeWidths=[320], resizeHeights=[100], resizeCachePath=os.path.join(self.tmp, "resized"))
+        resize._cache_size[0] = None
+        self.addCleanup(resize._cache_size.__setitem__, 0, None)
+        Image.new("RGB", (640, 480), "blue").save(self.write_media("uploads/a.png"), "PNG")
+        # 记录实际缩放的次数
+        self.resized = []
+        resize_image = resize.resize_image
+        self.addCleanup(setattr, resize, "resize_image", resize_image)
+        resize.resize_image = lambda *args: self.resized.append(args[2:]) or resize_image(*args)
+
+    def get(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            return response.status_code, None
+        content = b"".join(response.streaming_content)
+        response.close()
+        return response.status_code, Image.open(io.BytesIO(content))
+
+    def test_keep_aspect_ratio(self):
+        status, image = self.get("/media-resize/320x0/uploads/a.png")
+        self.assertEqual((status, image.size, image.format), (200, (320, 240), "PNG"))
+        status, image = self.get("/media-resize/320x100/uploads/a.png")
+        self.assertEqual(image.size, (133, 100))
+
+    def test_not_found(self):
+        for url in ("/media-resize/321x0/uploads/a.png", "/media-resize/320x99/uploads/a.png",
+                    "/media-resize/320x0/uploads/missing.png", "/media-resize/320x0/../settings.py",
+                    "/media-resize/320x0/uploads/.thumbs/a.png"):
+            self.assertEqual(self.get(url), (404, None), url)
+        self.assertEqual(self.resized, [])
+
+    def test_cache_hit(self):
+        self.get("/media-resize/320x0/uploads/a.png")
+        status, image = self.get("/media-resize/320x0/uploads/a.png")
+        self.assertEqual((status, image.size), (200, (320, 240)))
+        self.assertEqual(self.resized, [(320, 0)])
+        # 原图更新后重新缩放
+        time.sleep(0.01)
+        Image.new("RGB", (320, 320), "red").save(os.path.join(self.media_root, "uploads", "a.png"), "PNG")
+        status, image = self.get("/media-resize/320x0/uploads/a.png")
+        self.assertEqual((image.size, self.resized), ((320, 320), [(320, 0), (320, 0)]))
+
+    def test_evict_least_recently_used(self):
+        first = resize.get_resized_file("uploads/a.png", 320, 0)
+        second = resize.get_resized_file("uploads/a.png", 320, 100)
+        os.utime(first, (0, 0))
+        self.use_settings(resizeCacheMaxSize=os.path.getsize(second) + os.path.getsize(first) // 2)
+        resize.touch(second)
+        resize._cache_size[0] = None
+        resize.add_cache_size(0)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+
+class ShardingTests(TempMediaTestCase):
+    def test_default_path_format(self):
+        with ueditor_settings(defaultPathFormat="sharded"):
+            self.assertEqual(sharding.get_default_path_format(), sharding.SHARDED_PATH_FORMAT)
+        with ueditor_settings(defaultPathFormat="%(basename)s.%(extname)s"):
+            self.assertEqual(sharding.get_default_path_format(), "%(basename)s.%(extname)s")
+
+    def test_format_path(self):
+        path_format_var = {"basename": "a", "extname": "png", "year": "2016"}
+        path = sharding.format_path("uploads/%(year)s/%(shard)s/%(basename)s.%(extname)s", path_format_var)
+        # 与ueditor_shard_media一样按文件名分片
+        self.assertEqual(path, "uploads/2016/%s/a.png" % sharding.shard_of("a.png"))
+        self.assertEqual(sharding.format_path("%(basename)s.%(extname)s", path_format_var), "a.png")
+
+    def test_sharded_path(self):
+        mtime = time.mktime((2016, 5, 3, 12, 0, 0, 0, 0, -1))
+        shard = sharding.shard_of("a.png")
+        self.assertEqual(len(shard), 2)
+        self.assertEqual(sharding.sharded_path("uploads/a.png", mtime), "uploads/2016/05/03/%s/a.png" % shard)
+        self.assertEqual(sharding.sharded_path("a.png", mtime), "2016/05/03/%s/a.png" % shard)
+
+    def shard(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("ueditor_shard_media", *args, stdout=out, stderr=err)
+        return out.getvalue() + err.getvalue()
+
+    @skipUnless(apps.is_installed("news"), "news is not installed")
+    def test_command(self):
+        Article = apps.get_model("news", "Article")
+        mtime = time.mktime((2016, 5, 3, 12, 0, 0, 0, 0, -1))
+        for name in ("a b.png", "c.txt"):
+            os.utime(self.write_media("uploads/" + name), (mtime, mtime))
+            MediaFile.objects.create(path="uploads/" + name, ext=os.path.splitext(name)[1], mtime=mtime)
+        self.write_media("uploads/sub/d.png")
+        article = Article.objects.create(title="a", slug="a", content=(
+            '<img src="/media/uploads/a%20b.png"><a href="/media/uploads/c.txt">c</a>'
+            '<img src="/media/uploads/sub/d.png">'))
+        new_a = sharding.sharded_path("uploads/a b.png", mtime)
+        new_c = sharding.sharded_path("uploads/c.txt", mtime)
+        old_update_time = article.update_time
+
+        output = self.shard("--path", "uploads", "--dry-run")
+        self.assertIn("2 files would be moved", output)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, "uploads", "a b.png")))
+
+        output = self.shard("--path", "uploads", "--batch-size", "1")
+        self.assertIn("Moved 2 files, skipped 0", output)
+        self.assertIn("Rewrote 1 news.Article.content rows", output)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, new_a)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, "uploads", "sub", "d.png")))
+        self.assertEqual(sorted(MediaFile.objects.values_list("path", flat=True)), sorted([new_a, new_c]))
+        content = Article.objects.get(pk=article.pk).content
+        self.assertIn('src="%s"' % storage.file_url(new_a), content)
+        self.assertIn('href="/media/%s"' % new_c, content)
+        self.assertIn('src="/media/uploads/sub/d.png"', content)
+
+        # 保存文章的处理随之执行：更新时间、引用表
+        article = Article.objects.get(pk=article.pk)
+        self.assertGreater(article.update_time, old_update_time)
+        self.assertEqual(sorted(article.media.values_list("path", flat=True)), sorted([new_a, new_c, "uploads/sub/d.png"]))
+        # 重写完成后删除日志
+        journal = os.path.join(self.media_root, ".ueditor_shard.log")
+        self.assertFalse(os.path.exists(journal))
+
+        # 在重写引用之前中断：重新运行时按日志重写
+        with io.open(journal, "w", encoding="utf-8") as f:
+            f.write(u"uploads/c.txt\t%s\n" % new_c)
+        Article.objects.filter(pk=article.pk).update(content='<img src="/media/uploads/c.txt">')
+        self.assertIn("Moved 0 files", self.shard("--path", "uploads"))
+        self.assertEqual(Article.objects.get(pk=article.pk).content, '<img src="/media/%s">' % new_c)
+        self.assertFalse(os.path.exists(journal))
+
+    def test_target_exists(self):
+        mtime = time.mktime((2016, 5, 3, 12, 0, 0, 0, 0, -1))
+        os.utime(self.write_media("uploads/a.png", b"old"), (mtime, mtime))
+        self.write_media(sharding.sharded_path("uploads/a.png", mtime), b"new")
+        self.assertIn("already exists", self.shard("--path", "uploads"))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, "uploads", "a.png")))
+        with self.assertRaises(CommandError):
+            self.shard("--path", "missing")
+
+
+@skipUnless(apps.is_installed("news"), "news is not installed")
+class GarbageCollectTests(TempMediaMixin, TransactionTestCase):
+    # 命令在提取引用前关闭数据库连接，不能在一个事务中运行
+
+    def setUp(self):
+        super(GarbageCollectTests, self).setUp()
+        old = time.time() - 30 * 86400
+        for path, size in (("uploads/used.png", 1), ("uploads/orphan.png", 2),
+                           ("uploads/.thumbs/orphan_20x20.png", 0), ("uploads/.thumbs/orphan_200x200.png", 0),
+                           ("uploads/.thumbs/orphan_200x200.webp", 0), ("other/orphan.png", 4)):
+            os.utime(self.write_media(path, b"x" * size), (old, old))
+            if size:
+                MediaFile.objects.create(path=path, ext=".png", size=size, mtime=old)
+        MediaFile.objects.filter(path="uploads/orphan.png").update(thumbnail="uploads/.thumbs/orphan_20x20.png")
+        self.write_media("uploads/new.png", b"x" * 8)
+        MediaFile.objects.create(path="uploads/new.png", ext=".png", size=8, mtime=time.time())
+        MediaBlob.objects.create(sha1="0" * 40, path="uploads/orphan.png", size=2)
+        UploadUsage.objects.create(key=quota.SITE_KEY, size=15, count=4)
+        apps.get_model("news", "Article").objects.create(
+            title="a", slug="a", content='<img src="/media/uploads/used.png">')
+        self.quarantine_root = os.path.join(self.tmp, "ueditor_quarantine")
+
+    def gc(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("ueditor_gc", "--workers", "1", *args, stdout=out, stderr=err)
+        return out.getvalue() + err.getvalue()
+
+    def media_exists(self, path):
+        return os.path.exists(os.path.join(self.media_root, path))
+
+    def remaining(self):
+        return sorted(MediaFile.objects.values_list("path", flat=True))
+
+    def test_dry_run(self):
+        output = self.gc("--dry-run")
+        self.assertIn("uploads/orphan.png\nother/orphan.png\n2 unreferenced files", output.replace("\r", ""))
+        self.assertEqual(len(self.remaining()), 4)
+        self.assertTrue(self.media_exists("uploads/orphan.png"))
+        self.assertFalse(os.path.exists(self.quarantine_root))
+
+    def test_quarantine(self):
+        output = self.gc("--path", "uploads", "--batch-size", "1")
+        self.assertIn("Quarantined to %s: 1 unreferenced files" % self.quarantine_root, output)
+        # 隔离目录在MEDIA_ROOT之外
+        self.assertFalse(self.media_exists("uploads/orphan.png"))
+        self.assertFalse(self.media_exists("uploads/.thumbs/orphan_20x20.png"))
+        self.assertTrue(os.path.exists(os.path.join(self.quarantine_root, "uploads", "orphan.png")))
+        self.assertTrue(os.path.exists(os.path.join(self.quarantine_root, "uploads", ".thumbs", "orphan_20x20.png")))
+        # thumbnailSizes中其他尺寸的缩略图和WebP一起隔离
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads", ".thumbs")), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.quarantine_root, "uploads", ".thumbs"))), 3)
+        self.assertEqual(self.remaining(), ["other/orphan.png", "uploads/new.png", "uploads/used.png"])
+        self.assertFalse(MediaBlob.objects.exists())
+        usage = UploadUsage.objects.get(key=quota.SITE_KEY)
+        self.assertEqual((usage.size, usage.count), (13, 3))
+
+    def test_quarantine_path(self):
+        quarantine_root = os.path.join(self.tmp, "q")
+        self.use_settings(quarantinePath=quarantine_root)
+        self.assertIn("Quarantined to %s: 2" % quarantine_root, self.gc())
+        self.assertTrue(os.path.exists(os.path.join(quarantine_root, "other", "orphan.png")))
+
+    def test_quarantine_inside_media_root(self):
+        for path in (self.media_root, os.path.join(self.media_root, "quarantine")):
+            with self.assertRaises(CommandError):
+                self.gc("--quarantine", path)
+        self.assertEqual(len(self.remaining()), 4)
+
+    def test_delete(self):
+        self.assertIn("Deleted 2 unreferenced files", self.gc("--delete", "--grace-days", "10"))
+        self.assertFalse(self.media_exists("uploads/orphan.png"))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads", ".thumbs")), [])
+        self.assertFalse(os.path.exists(self.quarantine_root))
+        self.assertEqual(self.remaining(), ["uploads/new.png", "uploads/used.png"])
+        self.assertEqual(UploadUsage.objects.get(key=quota.SITE_KEY).size, 9)
+
+    def test_referenced_blob_is_kept(self):
+        MediaBlob.objects.filter(path="uploads/orphan.png").update(refcount=1)
+        self.assertIn("Deleted 1 unreferenced files", self.gc("--delete"))
+        self.assertTrue(self.media_exists("uploads/orphan.png"))
+        self.assertEqual(self.remaining(), ["uploads/new.png", "uploads/orphan.png", "uploads/used.png"])
+
+    def test_sweep_chunks(self):
+        old = time.time() - 3 * 86400
+        for upload_id, age in (("abandoned", old), ("active-upload", time.time())):
+            staging_path = chunked.get_staging_path(upload_id)
+            os.makedirs(staging_path)
+            chunked.save_meta(staging_path, {"owner": None})
+            chunked.save_chunk(staging_path, 0, ContentFile(b"x" * 5))
+            for name in os.listdir(staging_path) + [""]:
+                os.utime(os.path.join(staging_path, name), (age, age))
+        self.assertIn("Found 1 abandoned chunked uploads", self.gc("--dry-run", "--chunk-days", "1"))
+        self.assertTrue(os.path.isdir(chunked.get_staging_path("abandoned")))
+        self.assertIn("Removed 1 abandoned chunked uploads", self.gc("--chunk-days", "1"))
+        self.assertFalse(os.path.exists(chunked.get_staging_path("abandoned")))
+        self.assertTrue(os.path.isdir(chunked.get_staging_path("active-upload")))
+        # 减去暂存的5字节和两个未引用文件
+        self.assertEqual(UploadUsage.objects.get(key=quota.SITE_KEY).size, 4)
+
+
+class QuotaTests(TempMediaTestCase):
+    def setUp(self):
+        super(QuotaTests, self).setUp()
+        self.use_settings(siteQuota=100, userQuota=30)
+        self.user = get_user_model().objects.create_user("editor", password="secret")
+
+    def usage(self, key=quota.SITE_KEY):
+        usage = UploadUsage.objects.filter(key=key).first()
+        return (usage.size, usage.count) if usage else None
+
+    def test_charge_and_release(self):
+        user_key = quota.user_key(self.user.pk)
+        self.assertIsNone(quota.check(self.user.pk, 30))
+        self.assertIsNotNone(quota.check(self.user.pk, 31))
+        self.assertIsNone(quota.charge(self.user.pk, 20))
+        self.assertEqual((self.usage(), self.usage(user_key)), ((20, 1), (20, 1)))
+
+        # 超出用户配额时全站用量也不计入
+        self.assertIsNotNone(quota.charge(self.user.pk, 11))
+        self.assertEqual((self.usage(), self.usage(user_key)), ((20, 1), (20, 1)))
+        self.assertIsNone(quota.charge(self.user.pk, 10, count=0))
+        self.assertEqual(self.usage(user_key), (30, 1))
+
+        # 未登录只计入全站用量
+        self.assertIsNone(quota.charge(None, 70))
+        self.assertTrue(quota.charge(None, 1).startswith(u"上传空间不足"))
+        self.assertEqual(self.usage(), (100, 2))
+
+        quota.release(self.user.pk, 10, count=0)
+        self.assertEqual((self.usage(), self.usage(user_key)), ((90, 2), (20, 1)))
+        quota.adjust(None, 5, 1)
+        self.assertEqual(self.usage(), (95, 3))
+        quota.release_files([(self.user.pk, 20), (None, 5)])
+        self.assertEqual((self.usage(), self.usage(user_key)), ((70, 1), (0, 0)))
+
+    def test_unlimited(self):
+        self.use_settings(siteQuota=0, userQuota=0)
+        self.assertIsNone(quota.check(self.user.pk, 10 ** 12))
+        self.assertIsNone(quota.charge(self.user.pk, 10 ** 12))
+        self.assertEqual(self.usage(quota.user_key(self.user.pk)), (10 ** 12, 1))
+
+    def test_deleted_usage_row(self):
+        self.assertIsNone(quota.charge(self.user.pk, 10))
+        # 其他进程确认过计数行存在之后，计数行被删除
+        UploadUsage.objects.all().delete()
+        self.assertIsNone(quota.charge(self.user.pk, 10))
+        self.assertEqual((self.usage(), self.usage(quota.user_key(self.user.pk))), ((10, 1), (10, 1)))
+        UploadUsage.objects.all().delete()
+        self.use_settings(siteQuota=0, userQuota=0)
+        self.assertIsNone(quota.charge(None, 10))
+        self.assertEqual(self.usage(), (10, 1))
+
+    def test_reconcile(self):
+        MediaFile.objects.create(path="a.png", ext=".png", size=10, mtime=0, owner=self.user)
+        MediaFile.objects.create(path="b.png", ext=".png", size=5, mtime=0)
+        staging_path = chunked.get_staging_path("upload-0001")
+        os.makedirs(staging_path)
+        chunked.save_meta(staging_path, {"owner": self.user.pk})
+        chunked.save_chunk(staging_path, 0, ContentFile(b"x" * 3))
+        UploadUsage.objects.create(key=quota.user_key(12345), size=99, count=9)
+        UploadUsage.objects.create(key=quota.SITE_KEY, size=1, count=1)
+
+        quota.reconcile()
+        self.assertEqual(self.usage(), (18, 2))
+        self.assertEqual(self.usage(quota.user_key(self.user.pk)), (13, 1))
+        self.assertEqual(self.usage(quota.user_key(12345)), (0, 0))
+
+    def upload(self, size):
+        response = self.client.post("/controller/?action=uploadfile&filePathFormat=files/%(filename)s",
+                                    {"upfile": SimpleUploadedFile("a%d.txt" % size, b"x" * size)})
+        return json.loads(response.content.decode("utf-8"))["state"]
+
+    def test_upload_view(self):
+        self.client.login(username="editor", password="secret")
+        self.assertEqual(self.upload(20), "SUCCESS")
+        self.assertTrue(self.upload(20).startswith(u"上传空间不足"))
+        # 超出配额的文件没有写入
+        self.assertEqual(storage.get_storage().listdir("files")[1], ["a20.txt"])
+        self.assertEqual(self.usage(quota.user_key(self.user.pk)), (20, 1))
+        self.assertEqual(list(MediaFile.objects.values_list("path", "owner_id")), [("files/a20.txt", self.user.pk)])
+
+
+class RateLimitTests(TempMediaTestCase):
+    def setUp(self):
+        super(RateLimitTests, self).setUp()
+        self.use_settings(rateLimits={"listimage": [1, 2], "*": [0.5, 1]}, rateLimitCache="default")
+        caches["default"].clear()
+        ratelimit._local_buckets.clear()
+        self.addCleanup(caches["default"].clear)
+        self.addCleanup(ratelimit._local_buckets.clear)
+
+    def request(self, ip="10.0.0.1", **extra):
+        return RequestFactory().get("/controller/", REMOTE_ADDR=ip, **extra)
+
+    def test_consume(self):
+        allowed, bucket = ratelimit.consume(None, 1, 2, 100)
+        self.assertEqual((allowed, bucket), (True, (1, 100)))
+        allowed, bucket = ratelimit.consume(bucket, 1, 2, 100)
+        self.assertEqual((allowed, bucket), (True, (0, 100)))
+        allowed, bucket = ratelimit.consume(bucket, 1, 2, 100.5)
+        self.assertEqual((allowed, bucket), (False, (0.5, 100.5)))
+        # 补充的令牌不超过桶容量
+        self.assertEqual(ratelimit.consume(bucket, 1, 2, 1000), (True, (1, 1000)))
+
+    def test_get_limit(self):
+        self.assertEqual(ratelimit.get_limit("listimage"), (1.0, 2.0))
+        self.assertEqual(ratelimit.get_limit("uploadimage"), (0.5, 1.0))
+        self.use_settings(rateLimits={"listimage": [1, 2]})
+        self.assertIsNone(ratelimit.get_limit("uploadimage"))
+        self.assertEqual(ratelimit.check(self.request(), "uploadimage"), 0)
+
+    def check_limits(self, max_retry_after):
+        self.assertEqual(ratelimit.check(self.request(), "listimage"), 0)
+        self.assertEqual(ratelimit.check(self.request(), "listimage"), 0)
+        retry_after = ratelimit.check(self.request(), "listimage")
+        self.assertTrue(0 < retry_after <= max_retry_after)
+        # 按IP和action分别计算
+        self.assertEqual(ratelimit.check(self.request("10.0.0.2"), "listimage"), 0)
+        self.assertEqual(ratelimit.check(self.request(), "listfile"), 0)
+        self.assertTrue(1 < ratelimit.check(self.request(), "listfile") <= 2)
+
+    def test_cache(self):
+        # 窗口为burst/rate=2秒
+        self.check_limits(2)
+        self.assertEqual(ratelimit._local_buckets, {})
+
+    def test_cache_concurrent(self):
+        # 并发请求各自计数，不会都读到同一个剩余次数
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ratelimit.check(self.request(), "listimage")))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(0), 2)
+
+    def test_local_fallback(self):
+        self.use_settings(rateLimitCache="missing")
+        self.assertIsNone(ratelimit.get_cache())
+        self.check_limits(1)
+        self.assertEqual(len(ratelimit._local_buckets), 3)
+
+    def test_local_eviction(self):
+        self.use_settings(rateLimitCache="missing")
+        self.addCleanup(setattr, ratelimit, "MAX_LOCAL_BUCKETS", ratelimit.MAX_LOCAL_BUCKETS)
+        ratelimit.MAX_LOCAL_BUCKETS = 3
+        ratelimit.check(self.request(), "uploadfile")
+        for i in range(2, 5):
+            ratelimit.check(self.request("10.0.0.%d" % i), "uploadfile")
+            # 最近使用的客户端保留限制
+            self.assertTrue(ratelimit.check(self.request("10.0.0.2"), "uploadfile") > 0)
+        # 淘汰最久未使用的一个，而不是全部清空
+        self.assertEqual(len(ratelimit._local_buckets), 3)
+        self.assertEqual(ratelimit.check(self.request(), "uploadfile"), 0)
+
+    def test_client_key(self):
+        self.use_settings(rateLimitIpHeader="HTTP_X_FORWARDED_FOR")
+        request = self.request(HTTP_X_FORWARDED_FOR="1.2.3.4, 10.0.0.9")
+        self.assertEqual(ratelimit.get_client_key(request), "ip:1.2.3.4")
+        request.user = get_user_model().objects.create_user("editor")
+        self.assertEqual(ratelimit.get_client_key(request), "user:%s" % request.user.pk)
+
+    def test_controller(self):
+        for i in range(2):
+            self.assertEqual(self.client.get("/controller/?action=listimage").status_code, 200)
+        response = self.client.get("/controller/?action=listimage")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(self.client.get("/controller/?action=listfile").status_code, 200)
+
+
+class WidgetTests(TestCase):
+    def setUp(self):
+        widgets._rendered.clear()
+        self.addCleanup(widgets._rendered.clear)
+
+    def widget(self, **attrs):
+        attrs.setdefault("width", 600)
+        attrs.setdefault("height", 300)
+        return widgets.UEditorWidget(attrs)
+
+    def test_same_output_as_template(self):
+        widget = self.widget(toolbars="mini", imagePath="images/")
+        value = u'<p class="a">内容 & </textarea></p>'
+        expected = widget.render_template("content", "id_content", value, widget.get_settings())
+        # 模板中转义的内容
+        expected = expected.replace(widgets.ESCAPED_VALUE_TOKEN, conditional_escape(value))
+        self.assertEqual(widget.render("content", value), expected)
+
+    def test_memoized(self):
+        widget = self.widget(imagePath="images/")
+        first = widget.render("a", "1")
+        self.assertIn('id_a', first)
+        second = widget.render("b-c", "2")
+        self.assertIn('id_b_c', second)
+        self.assertEqual(len(widgets._rendered), 1)
+        # 相同配置的另一个实例共用同一份渲染结果
+        self.assertEqual(self.widget(imagePath="images/").render("a", "1"), first)
+        self.assertEqual(len(widgets._rendered), 1)
+        self.widget(imagePath="other/").render("a", "1")
+        self.assertEqual(len(widgets._rendered), 2)
+
+    def test_tokens_in_value(self):
+        widget = self.widget()
+        value = widgets.NAME_TOKEN + widgets.ESCAPED_VALUE_TOKEN
+        html = widget.render("content", value)
+        # 内容中的占位符文本原样输出，不会被替换
+        self.assertIn(value, html)
+
+    def test_escaped_name(self):
+        html = self.widget().render('a"b', None)
+        self.assertIn("a&quot;b", html)
+        self.assertNotIn('a"b', html)
+
+    def test_lazy_load(self):
+        value = u'<p>内容</p>'
+        script_url = bundle.get_home_url() + "ueditor.all.min.js"
+        html = self.widget().render("content", value)
+        self.assertIn('<script id="id_content" name="content"', html)
+        self.assertIn(script_url, str(self.widget().media))
+        with ueditor_settings(lazyLoad="interaction"):
+            widget = self.widget()
+            html = widget.render("content", value)
+            self.assertEqual(str(widget.media), "")
+        # 先输出同样大小的文本框，ueditor的脚本由加载器插入
+        self.assertIn('<textarea id="id_content" name="content" style="display: inline-block; '
+                      'width: 600px; height: 300px;">%s</textarea>' % conditional_escape(value), html)
+        self.assertNotIn('type="text/plain"', html)
+        self.assertIn('urls = ["%s' % bundle.get_home_url(), html)
+        self.assertIn("UE.getEditor('id_content'", html)
+        self.assertIn('if (false && "IntersectionObserver" in window)', html)
+        self.assertNotIn('rel="preload"', html)
+        with ueditor_settings(lazyLoad="visible", preload=True):
+            html = self.widget().render("content", value)
+        self.assertIn('if (true && "IntersectionObserver" in window)', html)
+        self.assertIn('<link rel="preload" href="%s" as="script">' % script_url, html)
+        # 延迟加载的配置不同，分别渲染
+        self.assertEqual(len(widgets._rendered), 3)
+
+    def test_cache_limit(self):
+        self.widget(width=1).render("a", "")
+        for i in range(widgets.MAX_RENDERED):
+            widgets._rendered["key%d" % i] = ""
+        self.widget(width=2).render("a", "")
+        self.assertEqual(len(widgets._rendered), 1)
+
+
+class BundleTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.manifest_file = os.path.join(self.tmp, "ueditor.manifest.json")
+        context = ueditor_settings(staticManifest=self.manifest_file)
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        bundle.reset_manifest()
+        self.addCleanup(bundle.reset_manifest)
+        widgets._rendered.clear()
+        self.addCleanup(widgets._rendered.clear)
+
+    def test_dialogs(self):
+        self.assertIsNone(bundle.get_buttons("full"))
+        self.assertEqual(bundle.get_buttons([["bold", "link"], "insertimage"]), set(["bold", "link", "insertimage"]))
+        self.assertEqual(bundle.get_dialogs(bundle.get_buttons("mini")), ["attachment", "link", "table"])
+        self.assertIn("scrawl", bundle.get_dialogs(None))
+
+    def test_list_files(self):
+        files = bundle.list_files(["attachment", "link", "table"])
+        self.assertIn("ueditor.all.min.js", files)
+        self.assertIn("dialogs/internal.js", files)
+        self.assertIn("dialogs/attachment/attachment.js", files)
+        # 附件对话框使用webuploader
+        self.assertTrue(any(path.startswith("third-party/webuploader/") for path in files))
+        for path in files:
+            self.assertFalse(path.startswith(("_examples/", "php/", "dialogs/scrawl/", "third-party/highcharts/")), path)
+            self.assertNotIn(path, ("ueditor.all.js", "index.html", "ueditor.parse.min.js"))
+        self.assertIn("ueditor.parse.min.js", bundle.list_files([], with_parse=True))
+
+    def build(self, *args):
+        out = StringIO()
+        call_command("ueditor_build_static", "--toolbars", "mini", "--output", self.tmp, *args, stdout=out)
+        return out.getvalue()
+
+    def test_command(self):
+        self.assertIsNone(bundle.get_manifest())
+        self.assertEqual(bundle.get_home_url(), settings.STATIC_URL + "ueditor/")
+        self.assertIn("Wrote", self.build())
+        bundle.reset_manifest()
+        manifest = bundle.get_manifest()
+        home = os.path.join(self.tmp, manifest["path"])
+        self.assertTrue(manifest["path"].startswith("ueditor-"))
+        self.assertEqual(manifest["dialogs"], ["attachment", "link", "table"])
+        self.assertEqual(sorted(manifest["files"]), sorted(bundle.list_files(manifest["dialogs"])))
+        self.assertTrue(os.path.exists(os.path.join(home, "ueditor.all.min.js.gz")))
+        self.assertFalse(os.path.exists(os.path.join(home, "dialogs", "scrawl")))
+        self.assertFalse(os.path.exists(home + ".tmp"))
+
+        # 文件没有变化时使用原来的目录
+        self.assertIn("is up to date", self.build())
+        bundle.reset_manifest()
+        self.assertEqual(bundle.get_manifest()["path"], manifest["path"])
+
+        # 页面从带散列的目录加载ueditor
+        home_url = settings.STATIC_URL + manifest["path"] + "/"
+        self.assertEqual(bundle.get_home_url(), home_url)
+        self.assertEqual(bundle.get_js_urls(), [home_url + name for name in bundle.UEDITOR_JS])
+        widget = widgets.UEditorWidget({"width": 600, "height": 300})
+        self.assertEqual(widget.get_settings()["UEDITOR_HOME_URL"], home_url)
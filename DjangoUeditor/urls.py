@@ -1,7 +1,8 @@
 # coding:utf-8
 from django.conf.urls import url,include
-from .views import get_ueditor_controller
+from .views import get_ueditor_controller, media_resize
 
 urlpatterns = [
     url(r'^controller/$', get_ueditor_controller),
+    url(r'^media-resize/(?P<width>\d+)x(?P<height>\d+)/(?P<path>.+)$', media_resize, name="ueditor_media_resize"),
 ]
@@ -39,16 +39,17 @@ class FileSize():
                     return 0
 
     # 返回字节为单位的值
+    # Python 3中是新式类，值保存在_size中，否则属性会递归调用自身
     @property
     def size(self):
-        return self.size
+        return self._size
 
     @size.setter
     def size(self, newsize):
         try:
-            self.size = long(newsize)
+            self._size = long(newsize)
         except:
-            self.size = 0
+            self._size = 0
 
     # 返回带单位的自动值
     @property
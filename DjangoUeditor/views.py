@@ -1,8 +1,20 @@
 # coding:utf-8
-from importlib import import_module
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse, Http404
 from . import settings as USettings
+from . import catalog
+from . import catcher
+from . import dedup
+from . import chunked
+from . import derivatives
+from . import resize
+from . import quota
+from . import ratelimit
+from . import scrawl
+from . import sharding
+from . import storage
+import mimetypes
 import os
+import re
 import json
 from django.views.decorators.csrf import csrf_exempt
 import datetime
@@ -22,27 +34,48 @@ def get_path_format_vars():
         "date": datetime.datetime.now().strftime("%Y%m%d"),
         "time": datetime.datetime.now().strftime("%H%M%S"),
         "datetime": datetime.datetime.now().strftime("%Y%m%d%H%M%S"),
-        "rnd": random.randrange(100, 999)
+        "rnd": random.randrange(100, 999),
     }
 
-# 保存上传的文件
+# 保存上传的文件到存储中，返回(状态,实际保存的文件名)
 
 
-def save_upload_file(PostFile, FilePath):
+def save_upload_file(PostFile, path_format):
     try:
-        f = open(FilePath, 'wb')
-        for chunk in PostFile.chunks():
-            f.write(chunk)
+        return u"SUCCESS", storage.save_file(path_format, PostFile)
     except Exception as E:
-        f.close()
-        return u"写入文件错误:" + E.message
-    f.close()
-    return u"SUCCESS"
+        return u"写入文件错误:%s" % E, path_format
+
+
+# If-None-Match中的每一项：*或(弱)ETag
+ETAG_PATTERN = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+
+def etag_matches(if_none_match, etag):
+    """按弱比较判断If-None-Match是否包含etag，W/"x"与"x"相同，*匹配任何ETag"""
+    for item in ETAG_PATTERN.findall(if_none_match):
+        if item == "*" or (item[2:] if item.startswith("W/") else item) == etag:
+            return True
+    return False
 
 
 @csrf_exempt
 def get_ueditor_settings(request):
-    return HttpResponse(json.dumps(USettings.UEditorUploadSettings, ensure_ascii=False), content_type="application/javascript")
+    """返回预先序列化的配置，支持If-None-Match和gzip，两种编码使用不同的ETag"""
+    config = USettings.UEditorConfigCache
+    use_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    etag = config["gzip_etag"] if use_gzip else config["etag"]
+    if etag_matches(request.META.get("HTTP_IF_NONE_MATCH", ""), etag):
+        response = HttpResponse(status=304)
+    elif use_gzip:
+        response = HttpResponse(config["gzip"], content_type="application/javascript")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(config["content"], content_type="application/javascript")
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=%d" % USettings.GetUeditorSettings("configMaxAge", 86400)
+    response["Vary"] = "Accept-Encoding"
+    return response
 
 
 @csrf_exempt
@@ -56,10 +89,18 @@ def get_ueditor_controller(request):
         "uploadscrawl": UploadFile,
         "uploadvideo": UploadFile,
         "uploadfile": UploadFile,
+        "uploadchunk": upload_chunk,
         "catchimage": catcher_remote_image,
         "listimage": list_files,
         "listfile": list_files
     }
+    # 超出频率限制时直接拒绝，不做任何磁盘和网络操作
+    retry_after = ratelimit.check(request, action)
+    if retry_after:
+        response = HttpResponse(json.dumps({"state": u"请求过于频繁，请稍后再试"}, ensure_ascii=False),
+                                content_type="application/javascript", status=429)
+        response["Retry-After"] = "%d" % max(int(retry_after + 0.999), 1)
+        return response
     return reponseAction[action](request)
 
 
@@ -87,12 +128,10 @@ def list_files(request):
     list_size = long(request.GET.get("size", listSize[action]))
     list_start = long(request.GET.get("start", 0))
 
-    files = []
-    root_path = os.path.join(
-        USettings.gSettings.MEDIA_ROOT, listpath[action]).replace("\\", "/")
-    files = get_files(root_path, root_path, allowFiles[action])
+    files, total = catalog.list_files(
+        listpath[action], allowFiles[action], list_start, list_size)
 
-    if (len(files) == 0):
+    if total == 0:
         return_info = {
             "state": u"未找到匹配文件！",
             "list": [],
@@ -102,35 +141,18 @@ def list_files(request):
     else:
         return_info = {
             "state": "SUCCESS",
-            "list": files[list_start:list_start + list_size],
+            "list": [{
+                "url": storage.file_url(path),
+                "thumb": storage.file_url(thumbnail) if thumbnail else "",
+                "mtime": mtime
+            } for path, mtime, thumbnail in files],
             "start": list_start,
-            "total": len(files)
+            "total": total
         }
 
     return HttpResponse(json.dumps(return_info), content_type="application/javascript")
 
 
-def get_files(root_path, cur_path, allow_types=[]):
-    files = []
-    items = os.listdir(cur_path)
-    for item in items:
-        item = unicode(item)
-        item_fullname = os.path.join(
-            root_path, cur_path, item).replace("\\", "/")
-        if os.path.isdir(item_fullname):
-            files.extend(get_files(root_path, item_fullname, allow_types))
-        else:
-            ext = os.path.splitext(item_fullname)[1]
-            is_allow_list = (len(allow_types) == 0) or (ext in allow_types)
-            if is_allow_list:
-                files.append({
-                    "url": urllib.basejoin(USettings.gSettings.MEDIA_URL, os.path.join(os.path.relpath(cur_path, root_path), item).replace("\\", "/")),
-                    "mtime": os.path.getmtime(item_fullname)
-                })
-
-    return files
-
-
 @csrf_exempt
 def UploadFile(request):
     """上传文件"""
@@ -209,26 +231,54 @@ def UploadFile(request):
     OutputPathFormat, OutputPath, OutputFile = get_output_path(
         request, upload_path_format[action], path_format_var)
 
+    # 上传配额检验，涂鸦解码后才知道大小，保存后再计入
+    owner_id = quota.get_owner_id(request)
+    if state == "SUCCESS" and action != "uploadscrawl":
+        state = quota.charge(owner_id, upload_file_size) or state
+        charged = state == "SUCCESS"
+    else:
+        charged = False
+
     # 所有检测完成后写入文件
     if state == "SUCCESS":
+        # 是否需要登记到上传文件目录，upload_module自行保存的文件可用ueditor_sync_catalog命令补登
+        register = True
         if action == "uploadscrawl":
-            state = save_scrawl_file(
-                request, os.path.join(OutputPath, OutputFile))
+            state, OutputPathFormat, upload_file_size = save_scrawl_file(
+                request, OutputPathFormat, max_size)
+            if state == "SUCCESS":
+                state = quota.charge(owner_id, upload_file_size) or state
+                charged = state == "SUCCESS"
+                if not charged:
+                    storage.get_storage().delete(OutputPathFormat)
         else:
             # 保存到文件中，如果保存错误，需要返回ERROR
-            upload_module_name = USettings.UEditorUploadSettings.get(
-                "upload_module", None)
-            if upload_module_name:
-                mod = import_module(upload_module_name)
-                state = mod.upload(file, OutputPathFormat)
+            upload_module = storage.get_upload_module()
+            if upload_module:
+                if not os.path.exists(OutputPath):
+                    os.makedirs(OutputPath)
+                state = upload_module.upload(file, OutputPathFormat)
+                register = False
+            elif USettings.GetUeditorSettings("contentAddressed", False):
+                # 内容相同的文件只保存一份，返回已有文件的地址
+                state, OutputPathFormat, register = dedup.save_upload_file(
+                    file, OutputPathFormat)
             else:
-                state = save_upload_file(
-                    file, os.path.join(OutputPath, OutputFile))
+                state, OutputPathFormat = save_upload_file(
+                    file, OutputPathFormat)
+        if state == "SUCCESS" and register:
+            catalog.register_file(OutputPathFormat, upload_file_size, owner_id)
+            # 图片在后台生成缩略图
+            if action in ("uploadimage", "uploadscrawl"):
+                derivatives.enqueue(OutputPathFormat)
+        elif charged:
+            # 保存失败或没有写入新文件(内容重复、upload_module)，不占用配额
+            quota.release(owner_id, upload_file_size)
 
     # 返回数据
     return_info = {
         # 保存后的文件名称
-        'url': urllib.basejoin(USettings.gSettings.MEDIA_URL, OutputPathFormat),
+        'url': storage.file_url(OutputPathFormat),
         'original': upload_file_name,  # 原始文件名
         'type': upload_original_ext,
         'state': state,  # 上传状态，成功时返回SUCCESS,其他任何值将原样返回至图片上传框中
@@ -237,6 +287,167 @@ def UploadFile(request):
     return HttpResponse(json.dumps(return_info, ensure_ascii=False), content_type="application/javascript")
 
 
+# 分块上传的文件类型对应的配置项：(允许的扩展名,大小限制,保存路径,表单名称)
+CHUNK_UPLOAD_SETTINGS = {
+    "image": ("imageAllowFiles", "imageMaxSize", "imagePathFormat", "imageFieldName"),
+    "video": ("videoAllowFiles", "videoMaxSize", "videoPathFormat", "videoFieldName"),
+    "file": ("fileAllowFiles", "fileMaxSize", "filePathFormat", "fileFieldName"),
+}
+
+
+@csrf_exempt
+def upload_chunk(request):
+    """分块上传大文件，支持断点续传
+        GET：查询uploadId已收到的分块
+        POST：上传编号为chunk(从0开始，共chunks块)的分块，全部收到后拼接为最终文件
+    """
+    upload_type = request.GET.get("type", "file")
+    if upload_type not in CHUNK_UPLOAD_SETTINGS:
+        return HttpResponse(json.dumps(u"{'state:'ERROR'}"), content_type="application/javascript")
+    try:
+        upload_id = request.GET.get("uploadId", "")
+        staging_path = chunked.get_staging_path(upload_id)
+    except chunked.ChunkError as E:
+        return HttpResponse(json.dumps({"state": u"%s" % E}, ensure_ascii=False), content_type="application/javascript")
+
+    # 查询已收到的分块，客户端据此续传
+    if request.method == "GET":
+        received = chunked.received_chunks(staging_path)
+        return_info = {
+            "state": "SUCCESS",
+            "uploadId": upload_id,
+            "chunks": sorted(received),
+            "received": sum(received.values())
+        }
+        return HttpResponse(json.dumps(return_info), content_type="application/javascript")
+
+    allow_key, max_size_key, path_format_key, field_name_key = CHUNK_UPLOAD_SETTINGS[upload_type]
+    file = request.FILES.get(request.GET.get(
+        field_name_key, USettings.UEditorUploadSettings.get(field_name_key, "upfile")), None)
+    if file is None:
+        return HttpResponse(json.dumps(u"{'state:'ERROR'}"), content_type="application/javascript")
+    try:
+        chunk_index = long(request.POST.get("chunk", request.GET.get("chunk", 0)))
+        chunk_count = long(request.POST.get("chunks", request.GET.get("chunks", 1)))
+        upload_file_size = long(request.POST.get("size", request.GET.get("size", 0)))
+    except ValueError:
+        chunk_index, chunk_count, upload_file_size = -1, 0, 0
+    upload_file_name = request.POST.get("name", request.GET.get("name", file.name))
+    upload_original_name, upload_original_ext = os.path.splitext(
+        upload_file_name)
+
+    state = "SUCCESS"
+    if chunk_index < 0 or chunk_index >= chunk_count:
+        state = u"分块编号不正确"
+
+    # 文件类型检验，每个分块都要检验
+    allow_type = list(request.GET.get(
+        allow_key, USettings.UEditorUploadSettings.get(allow_key, "")))
+    if not upload_original_ext in allow_type:
+        state = u"服务器不允许上传%s类型的文件。" % upload_original_ext
+
+    # 大小检验，声明的文件大小和已收到的分块大小都不能超过限制
+    received = chunked.received_chunks(staging_path)
+    replaced_size = received.pop(chunk_index, None)
+    max_size = long(request.GET.get(
+        max_size_key, USettings.UEditorUploadSettings.get(max_size_key, 0)))
+    if max_size != 0:
+        from .utils import FileSize
+        MF = FileSize(max_size)
+        if upload_file_size > MF.size or sum(received.values()) + file.size > MF.size:
+            state = u"上传文件大小不允许超过%s。" % MF.FriendValue
+
+    # 上传配额检验，按声明的文件大小提前拒绝，拼接后再按实际大小计入
+    owner_id = quota.get_owner_id(request)
+    if state == "SUCCESS" and not received:
+        state = quota.check(owner_id, upload_file_size) or state
+    # 暂存的分块按字节计入用量，拼接完成后再计入文件数，放弃的上传由ueditor_gc清理并减去
+    if state == "SUCCESS":
+        state = quota.charge(owner_id, file.size, count=0) or state
+
+    if state != "SUCCESS":
+        return HttpResponse(json.dumps({"state": state}, ensure_ascii=False), content_type="application/javascript")
+
+    try:
+        if not os.path.exists(staging_path):
+            os.makedirs(staging_path)
+        chunked.save_meta(staging_path, {
+            "name": upload_file_name,
+            "chunks": chunk_count,
+            "size": upload_file_size,
+            "type": upload_type,
+            "owner": owner_id
+        })
+        chunked.save_chunk(staging_path, chunk_index, file)
+    except chunked.ChunkError as E:
+        quota.release(owner_id, file.size, count=0)
+        return HttpResponse(json.dumps({"state": u"%s" % E}, ensure_ascii=False), content_type="application/javascript")
+    except Exception as E:
+        quota.release(owner_id, file.size, count=0)
+        return HttpResponse(json.dumps({"state": u"写入文件错误:%s" % E}, ensure_ascii=False), content_type="application/javascript")
+    if replaced_size is not None:
+        # 重新上传的分块替换了之前计入的分块
+        quota.release(owner_id, replaced_size, count=0)
+
+    # 重新读取已收到的分块，同时到达的最后几个分块中至少有一个会看到全部分块
+    received = chunked.received_chunks(staging_path)
+    if len(received) < chunk_count:
+        return_info = {
+            "state": "SUCCESS",
+            "uploadId": upload_id,
+            "chunk": chunk_index,
+            "chunks": sorted(received)
+        }
+        return HttpResponse(json.dumps(return_info), content_type="application/javascript")
+
+    # 全部分块已收到，拼接为最终文件
+    path_format_var = get_path_format_vars()
+    path_format_var.update({
+        "basename": upload_original_name,
+        "extname": upload_original_ext[1:],
+        "filename": upload_file_name,
+    })
+    OutputPathFormat, OutputPath, OutputFile = get_output_path(
+        request, path_format_key, path_format_var)
+    tmp_filename = storage.get_temp_filename(upload_original_ext)
+    try:
+        size = chunked.assemble(staging_path, chunk_count, tmp_filename)
+        if size is not None:
+            try:
+                OutputPathFormat = storage.save_local_file(OutputPathFormat, tmp_filename)
+            except Exception:
+                # 暂存目录已删除，减去分块计入的字节数
+                quota.release(owner_id, size, count=0)
+                raise
+            quota.adjust(owner_id, 0, 1)
+    except Exception as E:
+        return HttpResponse(json.dumps({"state": u"写入文件错误:%s" % E}, ensure_ascii=False), content_type="application/javascript")
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    if size is None:
+        # 另一个请求正在拼接
+        return_info = {
+            "state": "SUCCESS",
+            "uploadId": upload_id,
+            "chunk": chunk_index,
+            "chunks": sorted(received)
+        }
+        return HttpResponse(json.dumps(return_info), content_type="application/javascript")
+    catalog.register_file(OutputPathFormat, size, owner_id)
+    if upload_type == "image":
+        derivatives.enqueue(OutputPathFormat)
+
+    return_info = {
+        'url': storage.file_url(OutputPathFormat),
+        'original': upload_file_name,
+        'type': upload_original_ext,
+        'state': "SUCCESS",
+        'size': size
+    }
+    return HttpResponse(json.dumps(return_info, ensure_ascii=False), content_type="application/javascript")
+
+
 @csrf_exempt
 def catcher_remote_image(request):
     """远程抓图，当catchRemoteImageEnable:true时，
@@ -254,7 +465,12 @@ def catcher_remote_image(request):
 
     remote_urls = request.POST.getlist("source[]", [])
     catcher_infos = []
-    path_format_var = get_path_format_vars()
+    jobs = []
+
+    # 已抓取过的远程地址直接返回本地文件，过期的缓存需要向远程服务器重新验证
+    cache_enabled = USettings.GetUeditorSettings("catcherCacheEnable", True)
+    cached = catcher.get_cached_images(remote_urls) if cache_enabled else {}
+    cache_hits = []
 
     for remote_url in remote_urls:
         # 取得上传的文件的原始名称
@@ -263,6 +479,19 @@ def catcher_remote_image(request):
             remote_file_name)
         # 文件类型检验
         if remote_original_ext in allow_type:
+            image = cached.get(remote_url)
+            if image is not None and catcher.is_fresh(image):
+                cache_hits.append(image)
+                catcher_infos.append({
+                    "state": "SUCCESS",
+                    "url": storage.file_url(image.path),
+                    "size": image.size,
+                    "title": os.path.basename(image.path),
+                    "original": remote_file_name,
+                    "source": remote_url
+                })
+                continue
+            path_format_var = get_path_format_vars()
             path_format_var.update({
                 "basename": remote_original_name,
                 "extname": remote_original_ext[1:],
@@ -271,29 +500,52 @@ def catcher_remote_image(request):
             # 计算保存的文件名
             o_path_format, o_path, o_file = get_output_path(
                 request, "catcherPathFormat", path_format_var)
-            o_filename = os.path.join(o_path, o_file).replace("\\", "/")
-            # 读取远程图片文件
-            try:
-                remote_image = urllib.urlopen(remote_url)
-                # 将抓取到的文件写入文件
-                try:
-                    f = open(o_filename, 'wb')
-                    f.write(remote_image.read())
-                    f.close()
-                    state = "SUCCESS"
-                except Exception as E:
-                    state = u"写入抓取图片文件错误:%s" % E.message
-            except Exception as E:
-                state = u"抓取图片错误：%s" % E.message
-
-            catcher_infos.append({
-                "state": state,
-                "url": urllib.basejoin(USettings.gSettings.MEDIA_URL, o_path_format),
-                "size": os.path.getsize(o_filename),
-                "title": os.path.basename(o_file),
-                "original": remote_file_name,
-                "source": remote_url
-            })
+            headers = catcher.revalidate_headers(image) if image is not None else None
+            catcher_infos.append(None)
+            jobs.append((len(catcher_infos) - 1, image, remote_url,
+                         remote_file_name, o_path_format, headers))
+
+    # 剩余的上传配额也作为大小限制，超出时在下载过程中就中止
+    owner_id = quota.get_owner_id(request)
+    size_error = None
+    left = quota.remaining(owner_id) if jobs else None
+    if left is not None and (not max_size or left[0] < max_size):
+        max_size, size_error = max(left[0], 1), quota.quota_error(left[1])
+
+    # 并发下载远程图片，边下载边写入文件，下载完成后保存到存储中
+    results = catcher.fetch_all(
+        [(job[2], job[4], job[5]) for job in jobs], max_size,
+        USettings.GetUeditorSettings("catcherTimeout", 10),
+        USettings.GetUeditorSettings("catcherConcurrency", 4), size_error)
+
+    revalidated = []
+    for (index, image, remote_url, remote_file_name, o_path_format, headers), (state, size, info, o_path_format) in zip(jobs, results):
+        if state == "NOT_MODIFIED":
+            # 远程文件未修改，沿用缓存的本地文件
+            revalidated.append(image)
+            state, o_path_format, size = "SUCCESS", image.path, image.size
+        elif state == "SUCCESS":
+            state = quota.charge(owner_id, size) or state
+            if state != "SUCCESS":
+                # 超出上传配额，删除已下载的文件
+                storage.get_storage().delete(o_path_format)
+            else:
+                catalog.register_file(o_path_format, size, owner_id)
+                if cache_enabled:
+                    catcher.cache_image(remote_url, o_path_format, size, info)
+        catcher_infos[index] = {
+            "state": state,
+            "url": storage.file_url(o_path_format),
+            "size": size,
+            "title": os.path.basename(o_path_format),
+            "original": remote_file_name,
+            "source": remote_url
+        }
+
+    if cache_enabled:
+        catcher.touch_cached_images(cache_hits)
+        catcher.touch_cached_images(revalidated, revalidated=True)
+        catcher.evict_cached_images()
 
     return_info = {
         "state": "SUCCESS" if len(catcher_infos) > 0 else "ERROR",
@@ -305,33 +557,57 @@ def catcher_remote_image(request):
 
 def get_output_path(request, path_format, path_format_var):
     # 取得输出文件的路径
-    OutputPathFormat = (request.GET.get(path_format, USettings.UEditorSettings[
-                        "defaultPathFormat"]) % path_format_var).replace("\\", "/")
+    default_path_format = sharding.get_default_path_format()
+    # %(shard)s为文件名的散列前缀，由sharding.format_path在文件名确定后计算
+    OutputPathFormat = sharding.format_path(
+        request.GET.get(path_format, default_path_format), path_format_var).replace("\\", "/")
     # 分解OutputPathFormat
     OutputPath, OutputFile = os.path.split(OutputPathFormat)
     OutputPath = os.path.join(USettings.gSettings.MEDIA_ROOT, OutputPath)
     # 如果OutputFile为空说明传入的OutputPathFormat没有包含文件名，因此需要用默认的文件名
     if not OutputFile:
-        OutputFile = USettings.UEditorSettings[
-            "defaultPathFormat"] % path_format_var
+        OutputFile = sharding.format_path(default_path_format, path_format_var).replace("\\", "/")
         OutputPathFormat = os.path.join(OutputPathFormat, OutputFile)
-    if not os.path.exists(OutputPath):
-        os.makedirs(OutputPath)
+        OutputPath, OutputFile = os.path.split(os.path.join(OutputPath, OutputFile))
     return (OutputPathFormat, OutputPath, OutputFile)
 
 # 涂鸦功能上传处理
 
 
 @csrf_exempt
-def save_scrawl_file(request, filename):
-    import base64
+def save_scrawl_file(request, path_format, max_size=0):
+    """保存涂鸦，max_size不为0时在解码过程中检查大小，返回(状态,实际保存的文件名,文件大小)"""
+    field_name = USettings.UEditorUploadSettings.get("scrawlFieldName", "upfile")
+    tmp_filename = storage.get_temp_filename(".png")
+    size = 0
     try:
-        content = request.POST.get(
-            USettings.UEditorUploadSettings.get("scrawlFieldName", "upfile"))
-        f = open(filename, 'wb')
-        f.write(base64.decodestring(content))
-        f.close()
+        if request.META.get("CONTENT_TYPE", "").startswith("application/x-www-form-urlencoded"):
+            # 直接从请求流中解码，不经过request.POST，避免在内存中保存多份完整数据
+            chunks = scrawl.iter_field_value(request, field_name)
+        else:
+            content = request.POST.get(field_name, "")
+            chunks = [content.encode("ascii") if isinstance(content, six.text_type) else content]
+        size = scrawl.save_scrawl(chunks, tmp_filename, max_size)
+        path_format = storage.save_local_file(path_format, tmp_filename)
         state = "SUCCESS"
+    except scrawl.ScrawlError as E:
+        state = u"%s" % E
     except Exception as E:
-        state = "写入图片文件错误:%s" % E.message
-    return state
+        state = u"写入图片文件错误:%s" % E
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return state, path_format, size
+
+
+def media_resize(request, width, height, path):
+    """按需缩放MEDIA_ROOT中的图片，如/ueditor/media-resize/640x0/uploads/images/a.jpg"""
+    try:
+        cache_file = resize.get_resized_file(path, int(width), int(height))
+    except resize.ResizeError:
+        raise Http404
+    response = FileResponse(open(cache_file, "rb"),
+                            content_type=mimetypes.guess_type(cache_file)[0] or "application/octet-stream")
+    response["Content-Length"] = os.path.getsize(cache_file)
+    response["Cache-Control"] = "public, max-age=%d" % USettings.GetUeditorSettings("resizeMaxAge", 2592000)
+    return response
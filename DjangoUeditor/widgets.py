@@ -1,11 +1,17 @@
 # coding:utf-8
+import re
+import hashlib
+import threading
 from django import forms
 from django.conf import settings
 from django.contrib.admin.widgets import AdminTextareaWidget
 from django.template.loader import render_to_string
+from django.utils.encoding import force_text
+from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 from django.utils.http import urlencode
 from . import settings as USettings
+from . import bundle
 from .commands import *
 from django.utils.six import string_types
 
@@ -28,6 +34,28 @@ def calc_path(OutputPath, instance=None):
 
     return OutputPath
 
+# 预先渲染的编辑器HTML，name、id、value用占位符代替，每次渲染时只替换这三处：{配置的散列: HTML}
+_rendered = {}
+_rendered_lock = threading.Lock()
+# 最多保存的配置数量，超过时清空
+MAX_RENDERED = 256
+# 占位符，都是合法的JS标识符，不会被模板转义改变
+NAME_TOKEN = "__ueditor_name_token__"
+ID_TOKEN = "__ueditor_id_token__"
+VALUE_TOKEN = "__ueditor_value_token__"
+ESCAPED_VALUE_TOKEN = "__ueditor_escaped_value_token__"
+TOKEN_PATTERN = re.compile("%s|%s|%s|%s" % (NAME_TOKEN, ID_TOKEN, VALUE_TOKEN, ESCAPED_VALUE_TOKEN))
+
+
+def describe(obj):
+    """扩展命令和事件侦听的渲染结果只由类和属性决定，用它们描述对象"""
+    if obj is None:
+        return ""
+    if isinstance(obj, (list, tuple)):
+        return "[%s]" % ",".join(describe(item) for item in obj)
+    return "%s.%s%r" % (obj.__class__.__module__, obj.__class__.__name__,
+                        sorted(getattr(obj, "__dict__", {}).items()))
+
 # width=600, height=300, toolbars="full", imagePath="", filePath="", upload_settings={},
     # settings={},command=None,event_handler=None
 
@@ -130,12 +158,55 @@ class UEditorWidget(forms.Textarea):
     def render(self, name, value, attrs=None):
         if value is None:
             value = ''
-        # 传入模板的参数
         editor_id = "id_%s" % name.replace("-", "_")
+        tokens = {
+            NAME_TOKEN: conditional_escape(name),
+            ID_TOKEN: conditional_escape(editor_id),
+            VALUE_TOKEN: force_text(value),
+            ESCAPED_VALUE_TOKEN: conditional_escape(value)
+        }
+        # 一次替换全部占位符，内容中出现占位符文本时不会被再次替换
+        return mark_safe(TOKEN_PATTERN.sub(
+            lambda m: tokens[m.group(0)], self.get_rendered()))
+
+    def get_settings(self):
+        ueditor_settings = self.ueditor_settings.copy()
+        ueditor_settings.update({
+            "serverUrl": "/ueditor/controller/?%s" % urlencode(self._upload_settings)
+        })
+        # 使用ueditor_build_static生成的带散列的目录
+        if bundle.get_manifest():
+            ueditor_settings["UEDITOR_HOME_URL"] = bundle.get_home_url()
+        return ueditor_settings
+
+    def get_rendered(self):
+        """取得用占位符渲染的HTML，相同配置的编辑器只渲染一次"""
+        ueditor_settings = self.get_settings()
+        key = hashlib.sha1(("%r|%s|%s|%s|%s" % (
+            sorted(ueditor_settings.items()), describe(self.command), describe(self.event_handler),
+            USettings.GetUeditorSettings("lazyLoad", ""),
+            USettings.GetUeditorSettings("preload", False))).encode("utf-8")).hexdigest()
+        rendered = _rendered.get(key)
+        if rendered is None:
+            rendered = self.render_template(NAME_TOKEN, ID_TOKEN, VALUE_TOKEN, ueditor_settings)
+            with _rendered_lock:
+                if len(_rendered) >= MAX_RENDERED:
+                    _rendered.clear()
+                _rendered[key] = rendered
+        return rendered
+
+    def render_template(self, name, editor_id, value, ueditor_settings):
+        # 传入模板的参数
         uSettings = {
             "name": name,
             "id": editor_id,
-            "value": value
+            "value": value,
+            "escaped_value": ESCAPED_VALUE_TOKEN,
+            # 延迟加载时先显示同样大小的文本框，获得焦点或滚动到可见区域时再加载编辑器
+            "lazy": USettings.GetUeditorSettings("lazyLoad", ""),
+            "preload": USettings.GetUeditorSettings("preload", False),
+            "width": ueditor_settings.get("initialFrameWidth", 600),
+            "height": ueditor_settings.get("initialFrameHeight", 300)
         }
         if isinstance(self.command, list):
             cmdjs = ""
@@ -146,10 +217,7 @@ class UEditorWidget(forms.Textarea):
                 cmdjs = self.command.render(editor_id)
             uSettings["commands"] = cmdjs
 
-        uSettings["settings"] = self.ueditor_settings.copy()
-        uSettings["settings"].update({
-            "serverUrl": "/ueditor/controller/?%s" % urlencode(self._upload_settings)
-        })
+        uSettings["settings"] = ueditor_settings
         # 生成事件侦听
         if self.event_handler:
             uSettings["bindEvents"] = self.event_handler.render(editor_id)
@@ -159,13 +227,17 @@ class UEditorWidget(forms.Textarea):
             'STATIC_URL': settings.STATIC_URL,
             'STATIC_ROOT': settings.STATIC_ROOT,
             'MEDIA_URL': settings.MEDIA_URL,
-            'MEDIA_ROOT': settings.MEDIA_ROOT
+            'MEDIA_ROOT': settings.MEDIA_ROOT,
+            'UEDITOR_HOME_URL': bundle.get_home_url()
         }
-        return mark_safe(render_to_string('ueditor.html', context))
-
-    class Media:
-        js = ("ueditor/ueditor.config.js",
-              "ueditor/ueditor.all.min.js")
+        return render_to_string('ueditor.html', context)
+
+    @property
+    def media(self):
+        # 延迟加载时不在页面中直接引入ueditor的脚本
+        if USettings.GetUeditorSettings("lazyLoad", ""):
+            return forms.Media()
+        return forms.Media(js=bundle.get_js_urls())
 
 
 class AdminUEditorWidget(AdminTextareaWidget, UEditorWidget):
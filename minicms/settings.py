@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'news.querybudget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -143,3 +144,12 @@ REGISTRATION_AUTO_LOGIN = True  # 此项设置为True，用户可以自动登录
 LOGIN_REDIRECT_URL = '/'  # 用户登录后转向的页面
 LOGIN_URL = '/accounts/login/'  # 用户未成功登录时转向的页面
 
+
+# 缓存：文章页缓存(news/cache.py)和UEditor控制器限流使用default缓存
+# 进程内存缓存只在一个进程中有效，多进程部署时请改为共享缓存，如
+# CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211'}}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -21,6 +21,8 @@ urlpatterns = [
     url(r'^$',views.index,name='index'),
 	url(r'^column/(?P<column_slug>[^/]+)/$',views.column_detail,name='column'),
 	url(r'^news/(?P<pk>\d+)/(?P<article_slug>[^/]+)$',views.article_detail,name='article'),
+	url(r'^search/$',views.search,name='search'),
+	url(r'^search\.json$',views.search_json,name='search_json'),
 	url(r'^admin/', admin.site.urls),
 	url(r'^ueditor',include('DjangoUeditor.urls')),
 	url(r'^accounts/',include('registration.backends.default.urls')),
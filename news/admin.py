@@ -7,6 +7,7 @@ class ColumnAdmin(admin.ModelAdmin):
 	
 class ArticleAdmin(admin.ModelAdmin):
 	list_display = ('title','slug','author','pub_date','update_time')
+	list_select_related = ('author',)
 
 admin.site.register(Column,ColumnAdmin)
 admin.site.register( Article,ArticleAdmin)
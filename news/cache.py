@@ -0,0 +1,83 @@
+# 文章页缓存：按文章id、网址和更新时间缓存整个页面，文章保存、删除或栏目变化时还会增加版本号使缓存失效
+# 更新时间由条件请求(conditional.py)在每个请求中查询，使用各进程独立的内存缓存时，其它进程也不会返回修改前的页面
+# 版本号只在共享缓存(memcached、redis等)中对所有进程有效
+# 过期的页面由一个请求重新生成，其它请求在此期间继续使用旧页面，避免同时查询数据库
+import time
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from .conditional import timestamp
+
+# 页面的缓存时间(秒)
+ARTICLE_CACHE_TIMEOUT = getattr(settings,'NEWS_ARTICLE_CACHE_TIMEOUT',600)
+# 过期后旧页面还可以使用的时间(秒)，在此期间由一个请求重新生成
+ARTICLE_CACHE_STALE = getattr(settings,'NEWS_ARTICLE_CACHE_STALE',60)
+# 重新生成页面的锁的超时时间(秒)
+REBUILD_LOCK_TIMEOUT = 30
+# 没有旧页面可用、其它请求正在生成时，等待的次数和间隔(秒)
+WAIT_TRIES = 20
+WAIT_INTERVAL = 0.05
+
+def version_key(pk):
+	return 'news:article:%s:version' % pk
+
+def new_version():
+	return int(time.time() * 1000)
+
+def get_version(pk):
+	"""文章缓存的版本号，不存在时用当前时间生成，缓存被清空后也不会用到旧页面"""
+	version = cache.get(version_key(pk))
+	if version is None:
+		cache.add(version_key(pk),new_version(),None)
+		version = cache.get(version_key(pk))
+	return version
+
+def invalidate(pk):
+	"""使文章的所有页面缓存失效"""
+	try:
+		cache.incr(version_key(pk))
+	except ValueError:
+		cache.set(version_key(pk),new_version(),None)
+
+def page_key(pk,slug,update_time):
+	slug_hash = hashlib.md5(slug.encode('utf-8')).hexdigest()
+	return 'news:article:%s:%s:%s:%s' % (pk,slug_hash,timestamp(update_time),get_version(pk))
+
+def rebuild(key,lock_key,build):
+	try:
+		response = build()
+		# 只缓存正常的页面，跳转和错误页不缓存
+		if response.status_code == 200 and not response.streaming:
+			page = (response.content,response['Content-Type'])
+			cache.set(key,(time.time() + ARTICLE_CACHE_TIMEOUT,page),ARTICLE_CACHE_TIMEOUT + ARTICLE_CACHE_STALE)
+		return response
+	finally:
+		cache.delete(lock_key)
+
+def to_response(page):
+	content,content_type = page
+	return HttpResponse(content,content_type=content_type)
+
+def cached_article_page(pk,slug,update_time,build):
+	"""
+	返回文章页面，build()生成HttpResponse，update_time为数据库中文章的更新时间
+	缓存过期后只有取得锁的请求重新生成页面，其它请求返回旧页面
+	"""
+	key = page_key(pk,slug,update_time)
+	lock_key = key + ':lock'
+	entry = cache.get(key)
+	if entry is not None:
+		expires,page = entry
+		if expires > time.time() or not cache.add(lock_key,1,REBUILD_LOCK_TIMEOUT):
+			return to_response(page)
+		return rebuild(key,lock_key,build)
+	if cache.add(lock_key,1,REBUILD_LOCK_TIMEOUT):
+		return rebuild(key,lock_key,build)
+	# 其它请求正在生成，等待片刻
+	for i in range(WAIT_TRIES):
+		time.sleep(WAIT_INTERVAL)
+		entry = cache.get(key)
+		if entry is not None:
+			return to_response(entry[1])
+	return build()
@@ -0,0 +1,50 @@
+# 条件请求：按文章的更新时间生成ETag和Last-Modified，内容没有变化时返回304，不读取文章也不渲染模板
+# 每个请求只查询一次，结果保存在request上供etag和last_modified两个函数使用
+import calendar
+import hashlib
+from django.db.models import Count,Max
+from .models import Column,Article
+
+def article_state(request,pk,article_slug):
+	"""返回文章的更新时间，文章不存在或网址需要跳转时返回None"""
+	if not hasattr(request,'_news_article_state'):
+		row = Article.objects.filter(pk=pk).values_list('update_time','slug').first()
+		request._news_article_state = row[0] if row and row[1] == article_slug else None
+	return request._news_article_state
+
+def column_state(request,column_slug):
+	"""返回(栏目中文章的最后更新时间,文章数,栏目名称和简介的摘要)
+	文章数用于发现移出栏目或删除的文章，摘要用于发现栏目本身的修改"""
+	if not hasattr(request,'_news_column_state'):
+		row = Column.objects.filter(slug=column_slug).annotate(
+			latest=Max('article__update_time'),count=Count('article')).values_list(
+			'latest','count','name','intro').first()
+		if row and row[0]:
+			digest = hashlib.md5(('%s\n%s' % (row[2],row[3])).encode('utf-8')).hexdigest()[:12]
+			request._news_column_state = (row[0],row[1],digest)
+		else:
+			request._news_column_state = None
+	return request._news_column_state
+
+def timestamp(value):
+	return '%d.%06d' % (calendar.timegm(value.utctimetuple()),value.microsecond)
+
+def article_etag(request,pk,article_slug):
+	update_time = article_state(request,pk,article_slug)
+	if update_time is None:
+		return None
+	return 'article-%s-%s' % (pk,timestamp(update_time))
+
+def article_last_modified(request,pk,article_slug):
+	return article_state(request,pk,article_slug)
+
+def column_etag(request,column_slug):
+	state = column_state(request,column_slug)
+	if state is None:
+		return None
+	# 分页的游标在网址中，不同的页面由网址区分
+	return 'column-%s-%s-%d-%s' % (column_slug,timestamp(state[0]),state[1],state[2])
+
+def column_last_modified(request,column_slug):
+	state = column_state(request,column_slug)
+	return state[0] if state else None
@@ -0,0 +1,27 @@
+"""
+Rebuild the ``news.ArticleMedia`` reference table from the content of
+existing articles.  Articles are read in primary-key batches and each
+batch is replaced with one delete and one ``bulk_create``.
+"""
+
+from django.core.management.base import BaseCommand
+
+from DjangoUeditor import references
+from news.media import backfill_article_media
+from news.models import Article
+
+
+class Command(BaseCommand):
+	help = "Rebuild the media reference table from article content"
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--batch-size", type=int, default=500,
+			help="Number of articles processed per transaction")
+
+	def handle(self, *args, **options):
+		articles = media = 0
+		for rows in references.iter_contents(Article, "content", max(options["batch_size"], 1)):
+			media += backfill_article_media(rows)
+			articles += len(rows)
+		self.stdout.write("Indexed %d references in %d articles" % (media, articles))
@@ -0,0 +1,191 @@
+"""
+Import articles in bulk from a JSONL or CSV file.
+
+Each record has ``title``, ``slug``, ``content`` and ``columns`` (a list
+of column slugs, ``|``-separated in CSV), and optionally ``id``,
+``pub_date`` and ``published``.  Columns are resolved through a slug map
+loaded once; articles and their ``Article.column`` rows are written with
+``bulk_create`` in batches, and the media and search indexes are updated
+per batch instead of per row.  Every batch commits together with a
+``news.ImportCheckpoint`` row, so an interrupted import is resumed by
+running the same command again.  Primary keys are assigned by the
+command, so no other process should create articles during an import.
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+from news import search
+from news.media import backfill_article_media
+from news.models import Article, Column, ImportCheckpoint
+
+TRUE_VALUES = ("1", "true", "yes", "y")
+
+
+def read_jsonl(f):
+	for line in f:
+		line = line.strip()
+		if line:
+			yield json.loads(line)
+
+
+def read_csv(f):
+	for row in csv.DictReader(f):
+		row["columns"] = [slug for slug in (row.get("columns") or "").split("|") if slug]
+		yield row
+
+
+@contextmanager
+def keep_pub_date():
+	"""bulk_create时不用当前时间覆盖导入的发表时间"""
+	field = Article._meta.get_field("pub_date")
+	auto_now_add = field.auto_now_add
+	field.auto_now_add = False
+	try:
+		yield
+	finally:
+		field.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+	help = "Import articles from a JSONL or CSV file with bulk inserts and resumable checkpoints"
+
+	def add_arguments(self, parser):
+		parser.add_argument("path", help="Input file, or - for JSONL on standard input")
+		parser.add_argument(
+			"--format", choices=["jsonl", "csv"], default=None,
+			help="Input format, guessed from the file extension by default")
+		parser.add_argument(
+			"--batch-size", type=int, default=1000,
+			help="Number of articles written per transaction")
+		parser.add_argument(
+			"--name", default="",
+			help="Checkpoint name, defaults to the input file name")
+		parser.add_argument(
+			"--create-columns", action="store_true", default=False,
+			help="Create columns for unknown slugs instead of failing")
+		parser.add_argument(
+			"--skip-index", action="store_true", default=False,
+			help="Do not update the media and search indexes; run backfill_article_media "
+			     "and rebuild_search_index afterwards")
+
+	def handle(self, *args, **options):
+		path = options["path"]
+		fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+		name = options["name"] or ("stdin" if path == "-" else os.path.basename(path))
+		batch_size = max(options["batch_size"], 1)
+		self.create_columns = options["create_columns"]
+		self.skip_index = options["skip_index"]
+		self.columns = dict(Column.objects.values_list("slug", "pk"))
+
+		checkpoint = ImportCheckpoint.objects.get_or_create(name=name)[0]
+		position = checkpoint.position
+		if position:
+			self.stdout.write("Resuming %s after record %d" % (name, position))
+
+		if path == "-":
+			f = sys.stdin
+		else:
+			f = io.open(path, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+		imported = 0
+		try:
+			reader = read_csv(f) if fmt == "csv" else read_jsonl(f)
+			batch = []
+			with keep_pub_date():
+				for number, record in enumerate(reader, 1):
+					# 已导入的记录只读取不处理
+					if number <= position:
+						continue
+					batch.append((number, record))
+					if len(batch) >= batch_size:
+						imported += self.write_batch(checkpoint, batch)
+						batch = []
+				if batch:
+					imported += self.write_batch(checkpoint, batch)
+		finally:
+			if f is not sys.stdin:
+				f.close()
+
+		# 指定了id时，PostgreSQL等使用序列的数据库需要更新序列
+		sql = connection.ops.sequence_reset_sql(no_style(), [Article])
+		if sql:
+			with connection.cursor() as cursor:
+				for statement in sql:
+					cursor.execute(statement)
+		self.stdout.write("Imported %d articles, %d records done in total" % (imported, checkpoint.position))
+
+	def get_column_ids(self, number, slugs):
+		if isinstance(slugs, six.string_types):
+			slugs = [slug for slug in slugs.split("|") if slug]
+		ids = []
+		for slug in slugs:
+			if slug not in self.columns:
+				if not self.create_columns:
+					raise CommandError("Record %d: unknown column %r, use --create-columns" % (number, slug))
+				self.columns[slug] = Column.objects.create(name=slug, slug=slug).pk
+				self.created_columns.append(slug)
+			ids.append(self.columns[slug])
+		return ids
+
+	def build_article(self, number, record, pk):
+		if not record.get("title") or not record.get("slug"):
+			raise CommandError("Record %d: title and slug are required" % number)
+		pub_date = record.get("pub_date") or None
+		if pub_date:
+			pub_date = parse_datetime(pub_date)
+			if pub_date is None:
+				raise CommandError("Record %d: invalid pub_date %r" % (number, record["pub_date"]))
+			if timezone.is_naive(pub_date) and timezone.is_aware(timezone.now()):
+				pub_date = timezone.make_aware(pub_date)
+		published = record.get("published", True)
+		if not isinstance(published, bool):
+			published = six.text_type(published).strip().lower() in TRUE_VALUES
+		return Article(
+			pk=int(record.get("id") or pk), title=record["title"], slug=record["slug"],
+			content=record.get("content") or "", published=published,
+			pub_date=pub_date or timezone.now())
+
+	def write_batch(self, checkpoint, batch):
+		"""写入一批记录，返回写入的文章数"""
+		self.created_columns = []
+		try:
+			self.write_rows(checkpoint, batch)
+		except Exception:
+			# 事务回滚后本批新建的栏目已不存在，从栏目缓存中删除
+			for slug in self.created_columns:
+				self.columns.pop(slug, None)
+			raise
+		self.stdout.write("Imported records up to %d" % checkpoint.position)
+		return len(batch)
+
+	def write_rows(self, checkpoint, batch):
+		"""在一个事务中写入文章、栏目关系、索引和进度"""
+		Through = Article.column.through
+		with transaction.atomic():
+			next_pk = (Article.objects.aggregate(max_pk=Max("pk"))["max_pk"] or 0) + 1
+			articles, links = [], []
+			for number, record in batch:
+				article = self.build_article(number, record, next_pk)
+				next_pk = max(next_pk, article.pk) + 1
+				articles.append(article)
+				links.extend(Through(article_id=article.pk, column_id=column_id)
+				             for column_id in self.get_column_ids(number, record.get("columns") or []))
+			Article.objects.bulk_create(articles)
+			Through.objects.bulk_create(links)
+			if not self.skip_index:
+				backfill_article_media([(article.pk, article.content) for article in articles])
+				search.write_documents([search.build_document(article.pk, article.title, article.content)
+				                        for article in articles if article.published])
+			checkpoint.position = batch[-1][0]
+			checkpoint.save(update_fields=["position", "update_time"])
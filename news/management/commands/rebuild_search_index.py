@@ -0,0 +1,25 @@
+"""
+Rebuild the article search index from scratch.  Published articles are
+read in primary-key batches, stripped of HTML and written to the
+backend chosen by ``news.search`` (SQLite FTS5, MySQL FULLTEXT or the
+``SearchTerm`` table).  The whole rebuild runs in one transaction, so
+searches keep using the old index until it commits.  Saving or deleting an article keeps the index
+up to date afterwards.
+"""
+
+from django.core.management.base import BaseCommand
+
+from news import search
+
+
+class Command(BaseCommand):
+	help = "Rebuild the full-text search index of published articles"
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--batch-size", type=int, default=500,
+			help="Number of articles read and indexed per query; the rebuild is a single transaction")
+
+	def handle(self, *args, **options):
+		total = search.rebuild(max(options["batch_size"], 1))
+		self.stdout.write("Indexed %d articles using the %s backend" % (total, search.get_backend()))
@@ -0,0 +1,59 @@
+# 文章引用的上传文件：保存文章时对比新旧引用，只写入变化的部分
+# 同时增减按内容去重保存的文件的引用次数，有引用的文件ueditor_gc不会删除
+from django.db import transaction
+from django.db.models import Count
+from DjangoUeditor import dedup,references
+from .models import Article,ArticleMedia
+
+def extract_media(content):
+	"""取得文章内容中引用的上传文件路径(相对MEDIA_ROOT)"""
+	paths = references.extract_paths([content],references.get_url_prefix())
+	return set(path for path in paths if len(path) <= 255)
+
+def update_article_media(article_id,content):
+	"""按文章内容更新引用表，返回(增加数,删除数)"""
+	new = extract_media(content)
+	old = set(ArticleMedia.objects.filter(article_id=article_id).values_list('path',flat=True))
+	added,removed = new - old,old - new
+	with transaction.atomic():
+		if removed:
+			ArticleMedia.objects.filter(article_id=article_id,path__in=list(removed)).delete()
+		if added:
+			ArticleMedia.objects.bulk_create([ArticleMedia(article_id=article_id,path=path) for path in added])
+		# 重新统计而不是增减，文件被移动(如ueditor_shard_media)后引用次数也随新路径正确计算
+		refresh_refcounts(added | removed)
+	return len(added),len(removed)
+
+def refresh_refcounts(paths):
+	"""按引用表重新统计paths被多少篇文章引用，写入按内容去重保存的文件的引用次数"""
+	paths = sorted(paths)
+	for i in range(0,len(paths),500):
+		counts = dict.fromkeys(paths[i:i + 500],0)
+		counts.update(ArticleMedia.objects.filter(path__in=paths[i:i + 500]).values_list('path').annotate(Count('id')))
+		dedup.set_refcounts(counts)
+
+def remove_article_media(article_id):
+	"""删除文章前减少其引用文件的引用次数，引用表中的记录随文章一起删除"""
+	dedup.release_blobs(ArticleMedia.objects.filter(article_id=article_id).values_list('path',flat=True))
+
+def backfill_article_media(rows):
+	"""重建一批文章的引用，rows为[(文章id,内容),...]，返回写入的引用数"""
+	media = []
+	for article_id,content in rows:
+		media.extend(ArticleMedia(article_id=article_id,path=path) for path in extract_media(content))
+	existing = ArticleMedia.objects.filter(article_id__in=[article_id for article_id,content in rows])
+	with transaction.atomic():
+		paths = set(existing.values_list('path',flat=True))
+		existing.delete()
+		ArticleMedia.objects.bulk_create(media)
+		paths.update(item.path for item in media)
+		refresh_refcounts(paths)
+	return len(media)
+
+def articles_using(path):
+	"""使用某个文件的文章，用于替换文件后清除这些文章的缓存"""
+	return Article.objects.filter(media__path=path).distinct()
+
+def is_referenced(path):
+	"""是否有文章引用这个文件，没有引用的文件可以删除"""
+	return ArticleMedia.objects.filter(path=path).exists()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0003_auto_20160827_1506'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleMedia',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(db_index=True, max_length=255, verbose_name='文件路径')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media', to='news.Article', verbose_name='文章')),
+            ],
+            options={
+                'verbose_name': '文章引用的文件',
+                'verbose_name_plural': '文章引用的文件',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='articlemedia',
+            unique_together=set([('article', 'path')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0005_article_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='update_time',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True, verbose_name='更新时间'),
+        ),
+    ]
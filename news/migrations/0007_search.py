@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+
+def create_fulltext_index(apps, schema_editor):
+    """SQLite支持FTS5时创建虚拟表，MySQL创建ngram的FULLTEXT索引，其它数据库使用SearchTerm"""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=connection.alias):
+                schema_editor.execute('CREATE VIRTUAL TABLE news_article_fts USING fts5(title, body)')
+        except Exception:
+            # 没有编译FTS5
+            pass
+    elif connection.vendor == 'mysql':
+        # ngram解析器从MySQL 5.7.6开始支持，更早的版本使用SearchTerm
+        if connection.mysql_version < (5, 7, 6):
+            return
+        try:
+            schema_editor.execute('ALTER TABLE news_searchdocument ADD FULLTEXT INDEX '
+                                  'news_search_fulltext (title, body) WITH PARSER ngram')
+        except Exception:
+            # 没有ngram解析器(如MariaDB)或不支持FULLTEXT索引
+            pass
+
+
+def drop_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS news_article_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0006_article_update_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='news.Article', verbose_name='文章')),
+                ('title', models.CharField(max_length=256, verbose_name='标题')),
+                ('body', models.TextField(blank=True, default='', verbose_name='正文')),
+                ('length', models.PositiveIntegerField(default=0, verbose_name='词数')),
+            ],
+            options={
+                'verbose_name': '搜索文档',
+                'verbose_name_plural': '搜索文档',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='词')),
+                ('tf', models.PositiveIntegerField(default=0, verbose_name='出现次数')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='news.Article', verbose_name='文章')),
+            ],
+            options={
+                'verbose_name': '索引词',
+                'verbose_name_plural': '索引词',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchterm',
+            unique_together=set([('term', 'article')]),
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
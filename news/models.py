@@ -26,7 +26,7 @@ class Article(models.Model):
         toolbars='besttome', filePath='uploads/files/')
 	published = models.BooleanField('正式发布',default=True)
 	pub_date = models.DateTimeField('发表时间',auto_now_add=True,editable=True)
-	update_time = models.DateTimeField('更新时间',auto_now=True,null=True)
+	update_time = models.DateTimeField('更新时间',auto_now=True,null=True,db_index=True)
 	def get_absolute_url(self):
 		return reverse('article',args=(self.pk,self.slug,))
 	def __str__(self):
@@ -34,3 +34,47 @@ class Article(models.Model):
 	class Meta:
 		verbose_name = '教程'
 		verbose_name_plural='教程'
+		# 栏目页按(发表时间,id)分页
+		index_together = [('pub_date','id')]
+class ArticleMedia(models.Model):
+	"""文章内容引用的上传文件，保存文章时按内容更新，用于查找使用某个文件的文章"""
+	article = models.ForeignKey(Article,related_name='media',verbose_name='文章')
+	path = models.CharField('文件路径',max_length=255,db_index=True)
+	def __str__(self):
+		return self.path
+	class Meta:
+		verbose_name = '文章引用的文件'
+		verbose_name_plural='文章引用的文件'
+		unique_together = [('article','path')]
+class SearchDocument(models.Model):
+	"""文章去掉HTML后的文本，由news.search在保存文章时更新，用于全文索引和搜索结果的摘要"""
+	article = models.OneToOneField(Article,primary_key=True,related_name='search_document',verbose_name='文章')
+	title = models.CharField('标题',max_length=256)
+	body = models.TextField('正文',default='',blank=True)
+	length = models.PositiveIntegerField('词数',default=0)
+	def __str__(self):
+		return self.title
+	class Meta:
+		verbose_name = '搜索文档'
+		verbose_name_plural='搜索文档'
+class SearchTerm(models.Model):
+	"""没有数据库全文索引时使用的倒排索引：词在文章中出现的次数(标题中的词计两次)"""
+	term = models.CharField('词',max_length=64)
+	article = models.ForeignKey(Article,related_name='+',verbose_name='文章')
+	tf = models.PositiveIntegerField('出现次数',default=0)
+	def __str__(self):
+		return self.term
+	class Meta:
+		verbose_name = '索引词'
+		verbose_name_plural='索引词'
+		unique_together = [('term','article')]
+class ImportCheckpoint(models.Model):
+	"""import_articles的进度：已导入的记录数，与每批文章在同一个事务中更新"""
+	name = models.CharField('导入名称',max_length=255,unique=True)
+	position = models.BigIntegerField('已导入的记录数',default=0)
+	update_time = models.DateTimeField('更新时间',auto_now=True)
+	def __str__(self):
+		return self.name
+	class Meta:
+		verbose_name = '导入进度'
+		verbose_name_plural='导入进度'
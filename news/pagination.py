@@ -0,0 +1,57 @@
+# 按(发表时间,id)的键集分页：用上一页最后一篇文章的位置作为游标，翻到任何一页都只读取一页的行
+import calendar
+import datetime
+from django.db.models import Q
+from django.utils import timezone
+
+# 列表页需要的字段，不读取内容
+LIST_FIELDS = ('pk','title','slug','pub_date')
+
+def encode_cursor(article):
+	"""游标为"发表时间的微秒数-id"，可以直接放在网址中"""
+	pub_date = article.pub_date
+	if timezone.is_aware(pub_date):
+		pub_date = timezone.make_naive(pub_date,timezone.utc)
+	micros = calendar.timegm(pub_date.timetuple()) * 1000000 + pub_date.microsecond
+	return '%d-%d' % (micros,article.pk)
+
+def decode_cursor(cursor):
+	"""返回(发表时间,id)，游标无效时返回None"""
+	try:
+		micros,pk = cursor.split('-')
+		micros,pk = int(micros),int(pk)
+		pub_date = datetime.datetime(1970,1,1) + datetime.timedelta(microseconds=micros)
+	except (ValueError,OverflowError):
+		return None
+	if timezone.is_aware(timezone.now()):
+		pub_date = timezone.make_aware(pub_date,timezone.utc)
+	return pub_date,pk
+
+def keyset_page(queryset,after=None,before=None,per_page=20):
+	"""
+	按发表时间从新到旧分页，after为下一页(更早)的游标，before为上一页(更新)的游标
+	返回{'articles':文章列表,'next':下一页游标或None,'prev':上一页游标或None}
+	"""
+	queryset = queryset.only(*[name for name in LIST_FIELDS if name != 'pk'])
+	position = decode_cursor(before) if before else None
+	if position is not None:
+		pub_date,pk = position
+		rows = list(queryset.filter(Q(pub_date__gt=pub_date) | Q(pub_date=pub_date,pk__gt=pk))
+			.order_by('pub_date','pk')[:per_page + 1])
+		has_prev = len(rows) > per_page
+		articles = rows[:per_page][::-1]
+		has_next = True
+	else:
+		position = decode_cursor(after) if after else None
+		if position is not None:
+			pub_date,pk = position
+			queryset = queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date,pk__lt=pk))
+		rows = list(queryset.order_by('-pub_date','-pk')[:per_page + 1])
+		articles = rows[:per_page]
+		has_next = len(rows) > per_page
+		has_prev = position is not None
+	return {
+		'articles':articles,
+		'next':encode_cursor(articles[-1]) if has_next and articles else None,
+		'prev':encode_cursor(articles[0]) if has_prev and articles else None,
+	}
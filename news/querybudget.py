@@ -0,0 +1,88 @@
+# 查询预算：记录每个请求执行的SQL数量、数据库耗时和重复的SQL形状，发现N+1查询
+# 中间件在DEBUG或NEWS_QUERY_BUDGET_ENABLED时启用，测试中用QueryBudget断言视图的查询数量
+import re
+import time
+import logging
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger('news.querybudget')
+
+# 同一形状的SQL重复超过此次数时视为N+1查询
+REPEAT_THRESHOLD = getattr(settings,'NEWS_QUERY_REPEAT_THRESHOLD',3)
+# 每个视图(url名称)允许的查询数量，如{'article':2}
+QUERY_BUDGETS = getattr(settings,'NEWS_QUERY_BUDGETS',{})
+
+STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_PATTERN = re.compile(r"\bIN \([^)]*\)",re.I)
+SPACE_PATTERN = re.compile(r"\s+")
+
+def fingerprint(sql):
+	"""SQL的形状：去掉字符串、数字和IN列表中的值，只有参数不同的查询得到相同的结果"""
+	sql = STRING_PATTERN.sub('?',sql)
+	sql = NUMBER_PATTERN.sub('?',sql)
+	sql = IN_PATTERN.sub('IN (...)',sql)
+	return SPACE_PATTERN.sub(' ',sql).strip()
+
+class QueryReport(object):
+	"""一组查询的统计：数量、数据库耗时(秒)和重复的SQL形状"""
+	def __init__(self,queries,threshold=REPEAT_THRESHOLD):
+		self.queries = queries
+		self.count = len(queries)
+		self.time = sum(float(query.get('time') or 0) for query in queries)
+		self.fingerprints = Counter(fingerprint(query['sql']) for query in queries)
+		self.repeated = [(sql,n) for sql,n in self.fingerprints.most_common() if n > threshold]
+
+	def summary(self):
+		lines = ['%d queries, %.1fms' % (self.count,self.time * 1000)]
+		for sql,n in self.repeated:
+			lines.append('repeated %d times: %s' % (n,sql))
+		return '\n'.join(lines)
+
+class QueryBudget(CaptureQueriesContext):
+	"""
+	测试用的上下文管理器，超出查询数量或出现N+1查询时抛出AssertionError：
+		with QueryBudget(2):
+			self.client.get(url)
+	"""
+	def __init__(self,max_queries,threshold=REPEAT_THRESHOLD):
+		self.max_queries = max_queries
+		self.threshold = threshold
+		super(QueryBudget,self).__init__(connection)
+
+	def __exit__(self,exc_type,exc_value,traceback):
+		super(QueryBudget,self).__exit__(exc_type,exc_value,traceback)
+		if exc_type is not None:
+			return
+		self.report = QueryReport(self.captured_queries,self.threshold)
+		if self.report.count > self.max_queries:
+			raise AssertionError('%d queries executed, budget is %d\n%s' % (
+				self.report.count,self.max_queries,self.report.summary()))
+		if self.report.repeated:
+			raise AssertionError('N+1 queries detected\n%s' % self.report.summary())
+
+class QueryBudgetMiddleware(object):
+	"""记录每个请求的查询，出现N+1或超出视图的预算时记录警告，并在响应头中返回查询数量和耗时"""
+	def __init__(self,get_response):
+		self.get_response = get_response
+		self.enabled = getattr(settings,'NEWS_QUERY_BUDGET_ENABLED',settings.DEBUG)
+
+	def __call__(self,request):
+		if not self.enabled:
+			return self.get_response(request)
+		started = time.time()
+		with CaptureQueriesContext(connection) as context:
+			response = self.get_response(request)
+		report = QueryReport(context.captured_queries)
+		match = getattr(request,'resolver_match',None)
+		view_name = match.view_name if match else request.path
+		budget = QUERY_BUDGETS.get(view_name)
+		if report.repeated or (budget is not None and report.count > budget):
+			logger.warning('%s (%s) %s',request.path,view_name,report.summary())
+		response['X-DB-Queries'] = str(report.count)
+		response['X-DB-Time'] = '%.1fms' % (report.time * 1000)
+		response['X-Response-Time'] = '%.1fms' % ((time.time() - started) * 1000)
+		return response
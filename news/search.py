@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# 文章全文搜索：保存文章时去掉HTML、分词并更新索引，按BM25排序
+# SQLite使用FTS5虚拟表，MySQL使用ngram解析器的FULLTEXT索引，其它数据库(或SQLite不支持FTS5时)使用SearchTerm倒排表
+# 中日韩文字按相邻两个字切分，其它文字按单词切分
+from __future__ import unicode_literals
+import re
+import math
+from collections import Counter
+from django.conf import settings
+from django.db import connection,transaction
+from django.db.models import Avg,Count
+from django.utils.html import strip_tags
+from .models import Article,SearchDocument,SearchTerm
+
+try:
+	from html import unescape
+except ImportError:
+	# Python 2
+	from HTMLParser import HTMLParser
+	unescape = HTMLParser().unescape
+
+# 使用的索引："auto"按数据库选择，或指定"sqlite"、"mysql"、"python"
+SEARCH_BACKEND = getattr(settings,'NEWS_SEARCH_BACKEND','auto')
+FTS_TABLE = 'news_article_fts'
+MYSQL_INDEX = 'news_search_fulltext'
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 标题中的词的权重
+TITLE_WEIGHT = 2
+# 摘要的长度
+SNIPPET_LENGTH = 120
+
+CJK_RANGES = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+WORD_PATTERN = re.compile('[%s]+|[^\\W_%s]+' % (CJK_RANGES,CJK_RANGES),re.U)
+CJK_PATTERN = re.compile('[%s]' % CJK_RANGES,re.U)
+SKIP_TAGS_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>',re.I | re.S)
+SPACE_PATTERN = re.compile(r'\s+')
+
+# 已确定的索引类型
+_backend = []
+
+def strip_html(content):
+	"""文章内容的纯文本"""
+	content = SKIP_TAGS_PATTERN.sub(' ',content or '')
+	# 块级标签之间的文字不能连在一起
+	content = strip_tags(content.replace('<',' <'))
+	return SPACE_PATTERN.sub(' ',unescape(content)).strip()
+
+def split_words(text):
+	return WORD_PATTERN.findall(text.lower())
+
+def tokenize(text):
+	"""分词，中日韩文字切为相邻的两个字，单独的一个字保留"""
+	tokens = []
+	for word in split_words(text):
+		if CJK_PATTERN.match(word):
+			if len(word) == 1:
+				tokens.append(word)
+			else:
+				tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+		else:
+			tokens.append(word[:64])
+	return tokens
+
+def get_backend():
+	if not _backend:
+		backend = SEARCH_BACKEND
+		if backend == 'auto':
+			backend = 'python'
+			if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+				backend = 'sqlite'
+			elif connection.vendor == 'mysql':
+				with connection.cursor() as cursor:
+					cursor.execute('SHOW INDEX FROM news_searchdocument WHERE Key_name = %s',[MYSQL_INDEX])
+					if cursor.fetchone():
+						backend = 'mysql'
+		_backend.append(backend)
+	return _backend[0]
+
+def build_document(article_id,title,content):
+	"""返回(SearchDocument,标题的词,正文的词)"""
+	body = strip_html(content)
+	title_tokens,body_tokens = tokenize(title),tokenize(body)
+	document = SearchDocument(article_id=article_id,title=title,body=body,
+		length=TITLE_WEIGHT * len(title_tokens) + len(body_tokens))
+	return document,title_tokens,body_tokens
+
+def write_documents(documents):
+	"""写入一批[(SearchDocument,标题的词,正文的词),...]，替换这些文章原来的索引"""
+	backend = get_backend()
+	ids = [document.pk for document,title_tokens,body_tokens in documents]
+	with transaction.atomic():
+		delete_documents(ids)
+		SearchDocument.objects.bulk_create([item[0] for item in documents])
+		if backend == 'sqlite':
+			with connection.cursor() as cursor:
+				cursor.executemany('INSERT INTO %s (rowid,title,body) VALUES (%%s,%%s,%%s)' % FTS_TABLE,
+					[(document.pk,' '.join(title_tokens),' '.join(body_tokens))
+					for document,title_tokens,body_tokens in documents])
+		elif backend == 'python':
+			terms = []
+			for document,title_tokens,body_tokens in documents:
+				counts = Counter(body_tokens)
+				for token in title_tokens:
+					counts[token] += TITLE_WEIGHT
+				terms.extend(SearchTerm(term=term,article_id=document.pk,tf=tf) for term,tf in counts.items())
+			SearchTerm.objects.bulk_create(terms,batch_size=1000)
+
+def delete_documents(ids):
+	if not ids:
+		return
+	backend = get_backend()
+	SearchDocument.objects.filter(pk__in=ids).delete()
+	if backend == 'sqlite':
+		with connection.cursor() as cursor:
+			cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE,','.join(['%s'] * len(ids))),ids)
+	elif backend == 'python':
+		SearchTerm.objects.filter(article_id__in=ids).delete()
+
+def index_article(article):
+	"""保存文章后更新索引，未发布的文章从索引中删除"""
+	if article.published:
+		write_documents([build_document(article.pk,article.title,article.content)])
+	else:
+		with transaction.atomic():
+			delete_documents([article.pk])
+
+def remove_article(article_id):
+	with transaction.atomic():
+		delete_documents([article_id])
+
+def rebuild(batch_size=500):
+	"""
+	按主键分批重建全部索引，返回索引的文章数
+	在一个事务中清空并重建，重建期间的搜索仍使用原来的索引
+	"""
+	queryset = Article.objects.filter(published=True).order_by('pk').values_list('pk','title','content')
+	total = last_pk = 0
+	with transaction.atomic():
+		SearchDocument.objects.all().delete()
+		if get_backend() == 'sqlite':
+			with connection.cursor() as cursor:
+				cursor.execute('DELETE FROM %s' % FTS_TABLE)
+		elif get_backend() == 'python':
+			SearchTerm.objects.all().delete()
+		while True:
+			rows = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+			if not rows:
+				return total
+			write_documents([build_document(*row) for row in rows])
+			total += len(rows)
+			last_pk = rows[-1][0]
+
+def search_sqlite(tokens,offset,limit):
+	# 每个词加引号，FTS5对多个词取交集；bm25()越小越相关
+	query = ' '.join('"%s"' % token.replace('"','""') for token in tokens)
+	with connection.cursor() as cursor:
+		cursor.execute('SELECT count(*) FROM %s WHERE %s MATCH %%s' % (FTS_TABLE,FTS_TABLE),[query])
+		total = cursor.fetchone()[0]
+		cursor.execute('SELECT rowid,-bm25(%s,%s,1.0) AS score FROM %s WHERE %s MATCH %%s '
+			'ORDER BY score DESC LIMIT %%s OFFSET %%s' % (FTS_TABLE,float(TITLE_WEIGHT),FTS_TABLE,FTS_TABLE),
+			[query,limit,offset])
+		return total,cursor.fetchall()
+
+def search_mysql(words,offset,limit):
+	# ngram解析器自己切分中文，所有词都必须出现；排序使用InnoDB的相关度
+	query = ' '.join('+"%s"' % word.replace('"','') for word in words)
+	match = 'MATCH (title,body) AGAINST (%s IN BOOLEAN MODE)'
+	with connection.cursor() as cursor:
+		cursor.execute('SELECT count(*) FROM news_searchdocument WHERE ' + match,[query])
+		total = cursor.fetchone()[0]
+		cursor.execute('SELECT article_id,%s AS score FROM news_searchdocument WHERE %s '
+			'ORDER BY score DESC LIMIT %%s OFFSET %%s' % (match,match),[query,query,limit,offset])
+		return total,cursor.fetchall()
+
+def search_python(tokens,offset,limit):
+	"""在SearchTerm中取出每个词的文章，对包含全部词的文章计算BM25"""
+	terms = set(tokens)
+	postings = {}
+	for term,article_id,tf in SearchTerm.objects.filter(term__in=terms).values_list('term','article_id','tf').iterator():
+		postings.setdefault(term,{})[article_id] = tf
+	if len(postings) < len(terms):
+		return 0,[]
+	candidates = set.intersection(*[set(articles) for articles in postings.values()])
+	if not candidates:
+		return 0,[]
+	stats = SearchDocument.objects.aggregate(count=Count('pk'),avg=Avg('length'))
+	count,avg_length = stats['count'],float(stats['avg'] or 1)
+	lengths = dict(SearchDocument.objects.filter(pk__in=list(candidates)).values_list('pk','length'))
+	scores = []
+	for article_id in candidates:
+		norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths.get(article_id,0) / avg_length)
+		score = 0.0
+		for term,articles in postings.items():
+			idf = math.log(1 + (count - len(articles) + 0.5) / (len(articles) + 0.5))
+			tf = articles[article_id]
+			score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+		scores.append((article_id,score))
+	scores.sort(key=lambda item:(-item[1],-item[0]))
+	return len(scores),scores[offset:offset + limit]
+
+def make_snippet(body,words):
+	"""正文中第一个查询词附近的文字"""
+	lower = body.lower()
+	positions = [lower.find(word) for word in words]
+	positions = [position for position in positions if position >= 0]
+	start = max(min(positions) - SNIPPET_LENGTH // 4,0) if positions else 0
+	snippet = body[start:start + SNIPPET_LENGTH]
+	if start > 0:
+		snippet = '…' + snippet
+	if start + SNIPPET_LENGTH < len(body):
+		snippet += '…'
+	return snippet
+
+def search(query,page=1,per_page=20):
+	"""
+	搜索已发布的文章，返回{'total':结果数,'page':页码,'has_next':是否有下一页,
+	'results':[{'article':文章,'score':得分,'snippet':摘要},...]}
+	"""
+	words,tokens = split_words(query),tokenize(query)
+	page = max(page,1)
+	offset = (page - 1) * per_page
+	total,rows = 0,[]
+	if tokens:
+		backend = get_backend()
+		if backend == 'sqlite':
+			total,rows = search_sqlite(tokens,offset,per_page)
+		elif backend == 'mysql':
+			total,rows = search_mysql(words,offset,per_page)
+		else:
+			total,rows = search_python(tokens,offset,per_page)
+	ids = [row[0] for row in rows]
+	articles = Article.objects.only('title','slug','pub_date').in_bulk(ids)
+	bodies = dict(SearchDocument.objects.filter(pk__in=ids).values_list('pk','body'))
+	results = [{
+		'article':articles[article_id],
+		'score':float(score),
+		'snippet':make_snippet(bodies.get(article_id,''),words),
+	} for article_id,score in rows if article_id in articles]
+	return {'total':total,'page':page,'has_next':offset + per_page < total,'results':results}
@@ -0,0 +1,40 @@
+from django.db.models.signals import m2m_changed,post_delete,post_save,pre_delete
+from django.dispatch import receiver
+from .models import Article
+from .media import remove_article_media,update_article_media
+from .cache import invalidate
+from .search import index_article,remove_article
+
+@receiver(post_save,sender=Article)
+def article_saved(sender,instance,raw=False,**kwargs):
+	invalidate(instance.pk)
+	# 导入fixture时不处理，可以之后运行backfill_article_media
+	if raw:
+		return
+	update_article_media(instance.pk,instance.content)
+	index_article(instance)
+
+@receiver(pre_delete,sender=Article)
+def article_deleting(sender,instance,**kwargs):
+	remove_article_media(instance.pk)
+
+@receiver(post_delete,sender=Article)
+def article_deleted(sender,instance,**kwargs):
+	invalidate(instance.pk)
+	remove_article(instance.pk)
+
+@receiver(m2m_changed,sender=Article.column.through)
+def article_columns_changed(sender,instance,action,reverse,pk_set,**kwargs):
+	# post_clear时已无法知道栏目原来的文章，只处理pre_clear
+	if action == 'pre_clear' and reverse:
+		for pk in instance.article_set.values_list('pk',flat=True):
+			invalidate(pk)
+		return
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		invalidate(instance.pk)
+	elif pk_set:
+		# 从栏目一侧修改时pk_set为文章id
+		for pk in pk_set:
+			invalidate(pk)
@@ -1,3 +1,323 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from DjangoUeditor.models import MediaBlob
+from . import cache as article_cache
+from . import views
+from .media import articles_using,is_referenced,update_article_media
+from .models import Column,Article,ArticleMedia,ImportCheckpoint
+from .pagination import decode_cursor,encode_cursor,keyset_page
+from .querybudget import QueryBudget,fingerprint
+from .search import search,strip_html,tokenize
 
 # Create your tests here.
+class FingerprintTests(TestCase):
+	def test_parameters_are_removed(self):
+		self.assertEqual(
+			fingerprint("SELECT * FROM news_article WHERE id = 1 AND slug = 'a''b'"),
+			fingerprint("SELECT *  FROM news_article WHERE id = 25 AND slug = 'c'"))
+
+	def test_in_lists_are_collapsed(self):
+		self.assertEqual(
+			fingerprint('SELECT * FROM news_column WHERE id IN (1, 2)'),
+			fingerprint('SELECT * FROM news_column WHERE id IN (3, 4, 5)'))
+
+class QueryBudgetTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.columns = [Column.objects.create(name='栏目%d' % i,slug='column%d' % i) for i in range(5)]
+		for i in range(30):
+			article = Article.objects.create(title='教程%d' % i,slug='article%d' % i,content='<p>%d</p>' % i)
+			article.column.add(self.columns[i % 5])
+		self.article = article
+
+	def test_index(self):
+		with QueryBudget(1):
+			response = self.client.get('/')
+		self.assertEqual(response.status_code,200)
+
+	def test_column_detail(self):
+		with QueryBudget(3):
+			response = self.client.get(self.columns[0].get_absolute_url())
+		self.assertEqual(response.status_code,200)
+
+	def test_article_detail(self):
+		with QueryBudget(2):
+			response = self.client.get(self.article.get_absolute_url())
+		self.assertEqual(response.status_code,200)
+		# 第二次从缓存中读取，只查询更新时间
+		with QueryBudget(1):
+			self.client.get(self.article.get_absolute_url())
+
+	def test_article_not_modified(self):
+		response = self.client.get(self.article.get_absolute_url())
+		with QueryBudget(1):
+			response = self.client.get(self.article.get_absolute_url(),HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(response.status_code,304)
+
+	def test_column_not_modified(self):
+		url = self.columns[0].get_absolute_url()
+		etag = self.client.get(url)['ETag']
+		self.assertEqual(self.client.get(url,HTTP_IF_NONE_MATCH=etag).status_code,304)
+		# 修改栏目本身后ETag随之变化
+		self.columns[0].intro = '新的简介'
+		self.columns[0].save()
+		response = self.client.get(url,HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code,200)
+		self.assertContains(response,'新的简介')
+		self.assertNotEqual(response['ETag'],etag)
+
+	def test_repeated_queries_are_detected(self):
+		with self.assertRaises(AssertionError):
+			with QueryBudget(100):
+				for column in Column.objects.all():
+					list(column.article_set.all())
+
+class ArticleCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.column = Column.objects.create(name='栏目',slug='column')
+		self.article = Article.objects.create(title='教程',slug='article',content='旧的内容')
+		self.builds = 0
+
+	def build(self,content='新页面',delay=0):
+		def build():
+			self.builds += 1
+			time.sleep(delay)
+			return HttpResponse(content)
+		return build
+
+	def get_page(self,build):
+		return article_cache.cached_article_page(self.article.pk,self.article.slug,self.article.update_time,build)
+
+	def assertInvalidated(self,change):
+		version = article_cache.get_version(self.article.pk)
+		change()
+		self.assertNotEqual(article_cache.get_version(self.article.pk),version)
+
+	def test_save_invalidates(self):
+		url = self.article.get_absolute_url()
+		self.assertContains(self.client.get(url),'旧的内容')
+		self.article.content = '新的内容'
+		self.assertInvalidated(self.article.save)
+		response = self.client.get(url)
+		self.assertContains(response,'新的内容')
+		self.assertNotContains(response,'旧的内容')
+
+	def test_column_changes_invalidate(self):
+		self.assertInvalidated(lambda: self.article.column.add(self.column))
+		self.assertInvalidated(lambda: self.article.column.remove(self.column))
+		# 从栏目一侧修改
+		self.assertInvalidated(lambda: self.column.article_set.add(self.article))
+		self.assertInvalidated(lambda: self.column.article_set.clear())
+		self.article.column.add(self.column)
+		self.assertInvalidated(lambda: self.article.column.clear())
+
+	def test_cached_page(self):
+		self.assertContains(self.get_page(self.build()),'新页面')
+		self.assertContains(self.get_page(self.build('另一个页面')),'新页面')
+		self.assertEqual(self.builds,1)
+
+	def test_stale_page_while_rebuilding(self):
+		key = article_cache.page_key(self.article.pk,self.article.slug,self.article.update_time)
+		page = ('旧页面'.encode('utf-8'),'text/html; charset=utf-8')
+		cache.set(key,(time.time() - 1,page))
+		# 其它请求正在重新生成，返回过期的页面
+		cache.add(key + ':lock',1)
+		self.assertContains(self.get_page(self.build()),'旧页面')
+		self.assertEqual(self.builds,0)
+		# 锁释放后由一个请求重新生成
+		cache.delete(key + ':lock')
+		self.assertContains(self.get_page(self.build()),'新页面')
+		self.assertContains(self.get_page(self.build()),'新页面')
+		self.assertEqual(self.builds,1)
+
+	def test_concurrent_requests_build_once(self):
+		responses = []
+		threads = [threading.Thread(target=lambda: responses.append(self.get_page(self.build(delay=0.2))))
+			for i in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(self.builds,1)
+		self.assertEqual([response.content for response in responses],['新页面'.encode('utf-8')] * 5)
+
+class KeysetPaginationTests(TestCase):
+	def setUp(self):
+		self.column = Column.objects.create(name='栏目',slug='column')
+		now = timezone.now().replace(microsecond=123456)
+		for i in range(8):
+			article = Article.objects.create(title='文章%d' % i,slug='article%d' % i)
+			article.column.add(self.column)
+			# 中间四篇的发表时间相同，按id排序
+			pub_date = now - datetime.timedelta(hours=2 if 2 <= i <= 5 else i)
+			Article.objects.filter(pk=article.pk).update(pub_date=pub_date)
+		self.expected = list(Article.objects.order_by('-pub_date','-pk').values_list('pk',flat=True))
+
+	def pks(self,page):
+		return [article.pk for article in page['articles']]
+
+	def test_cursor(self):
+		article = Article.objects.get(slug='article3')
+		self.assertEqual(decode_cursor(encode_cursor(article)),(article.pub_date,article.pk))
+
+	def test_pages_are_stable_across_ties(self):
+		pages = [keyset_page(Article.objects.all(),per_page=3)]
+		while pages[-1]['next']:
+			pages.append(keyset_page(Article.objects.all(),after=pages[-1]['next'],per_page=3))
+		self.assertEqual([len(page['articles']) for page in pages],[3,3,2])
+		self.assertEqual(sum([self.pks(page) for page in pages],[]),self.expected)
+		self.assertIsNone(pages[0]['prev'])
+		# 从最后一页往前翻，每页与往后翻时相同
+		page = pages[-1]
+		for expected in reversed(pages[:-1]):
+			page = keyset_page(Article.objects.all(),before=page['prev'],per_page=3)
+			self.assertEqual(self.pks(page),self.pks(expected))
+			self.assertEqual(page['next'],expected['next'])
+		self.assertIsNone(page['prev'])
+
+	def test_bad_cursor(self):
+		first = self.pks(keyset_page(Article.objects.all(),per_page=3))
+		for cursor in ('x','1-2-3','1-x','%d-1' % 10 ** 20):
+			for name in ('after','before'):
+				page = keyset_page(Article.objects.all(),per_page=3,**{name:cursor})
+				self.assertEqual(self.pks(page),first)
+				self.assertIsNone(page['prev'])
+
+	def test_column_links(self):
+		old = views.COLUMN_PAGE_SIZE
+		views.COLUMN_PAGE_SIZE = 3
+		self.addCleanup(setattr,views,'COLUMN_PAGE_SIZE',old)
+		url = self.column.get_absolute_url()
+		response = self.client.get(url)
+		next_cursor = response.context['page']['next']
+		self.assertContains(response,'href="?after=%s"' % next_cursor)
+		self.assertNotContains(response,'?before=')
+		response = self.client.get(url,{'after':next_cursor})
+		self.assertEqual([article.pk for article in response.context['page']['articles']],self.expected[3:6])
+		self.assertContains(response,'href="?before=%s"' % response.context['page']['prev'])
+		self.assertContains(response,'href="?after=')
+		response = self.client.get(url,{'before':response.context['page']['prev']})
+		self.assertEqual([article.pk for article in response.context['page']['articles']],self.expected[:3])
+		self.assertEqual(self.client.get(url,{'after':'bad'}).status_code,200)
+
+class SearchTests(TestCase):
+	def setUp(self):
+		self.article = Article.objects.create(title='Django教程',slug='django',
+			content='<p>使用<b>全文</b>搜索</p><script>var hidden;</script>')
+		Article.objects.create(title='草稿',slug='draft',content='<p>全文搜索</p>',published=False)
+
+	def test_tokenize(self):
+		self.assertEqual(strip_html('<p>a&amp;b</p><style>p{}</style><p>c</p>'),'a&b c')
+		self.assertEqual(tokenize('Django全文搜索'),['django','全文','文搜','搜索'])
+
+	def test_search(self):
+		results = search('全文')
+		self.assertEqual(results['total'],1)
+		self.assertEqual(results['results'][0]['article'].pk,self.article.pk)
+		self.assertEqual(search('hidden')['total'],0)
+
+	def test_index_follows_changes(self):
+		self.article.title = 'Python教程'
+		self.article.save()
+		self.assertEqual(search('django')['total'],0)
+		self.assertEqual(search('python')['total'],1)
+		self.article.delete()
+		self.assertEqual(search('全文')['total'],0)
+
+class ArticleMediaTests(TestCase):
+	def setUp(self):
+		self.article = Article.objects.create(title='a',slug='a',
+			content='<img src="/media/uploads/a.png"><a href="/media/uploads/b%20c.txt">b</a>')
+
+	def paths(self,article):
+		return sorted(article.media.values_list('path',flat=True))
+
+	def test_saved_content_is_diffed(self):
+		self.assertEqual(self.paths(self.article),['uploads/a.png','uploads/b c.txt'])
+		self.article.content = '<img src="/media/uploads/a.png"><img src="/ueditor/media-resize/320x0/uploads/d.png">'
+		self.article.save()
+		self.assertEqual(self.paths(self.article),['uploads/a.png','uploads/d.png'])
+		# 未修改的引用不重写
+		self.assertEqual(update_article_media(self.article.pk,self.article.content),(0,0))
+		self.assertEqual(update_article_media(self.article.pk,''),(0,2))
+
+	def test_lookups(self):
+		other = Article.objects.create(title='b',slug='b',content='<img src="/media/uploads/a.png">')
+		self.assertEqual(sorted(article.pk for article in articles_using('uploads/a.png')),[self.article.pk,other.pk])
+		self.assertEqual(list(articles_using('uploads/b c.txt')),[self.article])
+		self.assertTrue(is_referenced('uploads/b c.txt'))
+		self.article.delete()
+		self.assertFalse(is_referenced('uploads/b c.txt'))
+		self.assertEqual(list(articles_using('uploads/a.png')),[other])
+
+	def test_backfill_command(self):
+		Article.objects.create(title='b',slug='b',content='<img src="/media/uploads/e.png">')
+		# 保存时未更新引用表，如导入的fixture
+		ArticleMedia.objects.all().delete()
+		ArticleMedia.objects.create(article=self.article,path='uploads/stale.png')
+		out = StringIO()
+		call_command('backfill_article_media',batch_size=1,stdout=out)
+		self.assertIn('Indexed 3 references in 2 articles',out.getvalue())
+		self.assertEqual(self.paths(self.article),['uploads/a.png','uploads/b c.txt'])
+		self.assertTrue(is_referenced('uploads/e.png'))
+
+class BlobRefcountTests(TestCase):
+	def setUp(self):
+		for i,path in enumerate(('uploads/a.png','uploads/b.png')):
+			MediaBlob.objects.create(sha1=str(i) * 40,path=path,size=1)
+
+	def refcounts(self):
+		return dict(MediaBlob.objects.values_list('path','refcount'))
+
+	def test_article_changes(self):
+		article = Article.objects.create(title='a',slug='a',content='<img src="/media/uploads/a.png">')
+		other = Article.objects.create(title='b',slug='b',
+			content='<img src="/media/uploads/a.png"><img src="/media/uploads/a.png">')
+		self.assertEqual(self.refcounts(),{'uploads/a.png':2,'uploads/b.png':0})
+		article.content = '<a href="/media/uploads/b.png">b</a>'
+		article.save()
+		self.assertEqual(self.refcounts(),{'uploads/a.png':1,'uploads/b.png':1})
+		other.delete()
+		self.assertEqual(self.refcounts(),{'uploads/a.png':0,'uploads/b.png':1})
+
+	def test_backfill(self):
+		Article.objects.create(title='a',slug='a',content='<img src="/media/uploads/a.png">')
+		MediaBlob.objects.update(refcount=5)
+		call_command('backfill_article_media',stdout=StringIO())
+		self.assertEqual(self.refcounts(),{'uploads/a.png':1,'uploads/b.png':5})
+
+class ImportArticlesTests(TestCase):
+	def setUp(self):
+		Column.objects.create(name='科技新闻',slug='tech')
+		fd,self.path = tempfile.mkstemp(suffix='.jsonl')
+		with os.fdopen(fd,'w') as f:
+			for i in range(5):
+				f.write(json.dumps({'title':'新闻%d' % i,'slug':'article_%d' % i,'content':'<p>内容%d</p>' % i,
+					'columns':['tech'],'pub_date':'2016-08-27T07:54:0%d' % i}) + '\n')
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test_import_and_resume(self):
+		call_command('import_articles',self.path,batch_size=2,stdout=StringIO())
+		self.assertEqual(Article.objects.count(),5)
+		self.assertEqual(Column.objects.get(slug='tech').article_set.count(),5)
+		self.assertEqual(Article.objects.get(slug='article_3').pub_date.second,3)
+		self.assertEqual(search('内容')['total'],5)
+		self.assertEqual(ImportCheckpoint.objects.get().position,5)
+		# 再次运行时跳过已导入的记录
+		call_command('import_articles',self.path,stdout=StringIO())
+		self.assertEqual(Article.objects.count(),5)
@@ -1,18 +1,71 @@
 from django.shortcuts import render,redirect
-from django.http import HttpResponse
+from django.http import HttpResponse,JsonResponse
+from django.conf import settings
+from django.views.decorators.http import condition
 from .models import Column,Article
+from .cache import cached_article_page
+from .pagination import keyset_page
+from .search import search as search_articles
+from .conditional import article_state,article_etag,article_last_modified,column_etag,column_last_modified
+
+# 栏目页每页的文章数
+COLUMN_PAGE_SIZE = getattr(settings,'NEWS_COLUMN_PAGE_SIZE',20)
+# 搜索结果每页的文章数
+SEARCH_PAGE_SIZE = getattr(settings,'NEWS_SEARCH_PAGE_SIZE',20)
  
 def index(request):
 	columns = Column.objects.all()
 	return render(request,'index.html',{'columns':columns}) 
  
+@condition(etag_func=column_etag,last_modified_func=column_last_modified)
 def column_detail(request, column_slug):
 	column = Column.objects.get(slug=column_slug)
-	return render(request,'news/column.html',{'column':column})
+	page = keyset_page(column.article_set.all(),after=request.GET.get('after'),
+		before=request.GET.get('before'),per_page=COLUMN_PAGE_SIZE)
+	return render(request,'news/column.html',{'column':column,'page':page})
  
  
+@condition(etag_func=article_etag,last_modified_func=article_last_modified)
 def article_detail(request,pk, article_slug):
-	article = Article.objects.get(pk=pk)
-	if article_slug != article.slug:
-		return redirect(article,permanent=True)
-	return render(request,'news/article.html',{'article':article})
+	def build():
+		article = Article.objects.get(pk=pk)
+		if article_slug != article.slug:
+			return redirect(article,permanent=True)
+		return render(request,'news/article.html',{'article':article})
+	if request.method not in ('GET','HEAD'):
+		return build()
+	# 已由条件请求查询过，文章不存在或需要跳转时为None
+	update_time = article_state(request,pk,article_slug)
+	if update_time is None:
+		return build()
+	return cached_article_page(pk,article_slug,update_time,build)
+
+ 
+def get_search_results(request):
+	query = request.GET.get('q','').strip()[:100]
+	try:
+		page = int(request.GET.get('page',1))
+	except ValueError:
+		page = 1
+	return query,search_articles(query,page,SEARCH_PAGE_SIZE)
+ 
+def search(request):
+	query,results = get_search_results(request)
+	return render(request,'news/search.html',{'query':query,'results':results})
+ 
+def search_json(request):
+	query,results = get_search_results(request)
+	return JsonResponse({
+		'query':query,
+		'total':results['total'],
+		'page':results['page'],
+		'has_next':results['has_next'],
+		'results':[{
+			'id':item['article'].pk,
+			'title':item['article'].title,
+			'url':item['article'].get_absolute_url(),
+			'pub_date':item['article'].pub_date,
+			'score':item['score'],
+			'snippet':item['snippet'],
+		} for item in results['results']],
+	})